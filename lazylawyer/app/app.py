@@ -1,23 +1,34 @@
 import argparse
-from lazylawyer.database import table_docs, table_doc_contents, table_cases
+from lazylawyer.database import database as db
+from lazylawyer.database import embedding_store, table_docs, table_doc_contents
 from flask import Flask, render_template, request
+from markupsafe import escape, Markup
 from lazylawyer import helpers
 from lazylawyer.nlp.curia_preprocessor import preprocess
 from lazylawyer.nlp.curia_preprocessor import tokenize_and_process_metadata
 from lazylawyer.nlp import phrases
 from lazylawyer.nlp.helpers import get_embedding_doc_word2vec
 from lazylawyer.nlp.helpers import get_embedding_doc_lsi
-from lazylawyer.nlp.helpers import cosine_similarity
+from lazylawyer.nlp.helpers import cosine_similarities
 import gensim
 from itertools import chain
+import numpy as np
 import os
-import pickle
 from textwrap import shorten
 
 app = Flask(__name__)
 
 averaging_scheme = 'average'
 
+# markers around matched terms in full-text snippets, replaced by html tags
+HIGHLIGHT = ('\x02', '\x03')
+
+def highlight_snippet(snippet):
+    """Escapes a full-text snippet and highlights the matches.
+    """
+    snippet = str(escape(snippet))
+    return Markup(snippet.replace(HIGHLIGHT[0], '<mark>').replace(HIGHLIGHT[1], '</mark>'))
+
 @app.route('/')
 def hello():
     return render_template('index.html')
@@ -55,23 +66,47 @@ def search():
     else:
         query_emb = get_embedding_doc_word2vec(query_content, model, stopword_removal=True)
 
-    similarities = [cosine_similarity(query_emb, pickle.loads(doc['embedding'])) + sim_meta \
-        for doc, sim_meta in zip(docs, similarities_metadata)]
+    similarities = cosine_similarities(doc_embeddings, query_emb) + np.asarray(similarities_metadata)
+
+    # finally, add full-text matches scaled to [0, fulltext_weight]
+    matches = table_doc_contents.search_fulltext(search_query, limit=fulltext_limit)
+    max_score = max([match['score'] for match in matches], default=0)
+    for match in matches:
+        i = doc_indices.get(match['doc_id'])
+        if i is not None and max_score > 0:
+            similarities[i] += fulltext_weight * match['score'] / max_score
 
-    results = [{'link': doc['link'], 'name': doc['name'], 'abstract': abstract, 'similarity': sim} \
+    results = [{'link': doc['link'], 'name': doc['name'], 'content_id': doc['content_id'], 'abstract': abstract, 'similarity': sim} \
         for sim, doc, abstract in zip(similarities, docs, doc_abstracts)]
-    results = sorted(results, key=lambda x: x['similarity'], reverse=True)
+    results = sorted(results, key=lambda x: x['similarity'], reverse=True)[:50]
 
-    return render_template('search_results.html', results=results[:50])
+    # show snippets around the matches instead of the abstract
+    snippets = table_doc_contents.get_fulltext_snippets(search_query,
+        [result['content_id'] for result in results], highlight=HIGHLIGHT)
+    for result in results:
+        if result['content_id'] in snippets:
+            result['abstract'] = highlight_snippet(snippets[result['content_id']])
+
+    return render_template('search_results.html', results=results)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Launch flask web app.')
     parser.add_argument('model', choices=['word2vec', 'fasttext', 'fasttext_pretrained', 'doc2vec', 'lsi'], help='model for doc embeddings')
     parser.add_argument('model_path', help='model path')
     parser.add_argument('--num_words', type=int, default=1000000, help='vocabulary size')
+    parser.add_argument('--fulltext_weight', type=float, default=1.0, help='weight of full-text matches in the ranking')
+    parser.add_argument('--fulltext_limit', type=int, default=200, help='number of full-text matches to consider')
+    parser.add_argument('--read_only', action='store_true', help='open the database read-only')
+    parser.add_argument('--snapshot', nargs='?', const=helpers.setup_json['snapshot_path'],
+        help='serve from an immutable snapshot, see scripts/publish_snapshot.py')
 
     args = parser.parse_args()
 
+    if args.snapshot:
+        db.open_database(args.snapshot, immutable=True, attached=db.snapshot_attachments(args.snapshot))
+    elif args.read_only:
+        db.open_database(db.db_path, read_only=True, attached=db.manager.attached)
+
     if args.model == 'word2vec':
         print('Loading pretrained binary file...')
         model_path = os.path.join('trained_models', args.model_path)
@@ -99,18 +134,26 @@ if __name__ == '__main__':
     metadata_dictionary = gensim.corpora.Dictionary.load(metadata_path)
 
     print('Loading documents...')
-    docs = table_docs.get_docs_with_names(['Judgment'])
-    doc_contents = [table_doc_contents.get_doc_content(doc) for doc in docs]
+    docs = table_docs.get_docs_with_cases(['Judgment'], case_fields=['party1', 'party2', 'subject'])
+
+    print('Loading embeddings...')
+    embedding_ids, embeddings = embedding_store.load_embeddings(args.model.replace('_pretrained', ''))
+    rows = embedding_store.get_rows(embedding_ids, [doc['id'] for doc in docs])
+    docs = [doc for doc, row in zip(docs, rows) if row >= 0] # skip docs without embedding
+    doc_embeddings = embeddings[rows[rows >= 0]]
+    doc_indices = {doc['id']: i for i, doc in enumerate(docs)}
+    fulltext_weight = args.fulltext_weight
+    fulltext_limit = args.fulltext_limit
+
+    doc_contents = table_doc_contents.get_doc_contents(docs)
     doc_abstracts = [shorten(content, width=200) for content in doc_contents]
 
     # load metadata
     print('Loading metadata...')
-    cases = [table_cases.get_case_for_doc(doc) for doc in docs]
-
     keywords = [tokenize_and_process_metadata([doc['keywords']]) for doc in docs]
-    parties1 = [tokenize_and_process_metadata([case['party1']]) for case in cases]
-    parties2 = [tokenize_and_process_metadata([case['party2']]) for case in cases]
-    subjects = [tokenize_and_process_metadata([case['subject']]) for case in cases]
+    parties1 = [tokenize_and_process_metadata([doc['party1']]) for doc in docs]
+    parties2 = [tokenize_and_process_metadata([doc['party2']]) for doc in docs]
+    subjects = [tokenize_and_process_metadata([doc['subject']]) for doc in docs]
 
     docs_metadata = [k + p1 + p2 + s for k, p1, p2, s in zip(keywords, parties1, parties2, subjects)]
     docs_metadata = [set(metadata_dictionary.doc2idx(meta)) for meta in docs_metadata]
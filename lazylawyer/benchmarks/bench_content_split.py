@@ -0,0 +1,86 @@
+"""This benchmark measures metadata scans on a synthetic
+database which keeps document contents and legacy embedding
+BLOBs in the same file as cases and docs, and again after
+the contents were moved to an attached content database.
+Every scan runs on fresh connections, i.e. with an empty
+SQLite page cache.
+"""
+import argparse
+import base64
+from lazylawyer.database import database as db
+from lazylawyer.database import migrations, table_cases, table_doc_contents, table_docs
+import os
+import tempfile
+import time
+
+DOC_NAMES = ['Judgment', 'Order', 'Opinion']
+
+def fill_database(num_cases, content_size, embedding_size):
+    def _fill(connection):
+        for i in range(num_cases):
+            case_id = connection.execute("""INSERT INTO cases (name, desc, url, protocol, court)
+                VALUES (?, '', '', '', 'COJ')""", ('C-{0}/18'.format(i),)).lastrowid
+            # contents are written right after their docs, as the
+            # crawl pipeline does, so the pages are interleaved
+            for name in DOC_NAMES:
+                doc_id = connection.execute("""INSERT INTO docs (case_id, name, link, embedding)
+                    VALUES (?, ?, 'link', ?)""", (case_id, name, os.urandom(embedding_size))).lastrowid
+                content_id = connection.execute("""INSERT INTO doc_contents (content, doc_id)
+                    VALUES (?, ?)""", (base64.b64encode(os.urandom(content_size * 3 // 4)), doc_id)).lastrowid
+                connection.execute("""UPDATE docs SET content_id=? WHERE id=?""", (content_id, doc_id))
+    db.write(_fill)
+
+SCANS = [
+    ('get_all_cases', lambda: table_cases.get_all_cases()),
+    ('get_docs_with_names', lambda: table_docs.get_docs_with_names(['Judgment'])),
+    ('get_docs_with_cases', lambda: table_docs.get_docs_with_cases(['Judgment', 'Order'])),
+]
+
+def run_scans(path, attached, repetitions):
+    for name, scan in SCANS:
+        elapsed = 0
+        for _ in range(repetitions):
+            db.open_database(path, attached=attached)
+            start = time.perf_counter()
+            scan()
+            elapsed += time.perf_counter() - start
+        print('{0:<22} {1:>10.2f} ms'.format(name, elapsed / repetitions * 1000))
+
+def bench_content_split(num_cases, content_size, embedding_size, repetitions):
+    old_path = db.db_path
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'bench.db')
+        attached = {'content': (os.path.join(tmp_dir, 'bench_content.db'), db.CONTENT_PRAGMAS)}
+        db.open_database(path)
+        try:
+            migrations.migrate()
+            print('Creating {0} documents...'.format(num_cases * len(DOC_NAMES)))
+            fill_database(num_cases, content_size, embedding_size)
+            # split_content() builds the full-text index of the
+            # content database, so the single file gets one as well
+            table_doc_contents.rebuild_fulltext_index()
+
+            # nothing was deleted yet, and vacuuming would undo the
+            # interleaving of the pages
+            print('Single file ({0:.1f} MB):'.format(db.file_size() / 1e6))
+            run_scans(path, None, repetitions)
+
+            db.open_database(path, attached=attached)
+            migrations.split_content()
+            db.vacuum()
+            db.vacuum('content')
+            print('Split files ({0:.1f} MB metadata, {1:.1f} MB content):'.format(
+                db.file_size() / 1e6, db.file_size('content') / 1e6))
+            run_scans(path, attached, repetitions)
+        finally:
+            db.open_database(old_path, attached=db.configured_attachments())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark metadata scans before and after splitting off the contents.')
+    parser.add_argument('--num_cases', type=int, default=5000, help='number of synthetic cases')
+    parser.add_argument('--content_size', type=int, default=20000, help='size of each content in bytes')
+    parser.add_argument('--embedding_size', type=int, default=1200, help='size of each legacy embedding in bytes')
+    parser.add_argument('--repetitions', type=int, default=5, help='number of scans per query')
+
+    args = parser.parse_args()
+    bench_content_split(args.num_cases, args.content_size, args.embedding_size, args.repetitions)
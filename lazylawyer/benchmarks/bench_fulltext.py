@@ -0,0 +1,77 @@
+"""This benchmark compares phrase search with the full-text
+index to a linear scan over all document contents on a synthetic
+database. A linear scan is the only way to answer exact phrase
+queries without the index.
+"""
+import argparse
+from lazylawyer.database import database as db
+from lazylawyer.database import migrations, table_cases, table_docs, table_doc_contents
+import os
+import random
+import tempfile
+import time
+
+WORDS = ['court', 'article', 'regulation', 'directive', 'member', 'state', 'commission',
+    'appeal', 'judgment', 'treaty', 'competition', 'agreement', 'market', 'undertaking',
+    'tax', 'customs', 'goods', 'services', 'freedom', 'establishment', 'applicant', 'order']
+PHRASE = 'Article 101 TFEU'
+
+def fill_database(num_docs, doc_length):
+    cases = [{'name': 'C-{0}/18'.format(i), 'desc': '', 'url': '', 'protocol': '', 'court': 'COJ'}
+        for i in range(num_docs)]
+    table_cases.write_cases(cases)
+    for case in table_cases.get_all_cases():
+        table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'link'}])
+
+    num_matches = 0
+    for doc in table_docs.get_docs_with_names(['Judgment'], only_with_content=False):
+        words = random.choices(WORDS, k=doc_length)
+        if random.random() < 0.05:
+            words.insert(random.randrange(doc_length), PHRASE)
+            num_matches += 1
+        table_doc_contents.write_doc_content(doc, ' '.join(words))
+    return num_matches
+
+def linear_scan(phrase):
+    return [doc['id'] for doc, text in table_doc_contents.iter_docs_with_contents(['Judgment'], columns=['id'])
+        if phrase in text]
+
+def fulltext_search(phrase):
+    return [match['doc_id'] for match in table_doc_contents.search_fulltext('"' + phrase + '"', limit=-1)]
+
+def fulltext_search_with_snippets(phrase):
+    matches = table_doc_contents.search_fulltext('"' + phrase + '"', limit=50)
+    table_doc_contents.get_fulltext_snippets('"' + phrase + '"', [match['content_id'] for match in matches])
+    return matches
+
+def measure(func, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        result = func(PHRASE)
+    return (time.perf_counter() - start) / repetitions, len(result)
+
+def bench_fulltext(num_docs, doc_length, repetitions):
+    old_path = db.db_path
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.open_database(os.path.join(tmp_dir, 'bench.db'))
+        try:
+            migrations.migrate()
+            print('Creating {0} documents...'.format(num_docs))
+            num_matches = fill_database(num_docs, doc_length)
+            print('{0} documents contain "{1}"'.format(num_matches, PHRASE))
+
+            for name, func in [('linear scan', linear_scan), ('full-text index', fulltext_search),
+                    ('top 50 + snippets', fulltext_search_with_snippets)]:
+                elapsed, num_results = measure(func, repetitions)
+                print('{0:<18} {1:>10.2f} ms  {2} results'.format(name, elapsed * 1000, num_results))
+        finally:
+            db.open_database(old_path, attached=db.configured_attachments())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark phrase search with and without the full-text index.')
+    parser.add_argument('--num_docs', type=int, default=5000, help='number of synthetic documents')
+    parser.add_argument('--doc_length', type=int, default=2000, help='number of words per document')
+    parser.add_argument('--repetitions', type=int, default=5, help='number of searches per method')
+
+    args = parser.parse_args()
+    bench_fulltext(args.num_docs, args.doc_length, args.repetitions)
@@ -0,0 +1,175 @@
+"""This benchmark measures parsing the CURIA case index and a
+documents page, comparing the previous parsing (builtin parser,
+whole page, every row searched several times) to html.parser and
+lxml with SoupStrainer and single-pass rows. Saved copies of the
+pages can be given; otherwise synthetic pages are generated.
+Peak memory is measured with tracemalloc in a separate run, as
+tracing slows down parsing.
+"""
+import argparse
+from bs4 import BeautifulSoup
+from lazylawyer.crawlers import curia_cl_protocol
+import lazylawyer.crawlers.helpers
+import re
+import time
+import tracemalloc
+
+NAVIGATION = '<div class="menu"><ul>' + '<li><a href="#">Menu entry</a></li>' * 200 + '</ul></div>' \
+    + '<script>var x = "' + 'x' * 20000 + '";</script>'
+INDEX_ROW = """<tr><td><b><a href="javascript:window.open('https://curia.europa.eu/juris/liste.jsf?num=C-{0}/18', 'case');">C-{0}/18</a></b></td>
+    <td><i>Commission v Member State {0}{1}</i></td></tr>"""
+APPEAL = '<br><b>APPEAL : </b><a href="#">T-{0}/16</a>'
+DOC_ROW = """<tr class="table_document_ligne">
+    <td class="table_cell_doc">Judgment
+    </td><td class="table_cell_date">01/02/2018</td>
+    <td class="table_cell_nom_usuel">Commission v Germany</td>
+    <td class="table_cell_aff"><span class="outputEcli">ECLI:EU:C:2018:{0}</span></td>
+    <td class="table_cell_aff"><a href="eurlex{0}.pdf"><img title="View pdf documents"></a></td>
+    <td class="table_cell_links_eurlex"><a href="curia{0}.pdf"><img title="View pdf documents"></a></td>
+    <td class="table_cell_links_curia"><span class="tooltipLink">Competition</span></td>
+    </tr>"""
+
+def index_page(num_cases):
+    rows = [INDEX_ROW.format(i, APPEAL.format(i) if i % 10 == 0 else '') for i in range(num_cases)]
+    return '<html><body>{0}<table>{1}</table>{0}</body></html>'.format(NAVIGATION, ''.join(rows))
+
+def docs_page(num_docs):
+    rows = ''.join(DOC_ROW.format(i) for i in range(num_docs))
+    return '<html><body>{0}<table class="detail_table_documents"><tbody>{1}</tbody></table>{0}</body></html>' \
+        .format(NAVIGATION, rows)
+
+def baseline_crawl_cases(html):
+    # parsing of the case index before the fast path
+    case_rows = html.body.find_all('tr')
+    def parse_case(row):
+        try:
+            link = row.find('b').a
+            url = lazylawyer.crawlers.helpers.strip_js_window_open(link['href'])
+            name = link.text.strip()
+            desc = row.find('i').text.strip()
+            court = 'GC' if name.startswith('T') else 'COJ'
+            return {'url': url, 'name': name, 'desc': desc, 'court': court}
+        except (AttributeError, TypeError):
+            return None
+
+    def parse_appeal(row):
+        try:
+            link = row.find('b').a
+            name = link.text.strip()
+            appeal = row.find('i').find(string='APPEAL : ')
+            appeal = appeal.parent.find_next('a').text
+            return {'orig': name, 'appeal': appeal}
+        except (AttributeError, TypeError):
+            return None
+
+    cases_dict = [parse_case(r) for r in case_rows if parse_case(r) is not None]
+    appeals_dict = [parse_appeal(r) for r in case_rows if parse_appeal(r) is not None]
+    return cases_dict, appeals_dict
+
+def baseline_crawl_docs(html_doc, formats):
+    # parsing of the document rows before the fast path
+    def link_to_image(imgs_list):
+        try:
+            links = [x.parent['href'] for x in imgs_list]
+            return None if len(links) < 1 else links[0]
+        except KeyError:
+            return None
+
+    docs = []
+    for html_tr in curia_cl_protocol._doc_rows(html_doc):
+        name = html_tr.find('td', {'class': 'table_cell_doc'}).text.split('\n')[0]
+        ecli = html_tr.find('span', {'class': 'outputEcli'}).text
+        date = html_tr.find('td', {'class': 'table_cell_date'}).text
+        party1 = html_tr.find('td', {'class': 'table_cell_nom_usuel'}).text.strip()
+        parties = re.match(r'(.*) v (.*)', party1)
+        subject = html_tr.find('td', {'class': 'table_cell_links_curia'}).find('span', {'class': 'tooltipLink'}).text
+        doc = {'name': name, 'ecli': ecli, 'date': date, 'party1': parties.group(1),
+            'party2': parties.group(2), 'subject': subject}
+        for format in formats:
+            for source in ['curia', 'eurlex']:
+                if source == 'curia':
+                    td = html_tr.find('td', {'class': 'table_cell_links_eurlex'})
+                else:
+                    td = html_tr.find_all('td', {'class': 'table_cell_aff'})[1]
+                link = link_to_image(td.find_all('img', {'title': 'View {0} documents'.format(format)}))
+                if link is not None and 'link' not in doc:
+                    doc.update({'link': link, 'source': source, 'format': format})
+        docs.append(doc)
+    return docs
+
+def crawl_docs(html_doc, formats):
+    docs = []
+    for html_tr in curia_cl_protocol._doc_rows(html_doc):
+        cells = curia_cl_protocol._row_cells(html_tr)
+        doc = curia_cl_protocol._doc_fields(cells)
+        for format, source, link, _ in curia_cl_protocol._link_candidates(cells, formats):
+            doc.update({'link': link, 'source': source, 'format': format})
+            break
+        docs.append(doc)
+    return docs
+
+def measure(text, parser, parse_only, extract, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        html = BeautifulSoup(text, parser, parse_only=parse_only)
+    parse_time = (time.perf_counter() - start) / repetitions
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        result = extract(html)
+    extract_time = (time.perf_counter() - start) / repetitions
+    del html
+
+    tracemalloc.start()
+    html = BeautifulSoup(text, parser, parse_only=parse_only)
+    extract(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return parse_time, extract_time, peak, len(result[0]) if isinstance(result, tuple) else len(result)
+
+def run(name, text, variants, repetitions):
+    print('{0} ({1:.1f} MB):'.format(name, len(text) / 1e6))
+    for label, parser, parse_only, extract in variants:
+        parse_time, extract_time, peak, num_rows = measure(text, parser, parse_only, extract, repetitions)
+        print('  {0:<32} parse {1:>9.1f} ms  rows {2:>8.1f} ms  peak {3:>7.1f} MB  ({4} rows)'.format(
+            label, parse_time * 1000, extract_time * 1000, peak / 1e6, num_rows))
+
+def bench_html_parsing(index_file, docs_file, num_cases, num_docs, repetitions):
+    if index_file is None:
+        index_text = index_page(num_cases)
+    else:
+        with open(index_file, encoding='utf-8') as f:
+            index_text = f.read()
+    if docs_file is None:
+        docs_text = docs_page(num_docs)
+    else:
+        with open(docs_file, encoding='utf-8') as f:
+            docs_text = f.read()
+
+    parsers = ['html.parser']
+    if lazylawyer.crawlers.helpers.PARSER != 'html.parser':
+        parsers.append(lazylawyer.crawlers.helpers.PARSER)
+    else:
+        print('lxml is not installed, only html.parser is measured.')
+
+    index_variants = [('html.parser, whole page (before)', 'html.parser', None, baseline_crawl_cases)]
+    index_variants += [('{0}, strainer'.format(p), p, curia_cl_protocol.CASES_STRAINER,
+        curia_cl_protocol.crawl_cases) for p in parsers]
+    run('Case index', index_text, index_variants, repetitions)
+
+    formats = ['html', 'pdf']
+    docs_variants = [('html.parser, whole page (before)', 'html.parser', None,
+        lambda html: baseline_crawl_docs(html, formats))]
+    docs_variants += [('{0}, strainer'.format(p), p, curia_cl_protocol.DOCS_STRAINER,
+        lambda html: crawl_docs(html, formats)) for p in parsers]
+    run('Documents page', docs_text, docs_variants, repetitions * 10)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark parsing of CURIA pages before and after the fast path.')
+    parser.add_argument('--index_page', default=None, help='saved copy of the case index; synthetic if omitted')
+    parser.add_argument('--docs_page', default=None, help='saved copy of a documents page; synthetic if omitted')
+    parser.add_argument('--num_cases', type=int, default=5000, help='number of cases in the synthetic index')
+    parser.add_argument('--num_docs', type=int, default=30, help='number of documents on the synthetic page')
+    parser.add_argument('--repetitions', type=int, default=3, help='number of parses per page')
+
+    args = parser.parse_args()
+    bench_html_parsing(args.index_page, args.docs_page, args.num_cases, args.num_docs, args.repetitions)
@@ -0,0 +1,80 @@
+"""This benchmark builds a synthetic database and compares
+the hot lookup queries on the schema without indices (version 1)
+to the latest schema. For each query, the query plan and the
+average latency are printed.
+"""
+import argparse
+from lazylawyer.database import database as db
+from lazylawyer.database import migrations
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+QUERIES = [
+    ('get_docs_for_case', """SELECT * FROM docs WHERE case_id=? AND link IS NOT NULL""", lambda n: (random.randrange(n),)),
+    ('get_docs_with_names', """SELECT id FROM docs WHERE name IN (?) AND link IS NOT NULL""", lambda n: ('Judgment',)),
+    ('get_case_with_name', """SELECT * FROM cases WHERE name=?""", lambda n: ('C-{0}/18'.format(random.randrange(n)),)),
+    ('get_doc_content', """SELECT content FROM doc_contents WHERE doc_id=?""", lambda n: (random.randrange(n),)),
+]
+
+DOC_NAMES = ['Judgment', 'Order', 'Opinion', 'Application', 'Notice', 'Request']
+
+def fill_database(num_docs):
+    docs_per_case = len(DOC_NAMES)
+    num_cases = (num_docs + docs_per_case - 1) // docs_per_case
+    cases = [('C-{0}/18'.format(i), '', '', '', 'COJ') for i in range(num_cases)]
+    docs = [(i // docs_per_case + 1, DOC_NAMES[i % docs_per_case], 'link')
+        for i in range(num_docs)]
+    contents = [(b'text', i+1) for i in range(0, num_docs, 10)]
+
+    def _fill(connection):
+        connection.executemany("""INSERT INTO cases (name, desc, url, protocol, court)
+            VALUES (?, ?, ?, ?, ?)""", cases)
+        connection.executemany("""INSERT INTO docs (case_id, name, link) VALUES (?, ?, ?)""", docs)
+        connection.executemany("""INSERT INTO doc_contents (content, doc_id) VALUES (?, ?)""", contents)
+    db.write(_fill)
+    return num_cases
+
+def run_queries(num_cases, repetitions):
+    for name, s, params in QUERIES:
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            db.cursor.execute(s, params(num_cases))
+            db.cursor.fetchall()
+        elapsed = (time.perf_counter() - start) / repetitions
+
+        # cached EXPLAIN statements do not notice schema changes,
+        # so the plan is obtained on a fresh connection
+        connection = sqlite3.connect(db.db_path)
+        rows = connection.execute('EXPLAIN QUERY PLAN ' + s, params(num_cases)).fetchall()
+        plan = '; '.join(row[-1] for row in rows)
+        connection.close()
+
+        print('{0:<22} {1:>10.3f} ms  {2}'.format(name, elapsed * 1000, plan))
+
+def bench_indexes(num_docs, repetitions):
+    old_path = db.db_path
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.open_database(os.path.join(tmp_dir, 'bench.db'))
+        try:
+            migrations.migrate(target=1)
+            num_cases = fill_database(num_docs)
+
+            print('Schema version 1 (no indices):')
+            run_queries(num_cases, repetitions)
+
+            migrations.migrate()
+            print('Schema version {0}:'.format(migrations.get_version()))
+            run_queries(num_cases, repetitions)
+        finally:
+            db.open_database(old_path, attached=db.configured_attachments())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark lookups before and after adding indices.')
+    parser.add_argument('--num_docs', type=int, default=100000, help='number of synthetic documents')
+    parser.add_argument('--repetitions', type=int, default=20, help='number of executions per query')
+
+    args = parser.parse_args()
+    bench_indexes(args.num_docs, args.repetitions)
@@ -1,3 +1,4 @@
+from lazylawyer import helpers
 from lazylawyer.database import table_doc_contents
 from lazylawyer.nlp.curia_preprocessor import preprocess
 from lazylawyer.nlp import phrases
@@ -5,17 +6,22 @@ from lazylawyer.nlp import phrases
 class ContentGenerator:
     """Yields a document content generator based on the list of 
     documents. Yields in one iteration one document consisting of
-    sentences of words.
+    sentences of words. Contents are fetched from the database in
+    batches of batch_size documents.
     """
-    def __init__(self, docs):
+    def __init__(self, docs, batch_size=100):
         self.docs = docs
+        self.batch_size = batch_size
         self.doc_gen = None
 
     def __iter__(self):
-        self.doc_gen = (doc for doc in self.docs)
+        self.doc_gen = self._generate()
         return self
     
     def __next__(self):
-        doc = table_doc_contents.get_doc_content(next(self.doc_gen))
-        doc = preprocess(doc)
-        return doc
+        return next(self.doc_gen)
+
+    def _generate(self):
+        for batch in helpers.create_batches_generate(self.docs, self.batch_size):
+            for doc in table_doc_contents.get_doc_contents(batch):
+                yield preprocess(doc)
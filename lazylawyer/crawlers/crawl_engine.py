@@ -0,0 +1,87 @@
+"""Asynchronous crawl engine. A fixed number of requests is kept
+in flight over the whole list of cases, and results are handed
+to a callback as soon as a case is finished instead of waiting
+for a whole batch. Requests are made with the blocking
+http_client on a thread pool with one thread per request slot,
+so every slot keeps its own connections alive. HTML parsing runs
+on a separate thread, off the event loop. Pages are read through
+the http_cache. Requests wait for the limiter of their host before
+they take a thread, so a throttled host does not hold up requests
+to other hosts.
+"""
+import asyncio
+import concurrent.futures
+from lazylawyer import http_client
+from lazylawyer.crawlers import http_cache
+import lazylawyer.crawlers.helpers
+
+# returned by next() when the items are exhausted
+_END = object()
+
+class AsyncFetcher:
+    """Coroutine function fetching a page and returning its soup.
+    At most max_in_flight requests run at the same time. An optional
+    SoupStrainer restricts parsing, see helpers.parse_html().
+    """
+    def __init__(self, io_executor, parse_executor, max_in_flight):
+        self.io_executor = io_executor
+        self.parse_executor = parse_executor
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def __call__(self, url, parse_only=None):
+        loop = asyncio.get_running_loop()
+        if not http_cache.offline:
+            await http_client.host_limiter(url).wait_async()
+        async with self.semaphore:
+            text = await loop.run_in_executor(self.io_executor, http_cache.get_text, url)
+        return await loop.run_in_executor(self.parse_executor,
+            lazylawyer.crawlers.helpers.parse_html, text, parse_only)
+
+async def _crawl(items, crawl_item, on_result, on_error, max_in_flight, num_parsers):
+    loop = asyncio.get_running_loop()
+    items = iter(items)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as io_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=num_parsers) as parse_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as item_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as result_executor:
+        fetch = AsyncFetcher(io_executor, parse_executor, max_in_flight)
+        pending_results = []
+
+        async def worker():
+            # items are taken from the shared iterator until it is
+            # exhausted, on one thread, as taking an item may block,
+            # e.g. to lease cases from the database
+            while True:
+                item = await loop.run_in_executor(item_executor, next, items, _END)
+                if item is _END:
+                    return
+                try:
+                    result = await crawl_item(item, fetch)
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    pending_results.append(loop.run_in_executor(result_executor, on_error, item, e))
+                    continue
+                # results are handled in order on one thread, so
+                # that blocking database writes do not stall the loop
+                pending_results.append(loop.run_in_executor(result_executor, on_result, item, result))
+
+        await asyncio.gather(*[worker() for _ in range(max_in_flight)])
+        await asyncio.gather(*pending_results)
+
+def crawl(items, crawl_item, on_result, on_error=None, max_in_flight=10, num_parsers=1):
+    """Crawls items concurrently and blocks until all are done.
+    Input params:
+    items: iterable of items to crawl, e.g. cases. Items are taken
+    from it on a separate thread, so it may block.
+    crawl_item: coroutine function crawl_item(item, fetch) returning
+    the result for an item; fetch(url, parse_only=None) is a coroutine
+    returning the soup of a page.
+    on_result: function on_result(item, result) called for each item
+    as soon as it is crawled, on a separate thread.
+    on_error: function on_error(item, exception) called instead of
+    on_result if crawling an item fails. If None, the crawl is aborted.
+    max_in_flight: maximum number of concurrent requests.
+    num_parsers: number of threads parsing HTML.
+    """
+    asyncio.run(_crawl(items, crawl_item, on_result, on_error, max_in_flight, num_parsers))
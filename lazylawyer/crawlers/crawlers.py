@@ -1,3 +1,4 @@
+import asyncio
 from bs4 import BeautifulSoup
 import lazylawyer.helpers
 import lazylawyer.crawlers.helpers
@@ -18,8 +19,8 @@ class CURIACrawler:
         cases_dict = []
         appeals_dict = []
         for link in self.eu_case_law_links:
-            html = lazylawyer.crawlers.helpers.crawl(link['url'])
             protocol = lazylawyer.helpers.import_by_name(link['protocol'])
+            html = lazylawyer.crawlers.helpers.crawl(link['url'], protocol.CASES_STRAINER)
             cases, appeals = protocol.crawl_cases(html)
             if num_cases > 0:
                 cases = cases[:num_cases]
@@ -32,7 +33,15 @@ class CURIACrawler:
         
         return cases_dict, appeals_dict
 
-    def crawl_case_docs(self, case, formats):
+    def crawl_case_docs(self, case, formats, doc_filter=None):
+        """Crawl individual cases from the case directory. Like
+        crawl_case_docs_async, but the pages are retrieved one
+        after the other.
+        """
+        return asyncio.run(self.crawl_case_docs_async(case, formats,
+            lazylawyer.crawlers.helpers.crawl_async, doc_filter))
+
+    async def crawl_case_docs_async(self, case, formats, fetch, doc_filter=None):
         """Crawl individual cases from the case directory.
         Requires the case dictionary to be already loaded either
         by calling ecj_cases_to_json() or load_ecj_cases_json().
@@ -40,15 +49,19 @@ class CURIACrawler:
         Input params:
         case: case for which to crawl documents.
         formats: formats of docs to download (pdf, html).
+        fetch: coroutine fetch(url) which returns the soup of
+        a page, see crawl_engine.AsyncFetcher.
+        doc_filter: if given, the pages of documents for which
+        doc_filter(doc) returns False are not fetched.
         """
         match = re.search('.*/(\d+)', case['name'])
         year = lazylawyer.crawlers.helpers.to_full_year(match.group(1))
 
         if year > 1997:
             protocol = lazylawyer.helpers.import_by_name(case['protocol'])
-            html = lazylawyer.crawlers.helpers.crawl(case['url'])
+            html = await fetch(case['url'], protocol.CASE_STRAINER)
 
-            docs = protocol.crawl_docs(html, formats)
+            docs = await protocol.crawl_docs_async(html, formats, fetch, doc_filter)
             return docs
         else:
             return None
@@ -1,27 +1,57 @@
+import asyncio
+from bs4 import SoupStrainer
 from contextlib import suppress
 import lazylawyer.helpers
 import lazylawyer.crawlers.helpers
 import itertools
 import re
 
-def _link_to_image(imgs_list):
-    try:
-        links = [x.parent['href'] for x in imgs_list]
-        link =  None if len(links) < 1 else links[0]
-    except KeyError:
-        link = None
-    return link
-
-def _crawl_doc(html_tr, formats):
-    """Process one doc.
+# Parts of the pages which are parsed. Everything else, e.g.
+# navigation and scripts, is skipped by the parser.
+CASES_STRAINER = SoupStrainer('tr')
+CASE_STRAINER = SoupStrainer('a', {'id': 'mainForm:j_id56'})
+DOCS_STRAINER = SoupStrainer('table', {'class': 'detail_table_documents'})
+DOC_PAGE_STRAINER = SoupStrainer('a', {'id': 'mainForm:j_id159'})
+
+def _row_cells(html_tr):
+    """Returns the cells of a row as a dictionary mapping
+    css classes to lists of cells, so that a row is only
+    searched once.
+    """
+    cells = {}
+    for td in html_tr.find_all('td'):
+        for css_class in td.get('class', ()):
+            cells.setdefault(css_class, []).append(td)
+    return cells
+
+def _cell(cells, css_class, index=0):
+    tds = cells.get(css_class, ())
+    return tds[index] if len(tds) > index else None
+
+def _image_links(td):
+    """Returns a dictionary mapping the titles of the images in
+    a cell to the links around them, the first one for each title.
+    """
+    links = {}
+    if td is not None:
+        for img in td.find_all('img', title=True):
+            links.setdefault(img['title'], img.parent.get('href'))
+    return links
+
+def _doc_fields(cells):
+    """Returns the metadata of the document in a row.
     """
-    name = html_tr.find('td', {'class': 'table_cell_doc'})
+    name = _cell(cells, 'table_cell_doc')
     name = None if name is None else name.text.split('\n')[0]
-    ecli = html_tr.find('span', {'class': 'outputEcli'})
-    ecli = None if ecli is None else ecli.text
-    date = html_tr.find('td', {'class': 'table_cell_date'})
+    ecli = None
+    for td in cells.get('table_cell_aff', ()):
+        ecli = td.find('span', {'class': 'outputEcli'})
+        if ecli is not None:
+            ecli = ecli.text
+            break
+    date = _cell(cells, 'table_cell_date')
     date = None if date is None else date.text
-    party1 = html_tr.find('td', {'class': 'table_cell_nom_usuel'})
+    party1 = _cell(cells, 'table_cell_nom_usuel')
     party1 = None if party1 is None else party1.text.strip()
     party2 = None
     if party1 is not None:
@@ -30,89 +60,118 @@ def _crawl_doc(html_tr, formats):
             party1 = parties.group(1)
             party2 = parties.group(2)
 
-    subject = html_tr.find('td', {'class': 'table_cell_links_curia'}).find('span', {'class': 'tooltipLink'})
+    subject = _cell(cells, 'table_cell_links_curia')
+    subject = None if subject is None else subject.find('span', {'class': 'tooltipLink'})
     subject = None if subject is None else subject.text
 
-    source = None
-    format = None
-    sources = ['curia', 'eurlex']
-    for fs in itertools.product(formats, sources):
+    return {'name': name, 'ecli': ecli, 'date': date, 
+        'party1': party1, 'party2': party2, 'subject': subject, 'link': None,
+        'source': None, 'format': None}
+
+def _link_candidates(cells, formats):
+    """Yields (format, source, url, is_page) for the links to
+    the document in a row in order of preference. If is_page is
+    True, url leads to a page with the link to the document, see
+    _link_from_doc_page().
+    """
+    links = {'curia': _image_links(_cell(cells, 'table_cell_links_eurlex')),
+        'eurlex': _image_links(_cell(cells, 'table_cell_aff', 1))}
+    for fs in itertools.product(formats, ['curia', 'eurlex']):
         # Try to get documents in the formats given. First format
         # in the list gets precedence over the second etc.
         # Similarly, the hardcoded sources are scanned from first to last.
-        link = None
-        if (fs[0] == 'pdf'):
-            if (fs[1] == 'curia'):
-                links_curia = html_tr.find('td', {'class': 'table_cell_links_eurlex'}) \
-                    .find_all('img', {'title': 'View pdf documents'})
-                link = _link_to_image(links_curia)
-            elif (fs[1] == 'eurlex'):
-                links_eurlex = html_tr.find_all('td', {'class': 'table_cell_aff'})[1] \
-                    .find_all('img', {'title': 'View pdf documents'})
-                link = _link_to_image(links_eurlex)
-
-        elif (fs[0] == 'html'):
-            if (fs[1] == 'curia'):
-                links_curia = html_tr.find('td', {'class': 'table_cell_links_eurlex'}) \
-                    .find_all('img', {'title': 'View html documents'})
-                doc_url = _link_to_image(links_curia)
-                if doc_url is not None: # if a document exists
-                    with suppress(Exception): # if we fail, we might as well search further
-                        html_doc = lazylawyer.crawlers.helpers.crawl(doc_url)
-                        link = html_doc.find('a', {'id': 'mainForm:j_id159'})['href']
-
-            elif (fs[1] == 'eurlex'):
-                links_eurlex = html_tr.find_all('td', {'class': 'table_cell_aff'})[1] \
-                    .find_all('img', {'title': 'View html documents'})
-                link = _link_to_image(links_eurlex)
-                
+        if fs[0] not in ('pdf', 'html'):
+            continue
+        link = links[fs[1]].get('View {0} documents'.format(fs[0]))
+        # html documents on curia are linked from a separate page
+        is_page = fs == ('html', 'curia')
+        if link is not None:
+            yield fs[0], fs[1], link, is_page
+
+def _link_from_doc_page(html_doc):
+    # the page is parsed with DOC_PAGE_STRAINER
+    return html_doc.find('a', {'id': 'mainForm:j_id159'})['href']
+
+async def _crawl_doc(html_tr, formats, fetch, doc_filter=None):
+    """Process one doc. If doc_filter(doc) returns False for
+    the fields of the row, the document page is not fetched.
+    """
+    cells = _row_cells(html_tr)
+    doc = _doc_fields(cells)
+    for format, source, link, is_page in _link_candidates(cells, formats):
+        if is_page:
+            page_url, link = link, None
+            if doc_filter is not None and not doc_filter(doc):
+                continue
+            with suppress(Exception): # if we fail, we might as well search further
+                link = _link_from_doc_page(await fetch(page_url, DOC_PAGE_STRAINER))
         if link is not None: # stop iterating if we found a link to the document
-            format = fs[0]
-            source = fs[1]
+            doc.update({'link': link, 'source': source, 'format': format})
             break
+    return doc
 
-    return {'name': name, 'ecli': ecli, 'date': date, 
-        'party1': party1, 'party2': party2, 'subject': subject, 'link': link,
-        'source': source, 'format': format}
+def _parse_index_row(row):
+    """Returns the case and the appeal in a row of the case
+    index; each is None if the row does not contain one.
+    """
+    bold = row.find('b')
+    link = None if bold is None else bold.a
+    desc = row.find('i')
+    if link is None or desc is None or not link.has_attr('href'):
+        return None, None
+
+    name = link.text.strip()
+    url = lazylawyer.crawlers.helpers.strip_js_window_open(link['href'])
+    court = 'GC' if name.startswith('T') else 'COJ'
+    case = {'url': url, 'name': name, 'desc': desc.text.strip(), 'court': court}
+
+    appeal = desc.find(string='APPEAL : ')
+    appeal = None if appeal is None else appeal.parent.find_next('a')
+    appeal = None if appeal is None else {'orig': name, 'appeal': appeal.text}
+    return case, appeal
 
 def crawl_cases(html):
-    case_rows = html.body.find_all('tr')
-    def parse_case(row):
-        try:
-            link = row.find('b').a
-            url = lazylawyer.crawlers.helpers.strip_js_window_open(link['href'])
-            name = link.text.strip()
-            desc = row.find('i').text.strip()
-            court = 'GC' if name.startswith('T') else 'COJ'
-            return {'url': url, 'name': name, 'desc': desc, 'court': court}
-        except (AttributeError, TypeError):
-            return None
-
-    def parse_appeal(row):
-        try:
-            link = row.find('b').a
-            name = link.text.strip()
-            appeal = row.find('i').find(text='APPEAL : ')
-            appeal = appeal.parent.findNext('a').text
-            return {'orig': name, 'appeal': appeal}
-        except (AttributeError, TypeError):
-            return None
-
-    cases_dict = [parse_case(r) for r in case_rows if parse_case(r) is not None]
-    appeals_dict = [parse_appeal(r) for r in case_rows if parse_appeal(r) is not None]
+    """Returns the cases and appeals in the case index. The
+    index may be parsed with CASES_STRAINER.
+    """
+    cases_dict = []
+    appeals_dict = []
+    for row in html.find_all('tr'):
+        case, appeal = _parse_index_row(row)
+        if case is not None:
+            cases_dict.append(case)
+        if appeal is not None:
+            appeals_dict.append(appeal)
     return cases_dict, appeals_dict
 
-def crawl_docs(html, formats):
-    """Crawl docs for a specific case.
-    """
-    doc_url = html.find('a', {'id': 'mainForm:j_id56'})
-    doc_url = doc_url['href']
-    html_doc = lazylawyer.crawlers.helpers.crawl(doc_url)
+def _doc_rows(html_doc):
     try:
-        all_docs_html = html_doc.find('table', {'class': 'detail_table_documents'}) \
+        return html_doc.find('table', {'class': 'detail_table_documents'}) \
             .find('tbody').find_all('tr', {'class': 'table_document_ligne'})
     except AttributeError:
         return None
 
-    all_docs = [_crawl_doc(x, formats) for x in all_docs_html]
-    return all_docs
+def crawl_docs(html, formats, doc_filter=None):
+    """Crawl docs for a specific case. Like crawl_docs_async,
+    but the pages are retrieved one after the other.
+    """
+    return asyncio.run(crawl_docs_async(html, formats, lazylawyer.crawlers.helpers.crawl_async, doc_filter))
+
+async def crawl_docs_async(html, formats, fetch, doc_filter=None):
+    """Crawl docs for a specific case. Pages are retrieved
+    with the coroutine fetch(url), which returns their soup.
+    The pages of all documents are fetched concurrently.
+    Input params:
+    doc_filter: if given, the pages of documents for which
+    doc_filter(doc) returns False are not fetched; documents
+    with a direct link are returned anyway.
+    """
+    doc_url = html.find('a', {'id': 'mainForm:j_id56'})
+    doc_url = doc_url['href']
+    html_doc = await fetch(doc_url, DOCS_STRAINER)
+    all_docs_html = _doc_rows(html_doc)
+    if all_docs_html is None:
+        return None
+
+    all_docs = await asyncio.gather(*[_crawl_doc(x, formats, fetch, doc_filter) for x in all_docs_html])
+    return list(all_docs)
@@ -1,21 +1,41 @@
 from bs4 import BeautifulSoup
-import requests
+from lazylawyer import http_client
+from lazylawyer.crawlers import http_cache
 
-def crawl(url):
-    """Crawl a specific url and return the soup.
+try:
+    import lxml
+    PARSER = 'lxml'
+except ImportError:
+    # lxml is optional, the builtin parser is several times slower
+    PARSER = 'html.parser'
+
+def parse_html(text, parse_only=None):
+    """Parses a page and returns the soup.
+    Input params:
+    parse_only: SoupStrainer selecting the elements to keep; other
+    parts of the page are skipped, which saves time and memory.
+    """
+    return BeautifulSoup(text, PARSER, parse_only=parse_only)
+
+def crawl(url, parse_only=None):
+    """Crawl a specific url and return the soup. Pages
+    are served from the cache if they are unchanged.
+    See parse_html() for parse_only.
     """
-    req = requests.get(url)
-    req.encoding = 'utf-8' # force utf-8 encoding
-    soup = BeautifulSoup(req.text, 'html.parser')
+    soup = parse_html(http_cache.get_text(url), parse_only)
     return soup
 
+async def crawl_async(url, parse_only=None):
+    """Coroutine version of crawl(), to be passed as fetch to
+    the asynchronous crawlers. The page is retrieved on the
+    calling thread, so pages are crawled one after the other.
+    """
+    return crawl(url, parse_only)
+
 def download_file(url, filename):
-    response = requests.get(url)
-    if response.status_code == requests.codes.ok:
-        with open(filename, 'wb') as file:
-            file.write(response.content)
-    else:
-        response.raise_for_status()
+    """Downloads a file and returns the hash of its content.
+    """
+    return http_client.download(url, filename)
 
 def strip_js_window_open(js):
     """Strips the javascript window.open function from 
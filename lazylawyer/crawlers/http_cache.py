@@ -0,0 +1,102 @@
+"""Persistent cache of crawled pages. Bodies are stored zlib
+compressed together with their ETag and Last-Modified headers,
+one file per URL in the http_cache_dir folder. Cached pages are
+revalidated with conditional requests, so unchanged pages are not
+transferred again. In offline mode, pages are only read from the
+cache, which allows re-running the parsers without network access.
+"""
+from lazylawyer import helpers, http_client
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+# if True, pages are only read from the cache
+offline = False
+
+class CacheMiss(KeyError):
+    """Raised in offline mode for pages which are not cached.
+    """
+
+_stats = {'fetched': 0, 'not_modified': 0, 'offline': 0, 'bytes_saved': 0}
+_stats_lock = threading.Lock()
+
+def set_offline(value):
+    """Switches offline mode on or off.
+    """
+    global offline
+    offline = value
+
+def _path(url):
+    hash = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(helpers.setup_json['http_cache_dir'], hash[:2], hash + '.cache')
+
+def _read(url):
+    path = _path(url)
+    if not os.path.exists(path):
+        return None, None
+    with open(path, 'rb') as f:
+        meta = json.loads(f.readline())
+        body = zlib.decompress(f.read())
+    return meta, body
+
+def _write(url, meta, body):
+    path = _path(url)
+    helpers.create_folder_if_not_exists(os.path.dirname(path))
+    tmp_path = '{0}.{1}.tmp'.format(path, threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(meta).encode() + b'\n')
+        f.write(zlib.compress(body))
+    os.replace(tmp_path, path)
+
+def _count(key, num_bytes=0):
+    with _stats_lock:
+        _stats[key] += 1
+        _stats['bytes_saved'] += num_bytes
+
+def get(url):
+    """Returns the body of a page as bytes, from the cache if it
+    is unchanged. Only successful responses are cached; for others,
+    HTTPError is raised. In offline mode, CacheMiss is raised for
+    pages which are not cached.
+    """
+    meta, body = _read(url)
+    if offline:
+        if meta is None:
+            raise CacheMiss(url)
+        _count('offline', len(body))
+        return body
+
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    response = http_client.get(url, headers=headers)
+    if response.status_code == 304 and meta is not None:
+        _count('not_modified', len(body))
+        return body
+
+    response.raise_for_status()
+    meta = {'url': url, 'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'), 'fetched': time.time()}
+    _write(url, meta, response.content)
+    _count('fetched')
+    return response.content
+
+def get_text(url):
+    """Returns the body of a page decoded as utf-8, see get().
+    """
+    return get(url).decode('utf-8', errors='replace')
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def stats_summary():
+    stats = get_stats()
+    return 'Pages: {0} fetched, {1} not modified, {2} offline ({3:.1f} MB not transferred)'.format(
+        stats['fetched'], stats['not_modified'], stats['offline'], stats['bytes_saved'] / 1e6)
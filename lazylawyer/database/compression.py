@@ -0,0 +1,130 @@
+"""Compression of document contents. Every row in doc_contents
+carries a codec tag so that rows written with different codecs
+can be read side by side:
+NULL: uncompressed UTF-8 text (rows written by older versions),
+'zlib', 'lzma': compressed with the respective standard module,
+'zstd': compressed with zstandard,
+'zstd:<id>': compressed with zstandard and the shared dictionary
+<id> from the compression_dicts table.
+zstandard is optional; without it, zstd is replaced by zlib when
+writing and zstd rows cannot be read.
+"""
+from lazylawyer.database import database as db
+import lzma
+import threading
+import warnings
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ['raw', 'zlib', 'lzma', 'zstd']
+# zstd level used unless content_zstd_level is set in setup.json;
+# higher levels are much slower and compress only slightly better
+DEFAULT_ZSTD_LEVEL = 6
+
+_dicts = {}
+# id of the latest dictionary by database path
+_latest_dict_ids = {}
+_dicts_lock = threading.Lock()
+
+def _get_dict(dict_id):
+    key = (db.db_path, dict_id)
+    with _dicts_lock:
+        if key not in _dicts:
+            # use a separate cursor, since this may be called from
+            # within a query through the decompress_content function
+            s = """SELECT dict FROM compression_dicts WHERE id=?"""
+            row = db.manager.read_connection().execute(s, (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError('Unknown compression dictionary {0}'.format(dict_id))
+            _dicts[key] = zstandard.ZstdCompressionDict(row[0])
+        return _dicts[key]
+
+def get_latest_dict_id():
+    """Returns the id of the most recently trained
+    dictionary or None if there is none. The id is cached,
+    so dictionaries trained by other processes are only used
+    after a restart.
+    """
+    with _dicts_lock:
+        if db.db_path not in _latest_dict_ids:
+            db.cursor.execute("""SELECT MAX(id) FROM compression_dicts""")
+            _latest_dict_ids[db.db_path] = db.cursor.fetchone()[0]
+        return _latest_dict_ids[db.db_path]
+
+def resolve_codec(codec):
+    """Returns the codec tag new rows are written with for
+    the given codec name. zstd uses the latest dictionary
+    if one was trained.
+    """
+    if codec not in CODECS:
+        raise ValueError('Unsupported codec {0}'.format(codec))
+    if codec == 'raw':
+        return None
+    if codec == 'zstd':
+        if zstandard is None:
+            warnings.warn('zstandard is not installed, falling back to zlib')
+            return 'zlib'
+        dict_id = get_latest_dict_id()
+        return 'zstd' if dict_id is None else 'zstd:{0}'.format(dict_id)
+    return codec
+
+def compress(text, tag, zstd_level=DEFAULT_ZSTD_LEVEL):
+    """Compresses text with the codec given by tag
+    and returns the bytes to store.
+    Input params:
+    zstd_level: compression level of zstd, from 1 to 22.
+    """
+    data = text.encode()
+    if tag is None:
+        return data
+    elif tag == 'zlib':
+        return zlib.compress(data, 9)
+    elif tag == 'lzma':
+        return lzma.compress(data)
+    elif tag == 'zstd':
+        return zstandard.ZstdCompressor(level=zstd_level).compress(data)
+    elif tag.startswith('zstd:'):
+        zstd_dict = _get_dict(int(tag[5:]))
+        return zstandard.ZstdCompressor(level=zstd_level, dict_data=zstd_dict).compress(data)
+    raise ValueError('Unsupported codec {0}'.format(tag))
+
+def decompress(data, tag):
+    """Decompresses stored bytes written with the codec
+    given by tag and returns the text.
+    """
+    if tag is None:
+        # earlier versions stored the text itself
+        return data if isinstance(data, str) else bytes(data).decode()
+    elif tag == 'zlib':
+        data = zlib.decompress(data)
+    elif tag == 'lzma':
+        data = lzma.decompress(data)
+    elif tag == 'zstd':
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif tag.startswith('zstd:'):
+        zstd_dict = _get_dict(int(tag[5:]))
+        data = zstandard.ZstdDecompressor(dict_data=zstd_dict).decompress(data)
+    else:
+        raise ValueError('Unsupported codec {0}'.format(tag))
+    return data.decode()
+
+# allows reading contents in SQL, e.g. for the full-text index
+db.register_function('decompress_content', 2, decompress)
+
+def train_dict(samples, dict_size=112640):
+    """Trains a shared zstd dictionary on sample texts, stores
+    it in the database and returns its id.
+    """
+    if zstandard is None:
+        raise RuntimeError('Training a dictionary requires zstandard')
+    zstd_dict = zstandard.train_dictionary(dict_size, [s.encode() for s in samples])
+
+    s = """INSERT INTO compression_dicts (dict) VALUES (?)"""
+    dict_id = db.write(lambda connection: connection.execute(s, (zstd_dict.as_bytes(),)).lastrowid)
+    with _dicts_lock:
+        _latest_dict_ids.pop(db.db_path, None)
+    return dict_id
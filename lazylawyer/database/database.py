@@ -1,97 +1,593 @@
-"""Database interface. The database is made
-thread-safe by locking the cursor. Therefore it
-is safe to call database functions from multiple
-threads at once.
+"""Database interface. Every thread reads through its
+own connection, while all writes are funneled through a
+single writer thread which groups them into transactions.
+The database runs in WAL mode, so readers never block on
+the writer. Therefore it is safe to call database functions
+from multiple threads at once.
+For serving, a database can be opened read-only, and a
+snapshot published with publish_snapshot() can be opened
+as immutable, which skips all locking.
+Document contents can be kept in a separate file, which is
+attached to every connection as the content schema (see
+content_db_path in setup.json), so that scans of the small
+metadata tables do not compete with large BLOBs for cache.
+All statements can be timed with query_stats.
 """
 import atexit
+from concurrent.futures import Future
 from lazylawyer import helpers
+from lazylawyer.database import query_stats
+import os
+import queue
 import sqlite3
+import sys
 import threading
+import time
+from urllib.request import pathname2url
 
-class ThreadSafeCursor:
-    _lock = threading.Lock()
+# pragmas applied to every connection; the journal mode
+# is persistent and only needs to be set once per file
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'cache_size': -64000, # in KiB, i.e. 64 MB
+    'mmap_size': 268435456, # 256 MB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000, # in ms
+}
+
+# pragmas for read-only connections; nothing is written,
+# so a larger share of the file can be memory-mapped
+READ_ONLY_PRAGMAS = {
+    'cache_size': -64000, # in KiB, i.e. 64 MB
+    'mmap_size': 4294967296, # 4 GB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000, # in ms
+    'query_only': 'ON',
+}
+
+# pragmas for the attached content database; large pages
+# reduce overflow chains for the BLOBs, and contents are
+# mostly read once, so they get a smaller cache. The page
+# size only takes effect when the file is created.
+CONTENT_PRAGMAS = {
+    'page_size': 16384,
+    'synchronous': 'NORMAL',
+    'cache_size': -16000, # in KiB, i.e. 16 MB
+    'mmap_size': 268435456, # 256 MB
+}
+
+# SQL functions available on every connection, see register_function()
+_functions = {}
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor which reports its statements and fetched rows
+    to query_stats if statistics are enabled.
+    """
+    _stats_query = None
+
+    def execute(self, sql, parameters=()):
+        stats = query_stats.current
+        if stats is None:
+            return super().execute(sql, parameters)
+        if self._stats_query is not None:
+            stats.finished(self, 0)
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        stats.executed(self, sql, parameters, time.perf_counter() - start)
+        return self
 
-    def __init__(self, connection):
-        self._cursor = connection.cursor()
+    def executemany(self, sql, seq_of_parameters):
+        stats = query_stats.current
+        if stats is None:
+            return super().executemany(sql, seq_of_parameters)
+        if self._stats_query is not None:
+            stats.finished(self, 0)
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        stats.executed(self, sql, seq_of_parameters[0] if seq_of_parameters else (),
+            time.perf_counter() - start)
+        return self
+
+    def fetchone(self):
+        stats = query_stats.current
+        if stats is None:
+            return super().fetchone()
+        start = time.perf_counter()
+        row = super().fetchone()
+        stats.fetched(self, time.perf_counter() - start, int(row is not None), row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        stats = query_stats.current
+        size = self.arraysize if size is None else size
+        if stats is None:
+            return super().fetchmany(size)
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        stats.fetched(self, time.perf_counter() - start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        stats = query_stats.current
+        if stats is None:
+            return super().fetchall()
+        start = time.perf_counter()
+        rows = super().fetchall()
+        stats.fetched(self, time.perf_counter() - start, len(rows), True)
+        return rows
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors are InstrumentedCursors,
+    including those created by execute() and executemany().
+    """
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class ConnectionManager:
+    """Hands out one read connection per thread and owns a
+    dedicated writer thread. Write jobs are queued and the writer
+    executes all jobs waiting in the queue (up to write_batch_size)
+    inside one transaction. Every job runs in its own savepoint, so
+    a failing job does not roll back the others.
+    Input params:
+    db_path: path to the sqlite database file.
+    pragmas: dictionary of pragmas applied to each connection.
+    write_batch_size: maximum number of jobs per transaction.
+    read_only: open the database with mode=ro, writes raise
+    an error.
+    immutable: additionally promise that the file never changes
+    while it is open, so SQLite skips locking and change
+    detection. Only use this for published snapshots.
+    attached: dictionary mapping schema names to (path, pragmas)
+    of databases which are attached to every connection. Their
+    tables can be used without schema prefix if the names are
+    unique. Note that transactions are atomic per file only.
+    """
+    def __init__(self, db_path, pragmas=None, write_batch_size=256,
+            read_only=False, immutable=False, attached=None):
+        self.db_path = db_path
+        self.read_only = read_only or immutable
+        self.immutable = immutable
+        if pragmas is None:
+            pragmas = READ_ONLY_PRAGMAS if self.read_only else DEFAULT_PRAGMAS
+        self.pragmas = pragmas
+        self.write_batch_size = write_batch_size
+        self.attached = {} if attached is None else attached
+
+        self._local = threading.local()
+        self._readers = [] # (thread, connection) pairs
+        self._readers_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
+
+        if not self.read_only:
+            connection = self._connect()
+            for schema in ['main'] + list(self.attached):
+                connection.execute('PRAGMA {0}.journal_mode=WAL'.format(schema))
+            connection.close()
+
+    def _uri(self, path):
+        uri = 'file:{0}?mode=ro'.format(pathname2url(os.path.abspath(path)))
+        if self.immutable:
+            uri += '&immutable=1'
+        return uri
+
+    def _connect(self):
+        if self.read_only:
+            connection = sqlite3.connect(self._uri(self.db_path), uri=True,
+                isolation_level=None, check_same_thread=False,
+                factory=InstrumentedConnection)
+        else:
+            connection = sqlite3.connect(self.db_path, isolation_level=None,
+                check_same_thread=False, factory=InstrumentedConnection)
+        for name, value in self.pragmas.items():
+            connection.execute('PRAGMA {0}={1}'.format(name, value))
+        for schema, (path, pragmas) in self.attached.items():
+            path = self._uri(path) if self.read_only else path
+            connection.execute('ATTACH DATABASE ? AS {0}'.format(schema), (path,))
+            for name, value in pragmas.items():
+                connection.execute('PRAGMA {0}.{1}={2}'.format(schema, name, value))
+        return connection
+
+    def _register_functions(self, connection, registered):
+        """Registers functions which were added since the
+        connection was last checked. Returns the number of
+        registered functions.
+        """
+        if registered < len(_functions):
+            # deterministic functions can be used in indices and
+            # are optimized better, but the flag needs Python 3.8
+            kwargs = {'deterministic': True} if sys.version_info >= (3, 8) else {}
+            for name, (num_params, func) in list(_functions.items())[registered:]:
+                connection.create_function(name, num_params, func, **kwargs)
+        return len(_functions)
+
+    def read_connection(self):
+        """Returns the read connection of the calling thread.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._closed:
+                raise sqlite3.ProgrammingError('Database is closed')
+            connection = self._connect()
+            self._local.connection = connection
+            self._local.functions = 0
+            with self._readers_lock:
+                # close connections of threads which have finished
+                alive = []
+                for thread, conn in self._readers:
+                    if thread.is_alive():
+                        alive.append((thread, conn))
+                    else:
+                        conn.close()
+                alive.append((threading.current_thread(), connection))
+                self._readers = alive
+        self._local.functions = self._register_functions(connection, self._local.functions)
+        return connection
+
+    def read_cursor(self):
+        """Returns a cursor on the read connection of the
+        calling thread.
+        """
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self.read_connection().cursor()
+            self._local.cursor = cursor
+        return cursor
+
+    def submit(self, func):
+        """Queues func(connection) for execution on the writer
+        thread and returns a Future with its result.
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError('Database is closed')
+        if self.read_only:
+            raise sqlite3.OperationalError('Database is opened read-only')
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop,
+                    name='db-writer', daemon=True)
+                self._writer.start()
+        future = Future()
+        self._queue.put((func, future, time.perf_counter()))
+        return future
+
+    def write(self, func):
+        """Executes func(connection) on the writer thread inside
+        a transaction and waits until it is committed. Returns the
+        result of func.
+        """
+        return self.submit(func).result()
+
+    def _write_loop(self):
+        connection = self._connect()
+        functions = 0
+        stop = False
+        while not stop:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            jobs = [job]
+            while len(jobs) < self.write_batch_size:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                jobs.append(job)
+
+            functions = self._register_functions(connection, functions)
+            self._run_jobs(connection, jobs)
+        connection.close()
+
+    def _run_jobs(self, connection, jobs):
+        results = []
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for func, future, submitted in jobs:
+                connection.execute('SAVEPOINT job')
+                stats = query_stats.current
+                if stats is not None:
+                    # the first statement of the job is charged with
+                    # the time the job waited for the writer
+                    stats.set_wait(time.perf_counter() - submitted)
+                try:
+                    result = func(connection)
+                except BaseException as e:
+                    connection.execute('ROLLBACK TO job')
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                connection.execute('RELEASE job')
+            connection.execute('COMMIT')
+        except BaseException as e:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            for _, future, _ in jobs:
+                future.set_exception(e)
+            return
+
+        for future, result, exception in results:
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
+
+    def close(self):
+        """Waits for pending writes and closes all connections.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+        with self._readers_lock:
+            for _, connection in self._readers:
+                connection.close()
+            self._readers = []
+
+class ThreadSafeCursor:
+    """Cursor which dispatches to the read connection of the
+    calling thread. Statements executed through it should only
+    read; writes go through write().
+    """
+    def _cursor(self):
+        return manager.read_cursor()
 
     def execute(self, str, *params):
-        with ThreadSafeCursor._lock:
-            result = self._cursor.execute(str, *params)
-        return result
+        return self._cursor().execute(str, *params)
 
     def executemany(self, str, seq_of_params):
-        with ThreadSafeCursor._lock:
-            result = self._cursor.executemany(str, seq_of_params)
-        return result
+        return self._cursor().executemany(str, seq_of_params)
 
     def fetchone(self):
-        with ThreadSafeCursor._lock:
-            result = self._cursor.fetchone()
-        return result
+        return self._cursor().fetchone()
 
     def fetchall(self):
-        with ThreadSafeCursor._lock:
-            result = self._cursor.fetchall()
-        return result
+        return self._cursor().fetchall()
+
+class BufferedWriter:
+    """Collects single-row write statements and flushes them
+    in one transaction, running consecutive executions of the
+    same statement with executemany. A flush happens when
+    flush_size statements are pending, flush_interval seconds
+    after the first pending statement was added, and when
+    leaving the with block. The writer can be shared between
+    threads; flushes are serialized, so batches are written in
+    the order of their statements. If a flush started by the
+    timer fails, its exception is raised by the next call of
+    execute() or flush(), or when leaving the with block.
+    Input params:
+    flush_size: maximum number of pending statements.
+    flush_interval: maximum delay in seconds before pending
+    statements are written.
+    """
+    def __init__(self, flush_size=500, flush_interval=5.0):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._groups = [] # [statement, list of params] in order
+        self._num_pending = 0
+        self._timer = None
+        self._error = None # exception of a failed timer flush
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def _raise_error(self):
+        # has to be called with self._lock held
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _timer_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            with self._lock:
+                self._error = e
+
+    def execute(self, str, params):
+        """Adds a statement to the buffer.
+        """
+        with self._lock:
+            self._raise_error()
+            if self._groups and self._groups[-1][0] == str:
+                self._groups[-1][1].append(params)
+            else:
+                self._groups.append([str, [params]])
+            self._num_pending += 1
+            full = self._num_pending >= self.flush_size
+            if not full and self._timer is None and self.flush_interval is not None:
+                self._timer = threading.Timer(self.flush_interval, self._timer_flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes all pending statements in one transaction.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._raise_error()
+                groups = self._groups
+                self._groups = []
+                self._num_pending = 0
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not groups:
+                return
+
+            def _flush(connection):
+                for str, seq_of_params in groups:
+                    connection.executemany(str, seq_of_params)
+            write(_flush)
 
-    def lastrowid(self):
-        return self._cursor.lastrowid
+def register_function(name, num_params, func):
+    """Makes a Python function available in SQL statements
+    on all connections, including already opened ones.
+    Functions must be deterministic.
+    """
+    if name not in _functions:
+        _functions[name] = (num_params, func)
+
+def configured_attachments():
+    """Returns the databases to attach according to setup.json,
+    in the format of the attached parameter of ConnectionManager.
+    """
+    content_db_path = helpers.setup_json.get('content_db_path')
+    if not content_db_path:
+        return {}
+    return {'content': (content_db_path, CONTENT_PRAGMAS)}
+
+def open_database(path, **kwargs):
+    """Closes the current database and opens the database
+    at path instead. Keyword arguments are passed on to
+    ConnectionManager; no databases are attached unless
+    given with attached.
+    """
+    global manager
+    global db_path
+    manager.close()
+    db_path = path
+    manager = ConnectionManager(db_path, **kwargs)
+
+def vacuum(schema='main'):
+    """Rebuilds the database file to give the space of
+    deleted or shrunk rows back to the file system.
+    Input params:
+    schema: main or the name of an attached database.
+    """
+    connection = manager._connect()
+    connection.execute('VACUUM {0}'.format(schema))
+    # in WAL mode, the file only shrinks at a checkpoint
+    connection.execute('PRAGMA {0}.wal_checkpoint(TRUNCATE)'.format(schema))
+    connection.close()
+
+def file_size(schema='main'):
+    """Returns the size of the file of a database in bytes. The
+    write-ahead log is checkpointed first, and whatever remains
+    in it is counted as well.
+    Input params:
+    schema: main or the name of an attached database.
+    """
+    path = db_path if schema == 'main' else manager.attached[schema][0]
+    connection = manager._connect()
+    connection.execute('PRAGMA {0}.wal_checkpoint(TRUNCATE)'.format(schema))
+    connection.close()
+    size = os.path.getsize(path)
+    if os.path.exists(path + '-wal'):
+        size += os.path.getsize(path + '-wal')
+    return size
+
+def snapshot_path(path, schema):
+    """Returns the path of the snapshot file of an attached
+    database, given the path of the snapshot of the main
+    database.
+    """
+    root, ext = os.path.splitext(path)
+    return '{0}_{1}{2}'.format(root, schema, ext)
+
+def snapshot_attachments(path):
+    """Returns the attached databases of the snapshot at path,
+    in the format of the attached parameter of ConnectionManager.
+    """
+    return {schema: (snapshot_path(path, schema), pragmas)
+        for schema, (_, pragmas) in manager.attached.items()}
+
+def publish_snapshot(path):
+    """Copies a consistent snapshot of the database to path
+    with the SQLite backup API. Attached databases are copied
+    from the same read transaction to snapshot_path(path, schema).
+    Writers are not blocked while the copy is made. The snapshot
+    uses a rollback journal instead of WAL, so it can be opened
+    as immutable, and it replaces existing files atomically.
+    """
+    paths = {'main': path}
+    for schema in manager.attached:
+        paths[schema] = snapshot_path(path, schema)
+    for target_path in paths.values():
+        if os.path.exists(target_path + '.tmp'):
+            os.remove(target_path + '.tmp')
+
+    source = manager._connect()
+    try:
+        # read from all schemas to pin one snapshot of every file
+        source.execute('BEGIN')
+        for schema in paths:
+            source.execute('SELECT COUNT(*) FROM {0}.sqlite_master'.format(schema))
+        for schema, target_path in paths.items():
+            target = sqlite3.connect(target_path + '.tmp', isolation_level=None)
+            try:
+                source.backup(target, name=schema)
+                target.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                target.close()
+        source.execute('COMMIT')
+    finally:
+        source.close()
+    for target_path in paths.values():
+        os.replace(target_path + '.tmp', target_path)
+
+def write(func):
+    """Executes func(connection) in a write transaction
+    and returns its result.
+    """
+    return manager.write(func)
+
+def execute_write(str, params, writer=None):
+    """Executes a single write statement. If a BufferedWriter
+    is given, the statement is added to its buffer instead.
+    """
+    if writer is None:
+        write(lambda connection: connection.execute(str, params))
+    else:
+        writer.execute(str, params)
+
+# collect statement statistics if configured; enabled before
+# close() is registered, so the summary includes the final writes
+if helpers.setup_json['query_stats']['enabled']:
+    query_stats.enable(helpers.setup_json['query_stats']['slow_query_ms'],
+        helpers.setup_json['query_stats']['slow_query_log'])
 
 # initialize database connection
 db_path = helpers.setup_json['db_path']
-connection = sqlite3.connect(db_path, check_same_thread=False)
-cursor = ThreadSafeCursor(connection)
+manager = ConnectionManager(db_path, attached=configured_attachments())
+cursor = ThreadSafeCursor()
 
 def close():
-    """Closes database connection. This method gets
+    """Closes database connections. This method gets
     called automatically at program exit.
     """
-    connection.close()
+    manager.close()
 atexit.register(close)
 
-def _get_non_existing_entries(batch, table, attrs):
-    """For a batch of values, check if those
-    values already exist in the table based on 
-    specific attributes attrs. Returns all entries
-    that are non-existent in the database.
-    """
-    conditions = []
-    for attr in attrs:
-        batchvals = [x[attr] for x in batch]
-        cond = attr + ' IN ('
-        cond +=  ','.join('"{0}"'.format(b) for b in batchvals)
-        cond += ')'
-        conditions.append(cond)
-
-    s = 'SELECT '
-    s += ','.join(attrs)
-    s += ' FROM '
-    s += table
-    s += ' WHERE '
-    s += ' AND '.join(conditions)
-    cursor.execute(s)
-    existing_batch = cursor.fetchall()
-    existing_batch = [dict(zip(attrs, x)) for x in existing_batch]
-
-    # exclude batch items in existing_batch
-    def _cmp_lists_dict(new, existing, attrs):
-        """Compare two lists of dicts based on 'attrs' keys.
-        """
-        result = []
-        for n in new:
-            n_attr = {k: v for k, v in n.items() if k in attrs}
-            if n_attr not in existing:
-                result.append(n)
-        return result
-
-    batch = _cmp_lists_dict(batch, existing_batch, attrs)
-    return batch
-
-def _insert_batch(batch, table):
-    """Insert one batch of data into a table.
+def _insert_batch(batch, table, attrs):
+    """Insert one batch of data into a table in a single
+    transaction. Rows conflicting with existing rows on the
+    unique attributes attrs are skipped.
     """
-    cols = batch[0].keys()
-    batchvals = [tuple(x.values()) for x in batch]
+    cols = list(batch[0].keys())
+    batchvals = [tuple(x[col] for col in cols) for x in batch]
     placeholder = '?'
     placeholderlist = ",".join([placeholder] * len(cols))
 
@@ -100,84 +596,127 @@ def _insert_batch(batch, table):
     s += '(' + ','.join(cols) + ')'
     s += ' VALUES'
     s += '(' + placeholderlist + ')'
-    cursor.executemany(s, batchvals)
-    connection.commit()
+    s += ' ON CONFLICT(' + ','.join(attrs) + ') DO NOTHING'
+    write(lambda connection: connection.executemany(s, batchvals))
 
-def batch_insert_check(table, vals, attrs, batch_size=100):
+def batch_upsert(table, vals, attrs, batch_size=100):
     """Process vals in batches of a specific batch size
-    and insert them into a table. Also perform a check to
-    verify if data is already in the database based on the attributes
-    (columns) defined in attrs.
-    """
-    batches = list(helpers.create_batches_generate(vals, batch_size))
-    for batch in batches:
-        batch = _get_non_existing_entries(batch, table, attrs)
-        if len(batch) > 0:
-            _insert_batch(batch, table)
-
-def _convert_to_cases_dict(db_rows):
-    cases = [{'id': x[0], 'name': x[1], 'desc': x[2],
-        'url': x[3], 'protocol': x[4], 'court': x[5], 'subject': x[6],
-        'party1': x[7], 'party2': x[8]} for x in db_rows]
-    return cases
-
-def _convert_to_docs_dict(db_rows):
-    docs = [{'id': x[0], 'case_id': x[1], 'name': x[2], 'ecli': x[3], 'date': x[4],
-            'link': x[5], 'source': x[6], 'format': x[7], 'content_id': x[8],
-            'download_error': x[9], 'embedding': x[10], 'keywords': x[11]} for x in db_rows]
-    return docs
-
-def _convert_to_appeals_dict(db_rows):
-    appeals = [{'id': x[0], 'orig_case_id': x[1], 'appeal_case_id': x[2]} for x in db_rows]
-    return appeals
-
-def create_tables(remove_old=False):
-    if remove_old:
-        cursor.execute("""DROP TABLE IF EXISTS cases""")
-        cursor.execute("""DROP TABLE IF EXISTS docs""")
-
-    # download_error column indicates if there was an error downloading docs for 
-    # the case. If 0, no problem, of 1, problem. If NULL, no download attempts yet.
-    cursor.execute("""CREATE TABLE IF NOT EXISTS cases(
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        desc TEXT NOT NULL, 
-        url TEXT NOT NULL,
-        protocol TEXT NOT NULL,
-        court TEXT,
-        subject TEXT,
-        party1 TEXT,
-        party2 TEXT,
-        CHECK (court IN ("COJ", "GC"))
-        )""") 
-    cursor.execute("""CREATE TABLE IF NOT EXISTS docs(
-        id INTEGER PRIMARY KEY,
-        case_id INTEGER NOT NULL,
-        name TEXT,
-        ecli TEXT,
-        date TEXT, 
-        link TEXT,
-        source TEXT,
-        format TEXT,
-        content_id INTEGER,
-        download_error INTEGER,
-        embedding BLOB,
-        keywords TEXT,
-        FOREIGN KEY (case_id) REFERENCES cases(id),
-        FOREIGN KEY (content_id) REFERENCES doc_contents(id)
-        )""")
-    cursor.execute("""CREATE TABLE IF NOT EXISTS doc_contents(
-        id INTEGER PRIMARY KEY,
-        content BLOB NOT NULL,
-        doc_id INTEGER NOT NULL,
-        FOREIGN KEY (doc_id) REFERENCES docs(id)
-        )""")
-    cursor.execute("""CREATE TABLE IF NOT EXISTS appeals(
-        id INTEGER PRIMARY KEY,
-        orig_case_id INTEGER NOT NULL,
-        appeal_case_id INTEGER NOT NULL,
-        FOREIGN KEY (orig_case_id) REFERENCES cases(id),
-        FOREIGN KEY (appeal_case_id) REFERENCES cases(id)
-        )""")
-
-    connection.commit()
+    and insert them into a table. Rows which already exist
+    in the database based on the attributes (columns) defined
+    in attrs are skipped. A unique index on attrs is required.
+    """
+    for batch in helpers.create_batches_generate(vals, batch_size):
+        _insert_batch(batch, table, attrs)
+
+# columns returned by default; docs.embedding is no longer used
+CASE_COLUMNS = ['id', 'name', 'desc', 'url', 'protocol', 'court', 'subject', 'party1', 'party2']
+DOC_COLUMNS = ['id', 'case_id', 'name', 'ecli', 'date', 'link', 'source', 'format',
+    'content_id', 'download_error', 'keywords', 'file_hash']
+APPEAL_COLUMNS = ['id', 'orig_case_id', 'appeal_case_id']
+FRONTIER_COLUMNS = ['case_id', 'state', 'attempts', 'last_error', 'worker', 'lease_expires',
+    'skipped_pages']
+
+class Record:
+    """Lightweight row object. Values can be accessed both as
+    attributes (row.name) and as items (row['name']), so records
+    can be used wherever row dictionaries were used before.
+    Subclasses are created by record_type().
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def items(self):
+        return list(zip(self.__slots__, self.values()))
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and self.items() == other.items()
+
+    def __repr__(self):
+        return 'Record({0})'.format(', '.join('{0}={1!r}'.format(k, v) for k, v in self.items()))
+
+_record_types = {}
+
+def record_type(columns):
+    """Returns the record class with the given columns.
+    Classes are cached, so each column list creates only
+    one class.
+    """
+    columns = tuple(columns)
+    if columns not in _record_types:
+        _record_types[columns] = type('Record', (Record,), {'__slots__': columns})
+    return _record_types[columns]
+
+def to_records(columns, rows):
+    """Converts database rows to records with the given columns.
+    """
+    cls = record_type(columns)
+    return [cls(*row) for row in rows]
+
+def iterate_rows(str, params, arraysize=1000):
+    """Executes a query and yields its rows. Rows are fetched
+    in chunks of arraysize, so arbitrarily large results can be
+    processed in constant memory. The query runs on its own
+    connection, whose read transaction lasts until the iteration
+    ends, so other queries of the thread still see new writes.
+    The WAL file cannot be checkpointed past the start of the
+    iteration, so it grows with the writes made meanwhile.
+    """
+    connection = manager._connect()
+    manager._register_functions(connection, 0)
+    cursor = connection.cursor()
+    cursor.arraysize = arraysize
+    try:
+        cursor.execute(str, params)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+        connection.close()
+
+def iterate_records(str, params, columns, arraysize=1000):
+    """Same as iterate_rows but yields records with the
+    given columns.
+    """
+    cls = record_type(columns)
+    for row in iterate_rows(str, params, arraysize):
+        yield cls(*row)
+
+def select_columns(columns, allowed):
+    """Returns the column list of a SELECT statement after
+    checking that all columns are allowed.
+    """
+    unknown = set(columns) - set(allowed)
+    if unknown:
+        raise ValueError('Unknown columns: {0}'.format(', '.join(sorted(unknown))))
+    return ','.join(columns)
@@ -0,0 +1,81 @@
+"""Storage of document embeddings. The embeddings of each model
+are kept as one contiguous float32 matrix in a .npy file together
+with a sorted array of the corresponding document ids. The matrix
+can therefore be memory-mapped as a whole instead of unpickling
+every embedding separately.
+"""
+from lazylawyer import helpers
+import numpy as np
+import os
+
+def _paths(model):
+    folder = helpers.setup_json['embeddings_dir']
+    return (os.path.join(folder, model + '.npy'),
+        os.path.join(folder, model + '_ids.npy'))
+
+def _save_atomic(path, array):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def has_embeddings(model):
+    """Returns True if embeddings for the model are stored.
+    """
+    matrix_path, ids_path = _paths(model)
+    return os.path.exists(matrix_path) and os.path.exists(ids_path)
+
+def write_embeddings(model, doc_ids, embeddings, replace=False):
+    """Stores embeddings for a model.
+    Input params:
+    model: name of the model, e.g. word2vec or lsi.
+    doc_ids: list of document ids.
+    embeddings: list or 2D array of embeddings in the same order.
+    replace: if True, existing embeddings of the model are discarded.
+    Otherwise, they are merged with the new ones.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape[0] != doc_ids.shape[0]:
+        raise ValueError('Expected one embedding per document id')
+
+    if not replace and has_embeddings(model):
+        old_ids, old_embeddings = load_embeddings(model)
+        keep = ~np.isin(old_ids, doc_ids)
+        doc_ids = np.concatenate([old_ids[keep], doc_ids])
+        embeddings = np.concatenate([old_embeddings[keep], embeddings])
+
+    # keep the ids sorted so that rows can be found by bisection
+    doc_ids, unique = np.unique(doc_ids[::-1], return_index=True)
+    embeddings = embeddings[::-1][unique]
+
+    helpers.create_folder_if_not_exists(helpers.setup_json['embeddings_dir'])
+    matrix_path, ids_path = _paths(model)
+    _save_atomic(matrix_path, np.ascontiguousarray(embeddings))
+    _save_atomic(ids_path, doc_ids)
+
+def load_embeddings(model):
+    """Returns the sorted document ids and the embedding
+    matrix of a model. The matrix is memory-mapped read-only,
+    so no data is copied until it is accessed.
+    """
+    matrix_path, ids_path = _paths(model)
+    doc_ids = np.load(ids_path)
+    embeddings = np.load(matrix_path, mmap_mode='r')
+    if embeddings.shape[0] != doc_ids.shape[0]:
+        raise ValueError('Embedding store of model {0} is inconsistent'.format(model))
+    return doc_ids, embeddings
+
+def get_rows(stored_ids, doc_ids):
+    """Maps document ids to rows of the embedding matrix.
+    Returns -1 for documents without an embedding.
+    Input params:
+    stored_ids: sorted ids returned by load_embeddings.
+    doc_ids: document ids to look up.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    if len(stored_ids) == 0:
+        return np.full(len(doc_ids), -1)
+    rows = np.searchsorted(stored_ids, doc_ids)
+    rows = np.minimum(rows, len(stored_ids) - 1)
+    return np.where(stored_ids[rows] == doc_ids, rows, -1)
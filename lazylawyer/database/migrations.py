@@ -0,0 +1,290 @@
+"""Schema migrations. The schema version of the database
+is stored in its user_version pragma. Each migration step
+upgrades the schema by one version in place, so existing
+data is kept. If a content database is attached, the
+document contents and their full-text index are created
+there; split_content() moves them out of an existing
+main database.
+"""
+from lazylawyer.database import compression # registers decompress_content for the full-text index
+from lazylawyer.database import database as db
+from lazylawyer.database import table_doc_contents
+
+def _schemas(connection):
+    return [row[1] for row in connection.execute("""PRAGMA database_list""") if row[1] != 'temp']
+
+def _content_schema(connection):
+    """Returns the schema which holds the document contents: the
+    main database as long as it has a doc_contents table, i.e.
+    until split_content() moved it, otherwise the content database
+    if it is attached.
+    """
+    s = """SELECT 1 FROM main.sqlite_master WHERE type='table' AND name='doc_contents'"""
+    if 'content' in _schemas(connection) and connection.execute(s).fetchone() is None:
+        return 'content'
+    return 'main'
+
+def _create_tables(connection, schema=None):
+    # download_error column indicates if there was an error downloading docs for 
+    # the case. If 0, no problem, of 1, problem. If NULL, no download attempts yet.
+    connection.execute("""CREATE TABLE IF NOT EXISTS cases(
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        desc TEXT NOT NULL, 
+        url TEXT NOT NULL,
+        protocol TEXT NOT NULL,
+        court TEXT,
+        subject TEXT,
+        party1 TEXT,
+        party2 TEXT,
+        CHECK (court IN ("COJ", "GC"))
+        )""") 
+    connection.execute("""CREATE TABLE IF NOT EXISTS docs(
+        id INTEGER PRIMARY KEY,
+        case_id INTEGER NOT NULL,
+        name TEXT,
+        ecli TEXT,
+        date TEXT, 
+        link TEXT,
+        source TEXT,
+        format TEXT,
+        content_id INTEGER,
+        download_error INTEGER,
+        embedding BLOB,
+        keywords TEXT,
+        FOREIGN KEY (case_id) REFERENCES cases(id),
+        FOREIGN KEY (content_id) REFERENCES doc_contents(id)
+        )""")
+    connection.execute("""CREATE TABLE IF NOT EXISTS {0}.doc_contents(
+        id INTEGER PRIMARY KEY,
+        content BLOB NOT NULL,
+        doc_id INTEGER NOT NULL,
+        FOREIGN KEY (doc_id) REFERENCES docs(id)
+        )""".format(schema or _content_schema(connection)))
+    connection.execute("""CREATE TABLE IF NOT EXISTS appeals(
+        id INTEGER PRIMARY KEY,
+        orig_case_id INTEGER NOT NULL,
+        appeal_case_id INTEGER NOT NULL,
+        FOREIGN KEY (orig_case_id) REFERENCES cases(id),
+        FOREIGN KEY (appeal_case_id) REFERENCES cases(id)
+        )""")
+
+def _create_unique_indices(connection):
+    """Creates unique indices on the natural keys of the tables.
+    Duplicates left over from earlier versions are removed first,
+    keeping the oldest row and pointing references to it. Of
+    duplicate docs, the oldest one with content, or else with a
+    download status, is kept.
+    """
+    duplicate_cases = """SELECT c1.id FROM cases c1 JOIN cases c2
+        ON c1.name=c2.name AND c1.id>c2.id"""
+    first_case = """SELECT MIN(c2.id) FROM cases c1 JOIN cases c2
+        ON c1.name=c2.name WHERE c1.id={0}"""
+    for table, col in [('docs', 'case_id'), ('appeals', 'orig_case_id'), ('appeals', 'appeal_case_id')]:
+        connection.execute("""UPDATE {0} SET {1}=({2}) WHERE {1} IN ({3})""".format(
+            table, col, first_case.format(table + '.' + col), duplicate_cases))
+    connection.execute("""DELETE FROM cases WHERE id NOT IN
+        (SELECT MIN(id) FROM cases GROUP BY name)""")
+    connection.execute("""CREATE TEMP TABLE removed_docs AS SELECT id, (SELECT d2.id FROM docs d2
+        WHERE d2.case_id=docs.case_id AND d2.name=docs.name
+        ORDER BY d2.content_id IS NULL, d2.download_error IS NULL, d2.id LIMIT 1) AS kept_id
+        FROM docs WHERE name IS NOT NULL""")
+    connection.execute("""DELETE FROM removed_docs WHERE id=kept_id""")
+    # contents of removed docs are dropped unless a kept doc uses them
+    connection.execute("""DELETE FROM doc_contents WHERE doc_id IN (SELECT id FROM removed_docs)
+        AND id NOT IN (SELECT content_id FROM docs WHERE content_id IS NOT NULL
+        AND id NOT IN (SELECT id FROM removed_docs))""")
+    connection.execute("""UPDATE doc_contents SET doc_id=(SELECT kept_id FROM removed_docs
+        WHERE removed_docs.id=doc_contents.doc_id) WHERE doc_id IN (SELECT id FROM removed_docs)""")
+    connection.execute("""DELETE FROM docs WHERE id IN (SELECT id FROM removed_docs)""")
+    connection.execute("""DROP TABLE removed_docs""")
+    connection.execute("""DELETE FROM appeals WHERE id NOT IN
+        (SELECT MIN(id) FROM appeals GROUP BY orig_case_id, appeal_case_id)""")
+
+    connection.execute("""CREATE UNIQUE INDEX IF NOT EXISTS cases_name
+        ON cases(name)""")
+    connection.execute("""CREATE UNIQUE INDEX IF NOT EXISTS docs_case_id_name
+        ON docs(case_id, name)""")
+    connection.execute("""CREATE UNIQUE INDEX IF NOT EXISTS appeals_orig_appeal
+        ON appeals(orig_case_id, appeal_case_id)""")
+
+def _create_lookup_indices(connection, schema=None):
+    """Creates indices for the most frequent lookups. Lookups
+    of cases by name and of docs by case_id are already served
+    by the unique indices.
+    """
+    connection.execute("""CREATE INDEX IF NOT EXISTS docs_name
+        ON docs(name)""")
+    connection.execute("""CREATE INDEX IF NOT EXISTS {0}.doc_contents_doc_id
+        ON doc_contents(doc_id)""".format(schema or _content_schema(connection)))
+
+def _add_content_codec(connection, schema=None):
+    """Adds the codec tag to doc_contents and a table for
+    shared compression dictionaries. Existing rows keep a NULL
+    codec, i.e. uncompressed text.
+    """
+    connection.execute("""ALTER TABLE {0}.doc_contents ADD COLUMN codec TEXT""".format(
+        schema or _content_schema(connection)))
+    connection.execute("""CREATE TABLE IF NOT EXISTS compression_dicts(
+        id INTEGER PRIMARY KEY,
+        dict BLOB NOT NULL
+        )""")
+
+def _create_fulltext_index(connection, schema=None):
+    """Creates an FTS5 full-text index over the document contents.
+    The index does not store the text itself; it reads it through
+    the doc_contents_text view, which decompresses the contents, so
+    the decompress_content function has to be registered. New
+    contents are added to the index when they are written.
+    """
+    schema = schema or _content_schema(connection)
+    connection.execute("""CREATE VIEW IF NOT EXISTS {0}.doc_contents_text AS
+        SELECT id, decompress_content(content, codec) AS content FROM doc_contents""".format(schema))
+    connection.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS {0}.doc_contents_fts USING fts5(
+        content, content='doc_contents_text', content_rowid='id', tokenize='porter unicode61'
+        )""".format(schema))
+    connection.execute("""INSERT INTO {0}.doc_contents_fts(doc_contents_fts) VALUES('rebuild')""".format(schema))
+
+def _add_content_hashes(connection):
+    """Adds the hash of the downloaded file to docs and the hash
+    of the text to doc_contents, so identical payloads can share
+    one content. Text hashes of existing contents are computed
+    here; file hashes are added when documents are extracted.
+    Docs are indexed by link to find files downloaded before.
+    """
+    schema = _content_schema(connection)
+    connection.execute("""ALTER TABLE docs ADD COLUMN file_hash TEXT""")
+    connection.execute("""ALTER TABLE {0}.doc_contents ADD COLUMN text_hash TEXT""".format(schema))
+
+    last_id = -1
+    while True:
+        s = """SELECT id, content, codec FROM {0}.doc_contents WHERE id>?
+            ORDER BY id LIMIT 100""".format(schema)
+        rows = connection.execute(s, (last_id,)).fetchall()
+        if not rows:
+            break
+        hashes = [(table_doc_contents.text_hash(compression.decompress(content, codec)), id)
+            for id, content, codec in rows]
+        s = """UPDATE {0}.doc_contents SET text_hash=? WHERE id=?""".format(schema)
+        connection.executemany(s, hashes)
+        last_id = rows[-1][0]
+
+    connection.execute("""CREATE INDEX IF NOT EXISTS docs_file_hash
+        ON docs(file_hash)""")
+    connection.execute("""CREATE INDEX IF NOT EXISTS docs_link
+        ON docs(link)""")
+    connection.execute("""CREATE INDEX IF NOT EXISTS {0}.doc_contents_text_hash
+        ON doc_contents(text_hash)""".format(schema))
+
+def _create_crawl_frontier(connection):
+    """Creates the crawl frontier, which records the crawl state
+    of every case, see table_crawl_frontier. Cases which already
+    have docs are marked as done, all others as pending.
+    """
+    connection.execute("""CREATE TABLE IF NOT EXISTS crawl_frontier(
+        case_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        worker TEXT,
+        lease_expires REAL,
+        FOREIGN KEY (case_id) REFERENCES cases(id),
+        CHECK (state IN ('pending', 'leased', 'done', 'failed'))
+        )""")
+    connection.execute("""CREATE INDEX IF NOT EXISTS crawl_frontier_state
+        ON crawl_frontier(state, case_id)""")
+    connection.execute("""INSERT OR IGNORE INTO crawl_frontier (case_id, state)
+        SELECT id, CASE WHEN EXISTS (SELECT 1 FROM docs WHERE docs.case_id=cases.id)
+        THEN 'done' ELSE 'pending' END FROM cases""")
+
+def _add_skipped_pages(connection):
+    """Adds the number of document pages which the download
+    policy skipped to the crawl frontier, so that these cases
+    can be crawled again when the policy is widened.
+    """
+    connection.execute("""ALTER TABLE crawl_frontier
+        ADD COLUMN skipped_pages INTEGER NOT NULL DEFAULT 0""")
+
+# migration steps in order; the step at index i upgrades
+# the schema from version i to version i+1
+MIGRATIONS = [
+    _create_tables,
+    _create_unique_indices,
+    _create_lookup_indices,
+    _add_content_codec,
+    _create_fulltext_index,
+    _add_content_hashes,
+    _create_crawl_frontier,
+    _add_skipped_pages,
+]
+
+def get_version():
+    """Returns the schema version of the database.
+    """
+    db.cursor.execute("""PRAGMA user_version""")
+    return db.cursor.fetchone()[0]
+
+def migrate(target=None):
+    """Upgrades the schema to the target version by applying
+    all missing migration steps. Each step runs in its own
+    transaction together with the version update.
+    Input params:
+    target: version to migrate to; if None, the latest version.
+    """
+    target = len(MIGRATIONS) if target is None else target
+    version = get_version()
+    for i in range(version, target):
+        def _step(connection, i=i):
+            MIGRATIONS[i](connection)
+            connection.execute("""PRAGMA user_version={0}""".format(i+1))
+        db.write(_step)
+
+def _drop_content(connection, schema):
+    connection.execute("""DROP TABLE IF EXISTS {0}.doc_contents_fts""".format(schema))
+    connection.execute("""DROP VIEW IF EXISTS {0}.doc_contents_text""".format(schema))
+    connection.execute("""DROP TABLE IF EXISTS {0}.doc_contents""".format(schema))
+
+def split_content():
+    """Moves the document contents with their full-text index
+    from the main database into the attached content database
+    (see content_db_path in setup.json). Tables left in the
+    content database by an interrupted split are replaced. The
+    main database has to be migrated to the latest version and
+    should be vacuumed afterwards. Returns the number of moved
+    contents.
+    """
+    def _split(connection):
+        if 'content' not in _schemas(connection):
+            raise ValueError('No content database attached')
+        if connection.execute("""PRAGMA main.user_version""").fetchone()[0] != len(MIGRATIONS):
+            raise ValueError('Database is not migrated to the latest version')
+        s = """SELECT 1 FROM main.sqlite_master WHERE type='table' AND name='doc_contents'"""
+        if connection.execute(s).fetchone() is None:
+            return 0
+
+        _drop_content(connection, 'content')
+        _create_tables(connection, 'content')
+        _create_lookup_indices(connection, 'content')
+        _add_content_codec(connection, 'content')
+        connection.execute("""ALTER TABLE content.doc_contents ADD COLUMN text_hash TEXT""")
+        connection.execute("""CREATE INDEX content.doc_contents_text_hash ON doc_contents(text_hash)""")
+        num_rows = connection.execute("""INSERT INTO content.doc_contents (id, content, doc_id, codec, text_hash)
+            SELECT id, content, doc_id, codec, text_hash FROM main.doc_contents""").rowcount
+        _create_fulltext_index(connection, 'content')
+
+        _drop_content(connection, 'main')
+        return num_rows
+    return db.write(_split)
+
+def reset():
+    """Drops all tables and indices, including those in
+    attached databases, and resets the schema version.
+    All data is lost.
+    """
+    def _drop(connection):
+        for schema in _schemas(connection):
+            _drop_content(connection, schema)
+            for table in ['crawl_frontier', 'appeals', 'compression_dicts', 'docs', 'cases']:
+                connection.execute("""DROP TABLE IF EXISTS {0}.{1}""".format(schema, table))
+        connection.execute("""PRAGMA user_version=0""")
+    db.write(_drop)
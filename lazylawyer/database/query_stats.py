@@ -0,0 +1,179 @@
+"""Timing of database statements. When enabled, every statement
+executed on a database connection is timed and aggregated by its
+normalized SQL text (literals and IN lists replaced), together with
+the number of executions, returned or changed rows and the time
+write jobs waited for the writer. Statements slower than a
+threshold are logged with their query plan, and a summary is
+printed at program exit. When disabled, the only cost per
+statement is a check of the current variable.
+"""
+import atexit
+import re
+import sqlite3
+import sys
+import threading
+
+# statistics being collected, None if disabled
+current = None
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+def normalize(sql):
+    """Returns the SQL text with string and number literals
+    replaced by ? and lists of placeholders collapsed, so that
+    executions of the same statement can be aggregated.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+class StatementStats:
+    """Aggregated statistics of one normalized statement.
+    Times are in seconds.
+    """
+    __slots__ = ('sql', 'count', 'time', 'max_time', 'wait', 'rows', 'plan')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.time = 0.0
+        self.max_time = 0.0
+        self.wait = 0.0
+        self.rows = 0
+        self.plan = None
+
+class QueryStats:
+    """Collects statement statistics from all threads.
+    Input params:
+    slow_query_ms: statements taking longer are logged with their
+    query plan; None disables the slow query log.
+    slow_query_log: file the slow queries are appended to; if None,
+    they are printed to stderr.
+    """
+    def __init__(self, slow_query_ms=None, slow_query_log=None):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.statements = {}
+        self._normalized = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _entry(self, sql):
+        key = self._normalized.get(sql)
+        if key is None:
+            if len(self._normalized) > 10000:
+                self._normalized = {}
+            key = self._normalized[sql] = normalize(sql)
+        entry = self.statements.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self.statements.setdefault(key, StatementStats(key))
+        return entry
+
+    def set_wait(self, wait):
+        """Sets the time the next statement of the calling thread
+        waited before it could run, e.g. in the write queue.
+        """
+        self._local.wait = wait
+
+    def executed(self, cursor, sql, params, elapsed):
+        """Records the execution of a statement on a cursor. Rows
+        fetched afterwards are added with fetched().
+        """
+        wait = getattr(self._local, 'wait', 0.0)
+        self._local.wait = 0.0
+        entry = self._entry(sql)
+        with self._lock:
+            entry.count += 1
+            entry.time += elapsed
+            entry.wait += wait
+        cursor._stats_query = (entry, sql, params)
+        cursor._stats_time = elapsed
+        if cursor.description is None:
+            # statements without result rows are complete
+            self.finished(cursor, max(cursor.rowcount, 0))
+
+    def fetched(self, cursor, elapsed, num_rows, done):
+        """Records fetching rows of the last statement of a cursor.
+        """
+        if cursor._stats_query is None:
+            return
+        entry = cursor._stats_query[0]
+        with self._lock:
+            entry.time += elapsed
+            entry.rows += num_rows
+        cursor._stats_time += elapsed
+        if done:
+            self.finished(cursor, 0)
+
+    def finished(self, cursor, num_rows):
+        """Completes the last statement of a cursor and logs it
+        if it was slow.
+        """
+        entry, sql, params = cursor._stats_query
+        elapsed = cursor._stats_time
+        cursor._stats_query = None
+        with self._lock:
+            entry.rows += num_rows
+            entry.max_time = max(entry.max_time, elapsed)
+        if self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms:
+            self._log_slow_query(entry, cursor.connection, sql, params, elapsed)
+
+    def _log_slow_query(self, entry, connection, sql, params, elapsed):
+        if entry.plan is None:
+            # the plan is obtained on a plain cursor, so it is not timed itself
+            try:
+                rows = sqlite3.Connection.cursor(connection).execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                entry.plan = '; '.join(row[-1] for row in rows)
+            except (sqlite3.Error, ValueError):
+                entry.plan = ''
+        line = '{0:.1f} ms  {1}  params={2!r}  plan: {3}\n'.format(
+            elapsed * 1000, _SPACE.sub(' ', sql).strip(), params, entry.plan)
+        with self._lock:
+            if self.slow_query_log is None:
+                sys.stderr.write('Slow query: ' + line)
+            else:
+                with open(self.slow_query_log, 'a', encoding='utf-8') as f:
+                    f.write(line)
+
+    def summary(self, n=20):
+        """Returns a table of the n statements with the highest
+        total time.
+        """
+        with self._lock:
+            entries = sorted(self.statements.values(), key=lambda e: e.time, reverse=True)[:n]
+        lines = ['{0:>10} {1:>8} {2:>9} {3:>9} {4:>10} {5:>9}  {6}'.format(
+            'total ms', 'count', 'avg ms', 'max ms', 'wait ms', 'rows', 'statement')]
+        for e in entries:
+            sql = e.sql if len(e.sql) <= 100 else e.sql[:97] + '...'
+            lines.append('{0:>10.1f} {1:>8} {2:>9.3f} {3:>9.1f} {4:>10.1f} {5:>9}  {6}'.format(
+                e.time * 1000, e.count, e.time * 1000 / e.count, e.max_time * 1000,
+                e.wait * 1000, e.rows, sql))
+        return '\n'.join(lines)
+
+def enable(slow_query_ms=None, slow_query_log=None, summary_at_exit=True):
+    """Starts collecting statistics and returns them. See
+    QueryStats for the parameters. If summary_at_exit is True,
+    the summary is printed when the program exits.
+    """
+    global current
+    current = QueryStats(slow_query_ms, slow_query_log)
+    if summary_at_exit:
+        atexit.register(_print_summary, current)
+    return current
+
+def disable():
+    """Stops collecting statistics and returns the collected ones.
+    """
+    global current
+    stats = current
+    current = None
+    return stats
+
+def _print_summary(stats):
+    if stats.statements:
+        sys.stderr.write('Database statements:\n' + stats.summary() + '\n')
@@ -5,62 +5,68 @@ def write_cases(cases):
     Input params:
     cases: case dictionary with all relevant information.
     """
-    db.batch_insert_check('cases', cases, attrs=['name'])
+    db.batch_upsert('cases', cases, attrs=['name'])
 
-def get_all_cases():
+def get_all_cases(columns=db.CASE_COLUMNS):
     """Retrieves all cases from the database.
     This can be useful e.g. when we want to
     bulk download or crawl.
+    Input params:
+    columns: columns to retrieve.
     """
-    s = """SELECT * FROM cases"""
+    s = """SELECT {0} FROM cases""".format(db.select_columns(columns, db.CASE_COLUMNS))
     db.cursor.execute(s)
     rows = db.cursor.fetchall()
     if not rows:
         return None
     else:
-        return db._convert_to_cases_dict(rows)
+        return db.to_records(columns, rows)
+
+def iter_all_cases(columns=db.CASE_COLUMNS, arraysize=1000):
+    """Yields all cases from the database without
+    loading them into memory at once.
+    Input params:
+    columns: columns to retrieve.
+    arraysize: number of rows fetched at once.
+    """
+    s = """SELECT {0} FROM cases""".format(db.select_columns(columns, db.CASE_COLUMNS))
+    return db.iterate_records(s, (), columns, arraysize)
 
 def get_case_with_name(name):
     """Retrieves case with a given name. Returns
     None if none found.
     """
-    s = """SELECT * FROM cases WHERE name=?"""
+    s = """SELECT {0} FROM cases WHERE name=?""".format(','.join(db.CASE_COLUMNS))
     db.cursor.execute(s, (name,))
     rows = db.cursor.fetchone()
     if not rows:
         return None
     else:
-        return db._convert_to_cases_dict([rows])[0]
+        return db.to_records(db.CASE_COLUMNS, [rows])[0]
 
 def get_case_for_doc(doc):
     """Retrieves case for a document.
     """
-    s = """SELECT * FROM cases WHERE id=?"""
+    s = """SELECT {0} FROM cases WHERE id=?""".format(','.join(db.CASE_COLUMNS))
     db.cursor.execute(s, (doc['case_id'],))
     rows = db.cursor.fetchone()
     if not rows:
         return None
     else:
-        return db._convert_to_cases_dict([rows])[0]
+        return db.to_records(db.CASE_COLUMNS, [rows])[0]
 
-def update_subject(case, subject):
+def update_subject(case, subject, writer=None):
     """Updates the subject of the case.
-    Subject is a text field.
+    Subject is a text field. If writer is given,
+    the update is buffered.
     """
     s = """UPDATE cases SET subject=? WHERE id=?"""
-    result = db.cursor.execute(s, (subject, case['id']))
-    db.connection.commit()
+    db.execute_write(s, (subject, case['id']), writer)
 
-def update_parties(case, party1, party2):
-    """Updates the category of the case.
-    Category is a text field.
+def update_parties(case, party1, party2, writer=None):
+    """Updates the parties of the case. Parties which
+    are None are left unchanged. If writer is given,
+    the update is buffered.
     """
-    if party1 is not None:
-        s = """UPDATE cases SET party1=? WHERE id=?"""
-        result = db.cursor.execute(s, (party1, case['id']))
-        db.connection.commit()
-
-    if party2 is not None:
-        s = """UPDATE cases SET party2=? WHERE id=?"""
-        result = db.cursor.execute(s, (party2, case['id']))
-        db.connection.commit()
\ No newline at end of file
+    s = """UPDATE cases SET party1=COALESCE(?, party1), party2=COALESCE(?, party2) WHERE id=?"""
+    db.execute_write(s, (party1, party2, case['id']), writer)
@@ -0,0 +1,148 @@
+"""Crawl frontier. Every case has a row with its crawl state:
+pending, leased by a worker until lease_expires, done, or failed
+after max_attempts attempts. Cases are leased inside a write
+transaction, so worker processes sharing the database never crawl
+the same case, and the cases of a crashed worker are leased again
+once their lease has expired. A crawl can therefore be stopped at
+any point and resumed with the cases which are not done. The
+frontier lives in the SQLite database in WAL mode, which does not
+work on network file systems, so all workers have to run on the
+host of the database.
+Done cases record how many document pages the download policy
+skipped; reopen_skipped() crawls them again after the policy
+was widened.
+"""
+from lazylawyer.database import database as db
+import os
+import socket
+import time
+
+STATES = ['pending', 'leased', 'done', 'failed']
+
+def worker_id():
+    """Returns the name of the calling process in the frontier.
+    The host name is kept to recognize workers in the logs.
+    """
+    return '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+def add_cases(cases):
+    """Adds cases to the frontier as pending. Cases which are
+    already in the frontier keep their state.
+    """
+    s = """INSERT OR IGNORE INTO crawl_frontier (case_id) VALUES (?)"""
+    params = [(case['id'],) for case in cases]
+    db.write(lambda connection: connection.executemany(s, params))
+
+def lease(num_cases, lease_seconds, max_attempts, worker=None, condition='1', params=(),
+        columns=db.CASE_COLUMNS):
+    """Leases up to num_cases pending cases and returns them,
+    ordered by id. Expired leases are reclaimed first; their
+    cases become pending again, or failed if they reached
+    max_attempts.
+    Input params:
+    lease_seconds: time after which the cases may be leased by
+    another worker if they are not done.
+    worker: name of the worker, defaults to worker_id().
+    condition: SQL condition on the cases table restricting the
+    cases to lease, with its parameters in params.
+    columns: columns of the cases to retrieve.
+    """
+    worker = worker_id() if worker is None else worker
+    def _lease(connection):
+        now = time.time()
+        connection.execute("""UPDATE crawl_frontier
+            SET state=CASE WHEN attempts>=? THEN 'failed' ELSE 'pending' END,
+            last_error='lease of ' || worker || ' expired', worker=NULL, lease_expires=NULL
+            WHERE state='leased' AND lease_expires<?""", (max_attempts, now))
+        # the writer holds the write lock, so no other process can
+        # lease the selected cases before they are updated
+        s = """SELECT case_id FROM crawl_frontier JOIN cases ON cases.id=case_id
+            WHERE state='pending' AND ({0}) ORDER BY case_id LIMIT ?""".format(condition)
+        case_ids = [row[0] for row in connection.execute(s, tuple(params) + (num_cases,))]
+        if not case_ids:
+            return []
+        placeholders = ','.join('?' * len(case_ids))
+        connection.execute("""UPDATE crawl_frontier
+            SET state='leased', attempts=attempts+1, worker=?, lease_expires=?
+            WHERE case_id IN ({0})""".format(placeholders), [worker, now + lease_seconds] + case_ids)
+        s = """SELECT {0} FROM cases WHERE id IN ({1}) ORDER BY id""".format(
+            db.select_columns(columns, db.CASE_COLUMNS), placeholders)
+        return db.to_records(columns, connection.execute(s, case_ids).fetchall())
+    return db.write(_lease)
+
+def mark_done(case, writer=None, skipped_pages=0):
+    """Marks a case as done. If writer is given, the update
+    is buffered.
+    Input params:
+    skipped_pages: number of document pages of the case which
+    were not fetched because of the download policy.
+    """
+    s = """UPDATE crawl_frontier SET state='done', last_error=NULL, worker=NULL,
+        lease_expires=NULL, skipped_pages=? WHERE case_id=?"""
+    db.execute_write(s, (skipped_pages, case['id']), writer)
+
+def mark_failed(case, error, max_attempts, writer=None):
+    """Records a failed attempt of a leased case. The case is
+    pending again unless it reached max_attempts, in which case
+    it is marked as failed. If writer is given, the update is
+    buffered.
+    """
+    s = """UPDATE crawl_frontier SET state=CASE WHEN attempts>=? THEN 'failed' ELSE 'pending' END,
+        last_error=?, worker=NULL, lease_expires=NULL WHERE case_id=? AND state='leased'"""
+    db.execute_write(s, (max_attempts, error, case['id']), writer)
+
+def release(worker=None):
+    """Returns the cases leased by a worker to pending without
+    counting the attempt, e.g. when the worker is stopped.
+    Returns the number of released cases.
+    """
+    worker = worker_id() if worker is None else worker
+    s = """UPDATE crawl_frontier SET state='pending', attempts=attempts-1, worker=NULL,
+        lease_expires=NULL WHERE state='leased' AND worker=?"""
+    return db.write(lambda connection: connection.execute(s, (worker,)).rowcount)
+
+def retry_failed():
+    """Sets failed cases back to pending and resets their
+    attempts. Returns the number of cases.
+    """
+    s = """UPDATE crawl_frontier SET state='pending', attempts=0 WHERE state='failed'"""
+    return db.write(lambda connection: connection.execute(s).rowcount)
+
+def reopen_skipped():
+    """Sets done cases whose document pages were skipped by the
+    download policy back to pending, e.g. after the policy was
+    widened. Their docs which were not downloaded yet are removed,
+    so that they are stored again with their preferred link.
+    Returns the number of cases.
+    """
+    def _reopen(connection):
+        s = """SELECT case_id FROM crawl_frontier WHERE state='done' AND skipped_pages>0"""
+        connection.execute("""DELETE FROM docs WHERE download_error IS NULL AND content_id IS NULL
+            AND case_id IN ({0})""".format(s))
+        s = """UPDATE crawl_frontier SET state='pending', attempts=0, skipped_pages=0
+            WHERE state='done' AND skipped_pages>0"""
+        return connection.execute(s).rowcount
+    return db.write(_reopen)
+
+def get_counts(condition='1', params=()):
+    """Returns a dictionary mapping each state to the number
+    of cases in it.
+    Input params:
+    condition: SQL condition on the cases table restricting the
+    cases to count, with its parameters in params.
+    """
+    s = """SELECT state, COUNT(*) FROM crawl_frontier JOIN cases ON cases.id=case_id
+        WHERE {0} GROUP BY state""".format(condition)
+    db.cursor.execute(s, params)
+    counts = dict.fromkeys(STATES, 0)
+    counts.update(db.cursor.fetchall())
+    return counts
+
+def get_failed_cases(columns=db.FRONTIER_COLUMNS):
+    """Retrieves the frontier rows of failed cases, e.g. to
+    inspect their last errors.
+    """
+    s = """SELECT {0} FROM crawl_frontier WHERE state='failed' ORDER BY case_id""".format(
+        db.select_columns(columns, db.FRONTIER_COLUMNS))
+    db.cursor.execute(s)
+    return db.to_records(columns, db.cursor.fetchall())
@@ -1,19 +1,81 @@
+from lazylawyer import helpers
+from lazylawyer.database import compression
 from lazylawyer.database import database as db
+from lazylawyer.database import table_docs
+import hashlib
+import re
+
+def text_hash(text):
+    """Returns the hash identifying a text in doc_contents.
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def get_content_schema():
+    """Returns the schema which holds the document contents: the
+    content database if it is attached and the contents were moved
+    there with split_content(), otherwise main.
+    """
+    s = """SELECT 1 FROM main.sqlite_master WHERE type='table' AND name='doc_contents'"""
+    db.cursor.execute(s)
+    if 'content' in db.manager.attached and db.cursor.fetchone() is None:
+        return 'content'
+    return 'main'
+
+def zstd_level():
+    """Returns the zstd level of new contents, the
+    content_zstd_level entry in setup.json.
+    """
+    return helpers.setup_json.get('content_zstd_level', compression.DEFAULT_ZSTD_LEVEL)
 
 def write_doc_content(doc, text):
     """Stores text for a document. Requires
-    doc['id'] to be stored in the doc dict.
+    doc['id'] to be stored in the doc dict. If an
+    identical text is already stored, the document
+    shares its content instead. The content id is
+    assigned to doc['content_id']. Returns True if
+    the content was shared.
     """
     if doc['content_id'] is not None: # check if no content assigned yet
-        return
+        return False
+
+    hash = text_hash(text)
+    s_hash = """SELECT id FROM doc_contents WHERE text_hash=?"""
+    db.cursor.execute(s_hash, (hash,))
+    row = db.cursor.fetchone()
+    if row is not None:
+        share_doc_content(doc, row[0])
+        doc['content_id'] = row[0]
+        return True
+
+    codec = compression.resolve_codec(helpers.setup_json.get('content_codec', 'raw'))
+    content = compression.compress(text, codec, zstd_level())
 
-    s = """INSERT INTO doc_contents (content, doc_id) VALUES (?, ?)"""
-    db.cursor.execute(s, (text.encode(), doc['id']))
-    db.connection.commit()
+    def _write(connection):
+        # an identical text may have been stored in the meantime
+        row = connection.execute(s_hash, (hash,)).fetchone()
+        if row is not None:
+            connection.execute("""UPDATE docs SET content_id=? WHERE id=?""", (row[0], doc['id']))
+            return row[0], True
 
+        s = """INSERT INTO doc_contents (content, doc_id, codec, text_hash) VALUES (?, ?, ?, ?)"""
+        content_id = connection.execute(s, (content, doc['id'], codec, hash)).lastrowid
+
+        s = """UPDATE docs SET content_id=? WHERE id=?"""
+        connection.execute(s, (content_id, doc['id']))
+
+        s = """INSERT INTO doc_contents_fts (rowid, content) VALUES (?, ?)"""
+        connection.execute(s, (content_id, text))
+        return content_id, False
+    doc['content_id'], shared = db.write(_write)
+    return shared
+
+def share_doc_content(doc, content_id, writer=None):
+    """Assigns an already stored content to a document, e.g.
+    when its file is identical to the file of another document.
+    If writer is given, the update is buffered.
+    """
     s = """UPDATE docs SET content_id=? WHERE id=?"""
-    db.cursor.execute(s, (db.cursor.lastrowid(), doc['id']))
-    db.connection.commit()
+    db.execute_write(s, (content_id, doc['id']), writer)
 
 def get_doc_content(doc):
     """Returns content for a document or None if
@@ -23,7 +85,139 @@ def get_doc_content(doc):
     if doc['content_id'] is None:
         return None
     
-    s = """SELECT content FROM doc_contents WHERE id=?"""
+    s = """SELECT content, codec FROM doc_contents WHERE id=?"""
     db.cursor.execute(s, (doc['content_id'],))
     row = db.cursor.fetchone()
-    return row[0].decode()
+    return compression.decompress(row[0], row[1])
+
+def get_doc_contents(docs, batch_size=500):
+    """Returns contents for a list of documents in the same
+    order, with None for documents without content. Contents
+    are fetched with one query per batch of documents.
+    """
+    contents = {}
+    content_ids = [doc['content_id'] for doc in docs if doc['content_id'] is not None]
+    for batch in helpers.create_batches_generate(content_ids, batch_size):
+        s = """SELECT id, content, codec FROM doc_contents WHERE id IN ({0})""".format(','.join(['?'] * len(batch)))
+        db.cursor.execute(s, batch)
+        for id, content, codec in db.cursor.fetchall():
+            contents[id] = compression.decompress(content, codec)
+    return [contents.get(doc['content_id']) for doc in docs]
+
+def iter_docs_with_contents(names, only_valid=True, columns=db.DOC_COLUMNS, arraysize=100):
+    """Yields (doc, text) pairs for all documents with specific
+    names which have content. Metadata and content are read with
+    one sequential query, so the corpus can be processed in
+    constant memory.
+    Input params:
+    names: list of names of the documents to retrieve.
+    only_valid: only retrieve docs which contain a link.
+    columns: document columns to retrieve.
+    arraysize: number of rows fetched at once.
+    """
+    db.select_columns(columns, db.DOC_COLUMNS)
+    cond, params = table_docs.docs_with_names_condition(names, only_valid, only_with_content=True)
+    s = """SELECT {0}, doc_contents.content, doc_contents.codec FROM docs
+        JOIN doc_contents ON doc_contents.id=docs.content_id
+        WHERE {1} ORDER BY docs.id""".format(','.join('docs.' + col for col in columns), cond)
+
+    cls = db.record_type(columns)
+    for row in db.iterate_rows(s, params, arraysize):
+        yield cls(*row[:-2]), compression.decompress(row[-2], row[-1])
+
+def to_fulltext_query(text):
+    """Converts a search text to an FTS5 query. Parts in double
+    quotes are searched as phrases, all other words individually;
+    a document matches if it contains any of them.
+    """
+    terms = []
+    for phrase, words in re.findall(r'"([^"]*)"|([^"]+)', text):
+        if phrase:
+            tokens = re.findall(r'\w+', phrase)
+            if tokens:
+                terms.append('"' + ' '.join(tokens) + '"')
+        else:
+            terms.extend('"' + token + '"' for token in re.findall(r'\w+', words))
+    return ' OR '.join(terms)
+
+def search_fulltext(text, limit=50):
+    """Searches the document contents with the full-text index.
+    Returns records with doc_id, content_id and score, best matches
+    first. The score is the BM25 relevance (higher is better).
+    Input params:
+    text: search text, see to_fulltext_query.
+    limit: maximal number of results, -1 for all.
+    """
+    query = to_fulltext_query(text)
+    if not query:
+        return []
+
+    s = """SELECT docs.id, docs.content_id, -bm25(doc_contents_fts)
+        FROM doc_contents_fts JOIN docs ON docs.content_id=doc_contents_fts.rowid
+        WHERE doc_contents_fts MATCH ? ORDER BY bm25(doc_contents_fts) LIMIT ?"""
+    db.cursor.execute(s, (query, limit))
+    return db.to_records(['doc_id', 'content_id', 'score'], db.cursor.fetchall())
+
+def get_fulltext_snippets(text, content_ids, snippet_tokens=24, highlight=('[', ']')):
+    """Returns a dictionary mapping content ids to snippets of
+    the contents around the matches of a search text. Snippets
+    require decompressing the contents, so they should only be
+    requested for the results which are displayed.
+    Input params:
+    text: search text, see to_fulltext_query.
+    content_ids: contents to create snippets for.
+    snippet_tokens: length of the snippets in tokens.
+    highlight: strings inserted before and after matched terms.
+    """
+    query = to_fulltext_query(text)
+    if not query or not content_ids:
+        return {}
+
+    s = """SELECT rowid, snippet(doc_contents_fts, 0, ?, ?, '...', ?)
+        FROM doc_contents_fts WHERE doc_contents_fts MATCH ? AND rowid IN ({0})""".format(
+        ','.join(['?'] * len(content_ids)))
+    db.cursor.execute(s, (highlight[0], highlight[1], snippet_tokens, query) + tuple(content_ids))
+    return dict(db.cursor.fetchall())
+
+def rebuild_fulltext_index():
+    """Rebuilds the full-text index from all stored contents.
+    """
+    s = """INSERT INTO doc_contents_fts(doc_contents_fts) VALUES('rebuild')"""
+    db.write(lambda connection: connection.execute(s))
+
+def recompress_doc_contents(codec, batch_size=100, level=None):
+    """Rewrites all stored contents which are not yet stored
+    with the given codec. Rows are processed in batches, each
+    batch in one transaction. Returns the number of rewritten rows.
+    Input params:
+    level: zstd level, zstd_level() if None.
+    """
+    tag = compression.resolve_codec(codec)
+    level = zstd_level() if level is None else level
+    s = """SELECT id, content, codec FROM doc_contents WHERE id>?
+        AND codec IS NOT ? ORDER BY id LIMIT ?"""
+    last_id = -1
+    num_rows = 0
+    while True:
+        db.cursor.execute(s, (last_id, tag, batch_size))
+        rows = db.cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        batch = [(compression.compress(compression.decompress(content, old_tag), tag, level), tag, id)
+            for id, content, old_tag in rows]
+        s_update = """UPDATE doc_contents SET content=?, codec=? WHERE id=?"""
+        db.write(lambda connection: connection.executemany(s_update, batch))
+        num_rows += len(batch)
+    return num_rows
+
+def get_content_samples(num_samples):
+    """Returns texts of a random sample of stored contents,
+    e.g. to train a compression dictionary. Only the ids are
+    sorted, so the contents of other rows are not read.
+    """
+    s = """SELECT content, codec FROM doc_contents WHERE id IN
+        (SELECT id FROM doc_contents ORDER BY RANDOM() LIMIT ?)"""
+    db.cursor.execute(s, (num_samples,))
+    return [compression.decompress(content, codec) for content, codec in db.cursor.fetchall()]
@@ -1,6 +1,5 @@
 from lazylawyer.database import database as db
 import pickle
-import sqlite3
 
 def write_docs_for_case(case, docs):
     """Stores documents belonging to a case.
@@ -14,79 +13,198 @@ def write_docs_for_case(case, docs):
 
     for doc in docs:
         doc['case_id'] = row[0]
-    db.batch_insert_check('docs', docs, attrs=['case_id', 'name'])
+    db.batch_upsert('docs', docs, attrs=['case_id', 'name'])
 
-def get_max_case_id_in_docs():
-    """Retrieves the highest case_id present in the
-    docs table. This is to allow for appending the docs
-    table with new cases.
-    """
-    s = """SELECT MAX(case_id) FROM docs"""
-    db.cursor.execute(s)
-    row = db.cursor.fetchone()
-    return -1 if row[0] is None else row[0]
+def _docs_for_case_query(case, only_with_link, downloaded, columns):
+    s = """SELECT {0} FROM docs WHERE case_id=?""".format(db.select_columns(columns, db.DOC_COLUMNS))
+    if only_with_link:
+        s += """ AND link IS NOT NULL"""
+    if not downloaded:
+        s += """ AND download_error IS NULL"""
+    return s, (case['id'],)
 
-def get_docs_for_case(case, only_with_link=True, downloaded=True):
+def get_docs_for_case(case, only_with_link=True, downloaded=True, columns=db.DOC_COLUMNS):
     """Retrieves documents for a specific case.
     Input params:
     case: case to get docs for.
     only_with_link: only retrieve docs which contain a link.
     downloaded: if True, also retrieves documents which are already
     downloaded (successfully or unsuccessfully)
+    columns: columns to retrieve.
     """
-    s = """SELECT * FROM docs WHERE case_id=?"""
-    if only_with_link:
-        s += """ AND link IS NOT NULL"""
-    if not downloaded:
-        s += """ AND download_error IS NULL"""
-
-    db.cursor.execute(s, (case['id'],))
+    s, params = _docs_for_case_query(case, only_with_link, downloaded, columns)
+    db.cursor.execute(s, params)
     rows = db.cursor.fetchall()
-    return db._convert_to_docs_dict(rows)
+    return db.to_records(columns, rows)
+
+def iter_docs_for_case(case, only_with_link=True, downloaded=True, columns=db.DOC_COLUMNS, arraysize=1000):
+    """Yields documents for a specific case. Parameters
+    are the same as for get_docs_for_case; arraysize is the
+    number of rows fetched at once.
+    """
+    s, params = _docs_for_case_query(case, only_with_link, downloaded, columns)
+    return db.iterate_records(s, params, columns, arraysize)
 
-def get_docs_with_names(names, only_valid=True, only_with_content=True):
+def docs_with_names_condition(names, only_valid, only_with_content, table='docs'):
+    """Returns the WHERE condition and parameters selecting
+    documents with specific names.
+    """
+    s = """{0}.name IN (""".format(table)
+    s += ','.join(['?'] * len(names))
+    s += """)"""
+
+    if only_valid:
+        s += """ AND ({0}.link IS NOT NULL)""".format(table)
+    if only_with_content:
+        s += """ AND ({0}.content_id IS NOT NULL)""".format(table)
+    return s, tuple(names)
+
+def get_docs_with_names(names, only_valid=True, only_with_content=True, columns=db.DOC_COLUMNS):
     """Retrieves all documents with specific names.
     Input params:
     names: list of names of the documents to retrieve.
     only_valid: only retrieve docs which contain a link.
     only_with_content: only retrieve docs which have downloaded
     content in doc_contents table.
+    columns: columns to retrieve.
     """
-    s = """SELECT * FROM docs WHERE (name=?"""
-    for i in range(len(names)-1):
-        s += """ OR name=?"""
-    s += """)"""
+    cond, params = docs_with_names_condition(names, only_valid, only_with_content)
+    s = """SELECT {0} FROM docs WHERE """.format(db.select_columns(columns, db.DOC_COLUMNS)) + cond
+    db.cursor.execute(s, params)
+    rows = db.cursor.fetchall()
+    return db.to_records(columns, rows)
 
-    if only_valid:
-        s += """ AND (link IS NOT NULL)"""
-    if only_with_content:
-        s += """ AND (content_id IS NOT NULL)"""
+def iter_docs_with_names(names, only_valid=True, only_with_content=True, columns=db.DOC_COLUMNS, arraysize=1000):
+    """Yields all documents with specific names. Parameters
+    are the same as for get_docs_with_names; arraysize is the
+    number of rows fetched at once.
+    """
+    cond, params = docs_with_names_condition(names, only_valid, only_with_content)
+    s = """SELECT {0} FROM docs WHERE """.format(db.select_columns(columns, db.DOC_COLUMNS)) + cond
+    return db.iterate_records(s, params, columns, arraysize)
+
+# case fields which can be joined to documents and the
+# expressions they are read from
+CASE_FIELDS = {'case_name': 'cases.name', 'case_desc': 'cases.desc', 'court': 'cases.court',
+    'subject': 'cases.subject', 'party1': 'cases.party1', 'party2': 'cases.party2'}
 
-    db.cursor.execute(s, tuple(names))
+def get_docs_with_cases(names, only_valid=True, only_with_content=True, courts=None,
+        columns=db.DOC_COLUMNS, case_fields=('case_name', 'court', 'subject', 'party1', 'party2')):
+    """Retrieves documents with specific names together with
+    fields of their case using one JOIN query. The case fields
+    are available in each returned record next to the document
+    columns, e.g. doc['case_name'] or doc['subject'].
+    Input params:
+    names: list of names of the documents to retrieve.
+    only_valid: only retrieve docs which contain a link.
+    only_with_content: only retrieve docs which have downloaded
+    content in doc_contents table.
+    courts: if given, only retrieve docs of cases of these courts.
+    columns: document columns to retrieve.
+    case_fields: case fields to retrieve, see CASE_FIELDS.
+    """
+    db.select_columns(columns, db.DOC_COLUMNS)
+    db.select_columns(case_fields, CASE_FIELDS)
+    cond, params = docs_with_names_condition(names, only_valid, only_with_content)
+    if courts is not None:
+        cond += """ AND cases.court IN ({0})""".format(','.join(['?'] * len(courts)))
+        params += tuple(courts)
+
+    cols = ['docs.' + col for col in columns] + [CASE_FIELDS[field] for field in case_fields]
+    s = """SELECT {0} FROM docs JOIN cases ON cases.id=docs.case_id
+        WHERE {1} ORDER BY docs.id""".format(','.join(cols), cond)
+    db.cursor.execute(s, params)
     rows = db.cursor.fetchall()
-    return db._convert_to_docs_dict(rows)
+    return db.to_records(list(columns) + list(case_fields), rows)
 
 def get_doc_with_id(id):
     """Retrieves a document with a corresponding id.
     """
-    s = """SELECT * FROM docs WHERE id=?"""
+    s = """SELECT {0} FROM docs WHERE id=?""".format(','.join(db.DOC_COLUMNS))
     db.cursor.execute(s, (id, ))
     row = db.cursor.fetchone()
-    return None if row is None else db._convert_to_docs_dict([row]) 
+    return None if row is None else db.to_records(db.DOC_COLUMNS, [row]) 
+
+def get_doc_with_file_hash(file_hash):
+    """Retrieves a document with content whose downloaded file
+    has the given hash. Returns None if there is none.
+    """
+    s = """SELECT {0} FROM docs WHERE file_hash=? AND content_id IS NOT NULL
+        LIMIT 1""".format(','.join(db.DOC_COLUMNS))
+    db.cursor.execute(s, (file_hash,))
+    row = db.cursor.fetchone()
+    return None if row is None else db.to_records(db.DOC_COLUMNS, [row])[0]
+
+def get_downloaded_doc_with_link(link):
+    """Retrieves a successfully downloaded document with the
+    given link together with the name of its case in
+    doc['case_name']. Returns None if there is none.
+    """
+    columns = db.DOC_COLUMNS + ['case_name']
+    s = """SELECT {0}, cases.name FROM docs JOIN cases ON cases.id=docs.case_id
+        WHERE docs.link=? AND docs.download_error=0 AND docs.file_hash IS NOT NULL
+        LIMIT 1""".format(','.join('docs.' + col for col in db.DOC_COLUMNS))
+    db.cursor.execute(s, (link,))
+    row = db.cursor.fetchone()
+    return None if row is None else db.to_records(columns, [row])[0]
+
+def get_pending_downloads(condition='1', params=(), columns=db.DOC_COLUMNS):
+    """Retrieves all documents with a link which were not
+    downloaded yet, together with the name of their case in
+    doc['case_name'], using one JOIN query.
+    Input params:
+    condition: additional SQL condition on docs and cases with
+    its parameters in params, e.g. from download_policy.
+    columns: document columns to retrieve.
+    """
+    db.select_columns(columns, db.DOC_COLUMNS)
+    s = """SELECT {0}, cases.name FROM docs JOIN cases ON cases.id=docs.case_id
+        WHERE docs.link IS NOT NULL AND docs.download_error IS NULL AND ({1})
+        ORDER BY docs.id""".format(','.join('docs.' + col for col in columns), condition)
+    db.cursor.execute(s, params)
+    return db.to_records(columns + ['case_name'], db.cursor.fetchall())
 
-def write_download_error(doc, result):
+def count_pending_downloads():
+    """Returns the number of documents with a link which
+    were not downloaded yet.
+    """
+    s = """SELECT COUNT(*) FROM docs WHERE link IS NOT NULL AND download_error IS NULL"""
+    db.cursor.execute(s)
+    return db.cursor.fetchone()[0]
+
+def write_download_error(doc, result, writer=None):
+    """Stores the download result of a document (0 on success,
+    1 on failure). If writer is given, the update is buffered.
+    """
     s = """UPDATE docs SET download_error=? WHERE id=?"""
-    result = db.cursor.execute(s, (result, doc['id']))
-    db.connection.commit()
+    db.execute_write(s, (result, doc['id']), writer)
 
-def update_embedding(doc_id, embedding):
-    pdata = pickle.dumps(embedding, pickle.HIGHEST_PROTOCOL)
-    s = """UPDATE docs SET embedding=? WHERE id=?"""
-    result = db.cursor.execute(s, (sqlite3.Binary(pdata), doc_id))
-    db.connection.commit()
+def update_file_hash(doc, file_hash, writer=None):
+    """Updates the hash of the downloaded file of the
+    document. If writer is given, the update is buffered.
+    """
+    s = """UPDATE docs SET file_hash=? WHERE id=?"""
+    db.execute_write(s, (file_hash, doc['id']), writer)
 
-def update_keywords(doc, keywords):
+def update_keywords(doc, keywords, writer=None):
+    """Updates the keywords of the document. If writer
+    is given, the update is buffered.
+    """
     s = """UPDATE docs SET keywords=? WHERE id=?"""
-    result = db.cursor.execute(s, (keywords, doc['id']))
-    db.connection.commit()
-    
+    db.execute_write(s, (keywords, doc['id']), writer)
+
+def get_legacy_embeddings():
+    """Returns the ids and embeddings of documents whose
+    embedding is still stored in docs.embedding, where earlier
+    versions kept them pickled.
+    """
+    db.cursor.execute("""SELECT id, embedding FROM docs WHERE embedding IS NOT NULL ORDER BY id""")
+    rows = db.cursor.fetchall()
+    return [row[0] for row in rows], [pickle.loads(row[1]) for row in rows]
+
+def clear_legacy_embeddings():
+    """Removes the embeddings stored in docs.embedding, e.g.
+    after they were moved to the embedding store.
+    """
+    s = """UPDATE docs SET embedding=NULL WHERE embedding IS NOT NULL"""
+    db.write(lambda connection: connection.execute(s))
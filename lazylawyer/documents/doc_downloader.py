@@ -1,16 +1,47 @@
 from lazylawyer import helpers
+from lazylawyer import http_client
 import os
 from pathlib import Path
-import requests
+import shutil
+
+def doc_path(case_name, doc):
+    """Returns the path of the downloaded file of a
+    document belonging to the case with the given name.
+    """
+    folder_path = Path('doc_dir/' + helpers.case_name_to_folder(case_name))
+    return folder_path / (str(doc['id']) + '.' + doc['format'])
+
+def download_doc(case_name, doc):
+    """Downloads document from the web belonging to the
+    case with the given name. Stores the document
+    under [name].[format]. Returns the hash of the
+    downloaded file or None if the document has no link.
+    """
+    path = doc_path(case_name, doc)
+    helpers.create_folder_if_not_exists(path.parent)
+
+    if doc['link'] is not None:
+        return http_client.download(doc['link'], path)
 
 def download_doc_for_case(case, doc):
     """Downloads document from the web belonging to a
-    specific case. Stores the document
-    under [name].[format].
+    specific case, see download_doc().
     """
-    folder_path = Path('doc_dir/' + helpers.case_name_to_folder(case['name']))
-    helpers.create_folder_if_not_exists(folder_path)
+    return download_doc(case['name'], doc)
 
-    doc_filename = str(doc['id']) + '.' + doc['format']
-    if doc['link'] is not None:
-        helpers.download_file(doc['link'], folder_path / doc_filename)
+def copy_doc(source_path, case_name, doc):
+    """Stores a copy of a file which was already downloaded
+    for another document with the same link, instead of
+    downloading it again. The copy is renamed into place
+    when it is complete.
+    """
+    path = doc_path(case_name, doc)
+    helpers.create_folder_if_not_exists(path.parent)
+    shutil.copyfile(source_path, str(path) + '.part')
+    os.replace(str(path) + '.part', path)
+
+def copy_doc_for_case(source_path, case, doc):
+    """Copies a downloaded file for a document of a
+    specific case, see copy_doc().
+    """
+    copy_doc(source_path, case['name'], doc)
@@ -1,6 +1,7 @@
 """Performs document rendering. Currently supports
-rendering pdfs (using GhostScript). Planning to also
-include rendering of HTML files and others.
+rendering pdfs (using GhostScript) to images and to the
+text of their text layer. Planning to also include
+rendering of HTML files and others.
 """
 
 import asyncio
@@ -26,11 +27,12 @@ def render_pdf(file_path, output_filename, resolution):
     """Render pdf file to a specific format.
     Input params:
     file_path: PDF document to render.
-    output_name: Name of the output file. The output
-    will be saved in the same directory as the input file.
+    output_filename: Path of the output file. A relative
+    path is taken relative to the directory of the input file,
+    so concurrent renderings should use separate directories.
     resolution: Resolution in DPI.
+    A .txt output file receives the text layer of the pdf.
     """
-    outputfilestr = '-o ' + output_filename
     resolutionstr = '-r' + str(resolution)
     _, format = os.path.splitext(output_filename)
     if format == '.png':
@@ -39,11 +41,16 @@ def render_pdf(file_path, output_filename, resolution):
     elif format == '.tiff':
         sdevicestr = '-sDEVICE=tiff24nc'
         compression = '-sCompression=lzw'
+    elif format == '.txt':
+        sdevicestr = '-sDEVICE=txtwrite'
+        compression = ''
     else:
         raise ValueError('Unsupported format')
 
     cwd, filename = os.path.split(file_path)
-    args = ['-q',resolutionstr,sdevicestr,compression,outputfilestr,filename,'-c','quit']
+    output_path = os.path.join(os.path.abspath(cwd), output_filename)
+    args = ['-q',resolutionstr,sdevicestr,compression,'-o',output_path,filename,'-c','quit']
+    args = [arg for arg in args if arg]
     _run_pdfrenderer(args, cwd=cwd)
 
 def render_doc(document_path, output_filename, resolution):
@@ -1,22 +1,33 @@
 from bs4 import BeautifulSoup
+from lazylawyer.documents import doc_renderer
 import os
 import re
+import string
 import subprocess
 import time
 
-def extract_from_image(file_path):
+def extract_from_image(file_path, threads=None):
+    """Returns the text in an image, recognized with tesseract.
+    The recognized text is written next to the image first, so
+    concurrent calls should use separate directories.
+    Input params:
+    threads: maximum number of threads of tesseract, e.g. 1
+    when several documents are processed in parallel.
+    """
     app = 'tesseract'
 
-    psmstr = '--psm 3'
     cwd, filename = os.path.split(file_path)
     base, _ = os.path.splitext(filename)
     outputfilename = base + '.txt'
     outputfile_path = os.path.join(cwd, outputfilename)
 
-    args = [filename, base, psmstr]
+    args = [filename, base, '--psm', '3']
+    env = {'PATH': os.getenv('PATH')}
+    if threads is not None:
+        env['OMP_THREAD_LIMIT'] = str(threads)
 
     try:
-        completed_process = subprocess.run([app] + args, env={'PATH': os.getenv('PATH')}, 
+        completed_process = subprocess.run([app] + args, env=env, 
             cwd=cwd, check=True)
         with open(outputfile_path, 'r', encoding='utf-8') as txt_file:
             text = txt_file.read()
@@ -27,6 +38,38 @@ def extract_from_image(file_path):
             os.remove(outputfile_path)
     return text
 
+# characters which occur in well extracted texts besides
+# letters, digits and whitespace
+TEXT_PUNCTUATION = set(string.punctuation + '«»„“”‘’–—…°§€£·•')
+
+def extract_from_text_layer(file_path, output_path):
+    """Returns the text of the text layer of a pdf, which is
+    empty for scanned documents.
+    Input params:
+    output_path: temporary .txt file for the text, which is
+    deleted afterwards.
+    """
+    try:
+        doc_renderer.render_pdf(file_path, output_path, 72)
+        with open(output_path, 'r', encoding='utf-8', errors='replace') as txt_file:
+            text = txt_file.read().strip()
+    finally:
+        if (os.path.exists(output_path)):
+            os.remove(output_path)
+    return text
+
+def text_layer_quality(text):
+    """Returns the share of characters in a text which are
+    letters, digits, whitespace or usual punctuation. Text
+    layers with broken font encodings consist largely of
+    other characters, e.g. control, private use or
+    replacement characters.
+    """
+    if not text:
+        return 0.0
+    good = sum(1 for c in text if c.isalnum() or c.isspace() or c in TEXT_PUNCTUATION)
+    return good / len(text)
+
 def extract_from_html(file_path):
     with open(os.path.join(file_path), 'r', encoding='utf-8') as file:
         html = BeautifulSoup(file, 'html.parser')
@@ -0,0 +1,82 @@
+"""Download policy. Only documents which later stages use are
+crawled and downloaded, as configured in the download_policy
+entry of setup.json:
+names: names of the documents, e.g. ["Judgment"].
+formats: formats of the documents, e.g. ["pdf"].
+courts: courts of the cases, COJ and/or GC.
+years: [first, last] year of the cases, taken from the case name.
+Entries which are null do not restrict. The policy is applied in
+the queries which select the work of the crawl and download
+stages, so excluded cases and documents never cause a request.
+"""
+from lazylawyer import helpers
+import lazylawyer.crawlers.helpers
+from lazylawyer.database import database as db
+import re
+
+def _policy():
+    return helpers.setup_json['download_policy']
+
+def case_year(name):
+    """Returns the year of a case from its name, e.g. 2018 for
+    C-123/18, or None if the name contains no year.
+    """
+    match = re.search(r'/(\d+)', name or '')
+    return None if match is None else lazylawyer.crawlers.helpers.to_full_year(match.group(1))
+
+db.register_function('case_year', 1, case_year)
+
+def _in(column, values, conditions, params):
+    if values is not None:
+        conditions.append('{0} IN ({1})'.format(column, ','.join(['?'] * len(values))))
+        params.extend(values)
+
+def case_condition(table='cases'):
+    """Returns the SQL condition selecting the cases allowed
+    by the policy, and its parameters.
+    Input params:
+    table: name or alias of the cases table in the query.
+    """
+    policy = _policy()
+    conditions, params = [], []
+    _in(table + '.court', policy['courts'], conditions, params)
+    first, last = policy['years'] or [None, None]
+    if first is not None:
+        conditions.append('case_year({0}.name)>=?'.format(table))
+        params.append(first)
+    if last is not None:
+        conditions.append('case_year({0}.name)<=?'.format(table))
+        params.append(last)
+    return ' AND '.join(conditions) or '1', tuple(params)
+
+def doc_condition(docs_table='docs', cases_table='cases'):
+    """Returns the SQL condition selecting the documents allowed
+    by the policy, and its parameters. The query has to join the
+    cases of the documents.
+    """
+    policy = _policy()
+    conditions, params = [], []
+    _in(docs_table + '.name', policy['names'], conditions, params)
+    _in(docs_table + '.format', policy['formats'], conditions, params)
+    case_cond, case_params = case_condition(cases_table)
+    conditions.append(case_cond)
+    params.extend(case_params)
+    return ' AND '.join(conditions), tuple(params)
+
+def allows_doc(doc):
+    """Returns True if the policy allows a document. Only the
+    name is checked, and the format if it is known.
+    """
+    policy = _policy()
+    if policy['names'] is not None and doc['name'] not in policy['names']:
+        return False
+    if policy['formats'] is not None and doc.get('format') is not None:
+        return doc['format'] in policy['formats']
+    return True
+
+def allowed_formats(formats):
+    """Returns the formats allowed by the policy, keeping
+    their order of preference.
+    """
+    policy = _policy()
+    return [format for format in formats if policy['formats'] is None or format in policy['formats']]
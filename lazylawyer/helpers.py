@@ -1,6 +1,6 @@
+import hashlib
 import json
 import os
-import requests
 
 SETUP_FILE_PATH = os.path.join('lazylawyer', 'setup.json')
 with open(SETUP_FILE_PATH, 'r') as setup_file:
@@ -15,13 +15,14 @@ def import_by_name(name):
         module = getattr(module, n)
     return module
 
-def download_file(url, filename):
-    response = requests.get(url)
-    if response.status_code == requests.codes.ok:
-        with open(filename, 'wb') as file:
-            file.write(response.content)
-    else:
-        response.raise_for_status()
+def hash_file(filename, chunk_size=1 << 20):
+    """Returns the SHA-256 hash of a file as hex string.
+    """
+    hash = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
 
 def create_batches_generate(lst, batch_size):
     """Generate batches using a generator.
@@ -38,8 +39,8 @@ def create_batches_list(lst, batch_size):
     return batches
 
 def create_folder_if_not_exists(dir):
-    if not os.path.exists(dir):
-        os.makedirs(dir)
+    # exist_ok, as threads may create the same folder concurrently
+    os.makedirs(dir, exist_ok=True)
 
 def case_name_to_folder(name):
     """Convert name of case to case folder."""
@@ -0,0 +1,147 @@
+"""Adaptive limits for the requests to one host. A token bucket
+caps the request rate, and the number of concurrent requests is
+adjusted with AIMD (additive increase, multiplicative decrease):
+every request which completes without signs of overload raises
+the limit by 1/limit, i.e. by about one per round of requests,
+while errors, throttling responses, retries or a latency well
+above the lowest latency seen cut it by decrease_factor. The limit
+is cut at most once per latency, so one burst of errors counts as
+one overload. A Retry-After header pauses the host.
+"""
+import asyncio
+import threading
+import time
+
+# seconds between checks of waiting coroutines for a free slot
+POLL_INTERVAL = 0.02
+
+class HostLimiter:
+    """Rate and concurrency limit of one host.
+    Input params:
+    rate: maximum number of requests per second.
+    burst: number of requests which can be sent at once after an
+    idle period, i.e. the capacity of the token bucket.
+    max_concurrency: upper bound of the concurrency limit.
+    min_concurrency: lower bound of the concurrency limit.
+    initial_concurrency: concurrency limit to start with.
+    latency_tolerance: the host counts as overloaded if the average
+    latency exceeds the lowest latency by this factor.
+    decrease_factor: factor applied to the concurrency limit when
+    the host is overloaded.
+    """
+    def __init__(self, rate, burst, max_concurrency, min_concurrency=1,
+            initial_concurrency=2, latency_tolerance=2.0, decrease_factor=0.5):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+
+        self.limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.tokens = float(burst)
+        self.in_flight = 0
+        self.queued = 0
+        self.latency = None # moving average in seconds
+        self.min_latency = None
+        self.paused_until = 0.0
+        self.requests = 0
+        self.decreases = 0
+        self._refilled = time.monotonic()
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def _delay(self, now):
+        """Returns 0 if a request can start now, otherwise the
+        time to wait for a token, or None if all slots are taken.
+        Has to be called with the lock held.
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a request to the host may start and
+        takes a slot for it. Every acquire() has to be followed
+        by a release(). Returns the time waited in seconds.
+        """
+        start = time.monotonic()
+        with self._condition:
+            self.queued += 1
+            try:
+                while True:
+                    delay = self._delay(time.monotonic())
+                    if delay == 0:
+                        break
+                    self._condition.wait(delay)
+            finally:
+                self.queued -= 1
+            self.tokens -= 1
+            self.in_flight += 1
+            self.requests += 1
+        return time.monotonic() - start
+
+    async def wait_async(self):
+        """Waits without blocking the event loop until a request
+        to the host could start. No slot is taken, so a following
+        acquire() may still block briefly if other threads were
+        faster; this keeps coroutines for a busy host from holding
+        threads which requests to other hosts could use.
+        """
+        while True:
+            with self._condition:
+                delay = self._delay(time.monotonic())
+            if delay == 0:
+                return
+            await asyncio.sleep(POLL_INTERVAL if delay is None else delay)
+
+    def release(self, latency=None, overloaded=False, retry_after=None):
+        """Frees the slot of a finished request and adapts the
+        concurrency limit.
+        Input params:
+        latency: time until the response headers arrived in seconds,
+        None if the request failed.
+        overloaded: True if the host signalled overload, e.g. by an
+        error, a throttling response or retries.
+        retry_after: seconds the host asked to wait before the next
+        request, if any.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                else:
+                    # drift slowly upwards, so a permanently slower
+                    # host does not count as overloaded forever
+                    self.min_latency += 0.01 * (latency - self.min_latency)
+                if self.latency > self.latency_tolerance * self.min_latency:
+                    overloaded = True
+
+            if overloaded:
+                if now - self._last_decrease >= (self.latency or 1.0):
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self.decreases += 1
+                    self._last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def snapshot(self):
+        """Returns the current limits and queue as a dictionary.
+        Latencies are in seconds, None before the first response.
+        """
+        with self._condition:
+            return {'limit': int(self.limit), 'in_flight': self.in_flight, 'queued': self.queued,
+                'rate': self.rate, 'tokens': self.tokens, 'latency': self.latency,
+                'min_latency': self.min_latency, 'requests': self.requests, 'decreases': self.decreases}
@@ -0,0 +1,303 @@
+"""HTTP client shared by the crawlers and downloaders. Every
+thread gets its own requests Session, so connections are kept
+alive between requests of a thread and the number of open
+connections per host follows the number of worker threads.
+Requests time out, and connection errors as well as server
+errors are retried with exponential backoff and jitter.
+Requests, bytes, retries and errors are counted per host.
+Every host has a HostLimiter, which adapts the rate and the
+number of concurrent requests to the responses of the host.
+Settings are read from the http entry in setup.json.
+"""
+from lazylawyer import helpers
+from lazylawyer.host_limiter import HostLimiter
+import hashlib
+import os
+import random
+import re
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+
+# status codes which are retried
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+class JitterRetry(Retry):
+    """Retry whose backoff time is randomized between half
+    and the full exponential backoff, so that threads which
+    failed together do not retry at the same moment.
+    """
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+class HostStats:
+    """Request statistics of one host. Times are in seconds.
+    """
+    __slots__ = ('requests', 'bytes', 'retries', 'errors', 'time')
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.time = 0.0
+
+_local = threading.local()
+_stats = {}
+_stats_lock = threading.Lock()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def _config():
+    return helpers.setup_json['http']
+
+def create_session():
+    """Creates a session with retries and a connection pool
+    for up to pool_hosts hosts.
+    """
+    config = _config()
+    retry = JitterRetry(total=config['retries'], status_forcelist=RETRY_STATUS,
+        allowed_methods=['GET', 'HEAD'], backoff_factor=config['backoff_factor'],
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=config['pool_hosts'], pool_maxsize=1, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session():
+    """Returns the session of the calling thread.
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = create_session()
+    return session
+
+def host_limiter(url):
+    """Returns the HostLimiter of the host of url. Limits are
+    taken from the entry of the host in host_limits, or from
+    the default entry.
+    """
+    host = urlparse(url).netloc
+    limiter = _limiters.get(host)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(host)
+            if limiter is None:
+                config = _config()
+                limits = config['host_limits'].get(host, config['host_limits']['default'])
+                limiter = _limiters[host] = HostLimiter(**dict(config['aimd'], **limits))
+    return limiter
+
+def _retries(response):
+    if response is None or response.raw is None or response.raw.retries is None:
+        return 0
+    return len(response.raw.retries.history)
+
+def _release(limiter, response=None):
+    """Releases the slot of a request and reports the
+    outcome to the limiter of the host.
+    """
+    if response is None:
+        limiter.release(overloaded=True)
+        return
+    retry_after = response.headers.get('Retry-After')
+    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+    overloaded = _retries(response) > 0 or response.status_code in RETRY_STATUS
+    limiter.release(response.elapsed.total_seconds(), overloaded, retry_after)
+
+def _record(url, elapsed, num_bytes=0, response=None, error=False):
+    host = urlparse(url).netloc
+    retries = _retries(response)
+    with _stats_lock:
+        stats = _stats.get(host)
+        if stats is None:
+            stats = _stats[host] = HostStats()
+        stats.requests += 1
+        stats.bytes += num_bytes
+        stats.retries += retries
+        stats.errors += error or (response is not None and response.status_code >= 400)
+        stats.time += elapsed
+
+def get(url, **kwargs):
+    """Sends a GET request with the session of the calling
+    thread and returns the response. Keyword arguments are
+    passed on to requests; the timeout defaults to the
+    configured (connect, read) timeout.
+    """
+    kwargs.setdefault('timeout', tuple(_config()['timeout']))
+    limiter = host_limiter(url)
+    limiter.acquire()
+    start = time.perf_counter()
+    try:
+        response = get_session().get(url, **kwargs)
+    except requests.RequestException:
+        _release(limiter)
+        _record(url, time.perf_counter() - start, error=True)
+        raise
+    _release(limiter, response)
+    num_bytes = 0 if kwargs.get('stream') else len(response.content)
+    _record(url, time.perf_counter() - start, num_bytes, response)
+    return response
+
+class IncompleteDownload(requests.RequestException):
+    """Raised if a download ends before all bytes announced by
+    the server were received. The partial file is kept, so the
+    next download of the file resumes it.
+    """
+
+def _strong_validator(response):
+    # If-Range only accepts strong ETags or dates
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified', '')
+
+def _content_range(response):
+    """Returns the first byte and the total size from the
+    Content-Range header; each is None if unknown.
+    """
+    match = re.match(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)', response.headers.get('Content-Range', ''))
+    if match is None:
+        return None, None
+    first, total = match.groups()
+    return (None if first is None else int(first)), (None if total == '*' else int(total))
+
+def _resume_state(part_path, validator_path, chunk_size):
+    """Returns the size of a partial download, the validator of
+    the file it belongs to, and the hash of the received bytes.
+    Partial downloads without validator cannot be resumed.
+    """
+    hash = hashlib.sha256()
+    if not os.path.exists(part_path) or not os.path.exists(validator_path):
+        return 0, '', hash
+    with open(validator_path, encoding='utf-8') as f:
+        validator = f.read()
+    if not validator:
+        return 0, '', hash
+    size = 0
+    with open(part_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            hash.update(chunk)
+            size += len(chunk)
+    return size, validator, hash
+
+def _transfer(url, part_path, validator_path, chunk_size):
+    """Downloads the file or the rest of a partial download into
+    part_path. Returns the hash of the complete file, or None if
+    the partial download does not match the file on the server.
+    """
+    offset, validator, hash = _resume_state(part_path, validator_path, chunk_size)
+    headers = {}
+    if offset > 0:
+        headers = {'Range': 'bytes={0}-'.format(offset), 'If-Range': validator}
+
+    limiter = host_limiter(url)
+    limiter.acquire()
+    start = time.perf_counter()
+    num_bytes = 0
+    response = None
+    try:
+        with get_session().get(url, headers=headers, stream=True, timeout=tuple(_config()['timeout'])) as response:
+            if response.status_code == 416 and offset > 0:
+                # nothing left to download if the part has the full size
+                return hash.hexdigest() if _content_range(response)[1] == offset else None
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                first, expected_size = _content_range(response)
+                if first != offset:
+                    return None
+                mode = 'ab'
+            else:
+                # the file changed or the server ignores ranges
+                offset, hash, mode = 0, hashlib.sha256(), 'wb'
+                expected_size = None
+                if 'Content-Encoding' not in response.headers and 'Content-Length' in response.headers:
+                    expected_size = int(response.headers['Content-Length'])
+                with open(validator_path, 'w', encoding='utf-8') as f:
+                    f.write(_strong_validator(response))
+
+            with open(part_path, mode) as file:
+                for chunk in response.iter_content(chunk_size):
+                    file.write(chunk)
+                    hash.update(chunk)
+                    num_bytes += len(chunk)
+            if expected_size is not None and offset + num_bytes != expected_size:
+                raise IncompleteDownload('Received {0} of {1} bytes of {2}'.format(
+                    offset + num_bytes, expected_size, url), response=response)
+    except requests.RequestException as e:
+        _record(url, time.perf_counter() - start, num_bytes, getattr(e, 'response', None), error=True)
+        raise
+    finally:
+        # the slot is held until the body is transferred
+        _release(limiter, response)
+    _record(url, time.perf_counter() - start, num_bytes, response)
+    return hash.hexdigest()
+
+def download(url, filename, chunk_size=1 << 16):
+    """Downloads a file in chunks and returns the SHA-256 hash
+    of its content as hex string. Memory use does not depend on
+    the size of the file. The file is written to filename.part
+    and renamed when it is complete, so filename never holds a
+    partial file. A partial file left by an interrupted download
+    is resumed with a Range request; If-Range makes sure that the
+    file did not change on the server in between. Raises HTTPError
+    if the server does not return the file, and IncompleteDownload
+    if the transfer ends early.
+    """
+    part_path = '{0}.part'.format(filename)
+    validator_path = part_path + '.validator'
+    file_hash = _transfer(url, part_path, validator_path, chunk_size)
+    if file_hash is None:
+        # the partial download is stale, start over
+        os.remove(validator_path)
+        file_hash = _transfer(url, part_path, validator_path, chunk_size)
+        if file_hash is None:
+            raise IncompleteDownload('Server returned an unrequested range of {0}'.format(url))
+    os.replace(part_path, filename)
+    os.remove(validator_path)
+    return file_hash
+
+def get_stats():
+    """Returns a dictionary mapping hosts to their HostStats.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+def get_limits():
+    """Returns a dictionary mapping hosts to the current limits
+    and queue depth of their HostLimiter, see HostLimiter.snapshot().
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {host: limiter.snapshot() for host, limiter in limiters.items()}
+
+def limits_summary():
+    """Returns a table of the current limits per host.
+    """
+    lines = ['{0:<30} {1:>6} {2:>9} {3:>7} {4:>7} {5:>11} {6:>10}'.format(
+        'host', 'limit', 'in flight', 'queued', 'rate/s', 'latency ms', 'decreases')]
+    for host, s in sorted(get_limits().items()):
+        latency = '-' if s['latency'] is None else '{0:.0f}'.format(s['latency'] * 1000)
+        lines.append('{0:<30} {1:>6} {2:>9} {3:>7} {4:>7.1f} {5:>11} {6:>10}'.format(
+            host, s['limit'], s['in_flight'], s['queued'], s['rate'], latency, s['decreases']))
+    return '\n'.join(lines)
+
+def stats_summary():
+    """Returns a table of the request statistics per host.
+    """
+    lines = ['{0:<30} {1:>9} {2:>10} {3:>8} {4:>7} {5:>9}'.format(
+        'host', 'requests', 'MB', 'retries', 'errors', 'time s')]
+    for host, s in sorted(get_stats().items()):
+        lines.append('{0:<30} {1:>9} {2:>10.1f} {3:>8} {4:>7} {5:>9.1f}'.format(
+            host, s.requests, s.bytes / 1e6, s.retries, s.errors, s.time))
+    return '\n'.join(lines)
@@ -83,4 +83,16 @@ def cosine_similarity(a, b):
         if np.isclose(norm_a, 0) or np.isclose(norm_b, 0):
             return 0
         else:
-            return dot_product / (norm_a * norm_b)
\ No newline at end of file
+            return dot_product / (norm_a * norm_b)
+
+def cosine_similarities(matrix, b):
+        """Takes a matrix with one vector per row and a vector b and
+        returns the cosine similarity of each row with b.
+        """
+        dot_products = np.dot(matrix, b)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(b)
+
+        similarities = np.zeros(len(dot_products))
+        nonzero = ~np.isclose(norms, 0)
+        similarities[nonzero] = dot_products[nonzero] / norms[nonzero]
+        return similarities
@@ -1,32 +1,90 @@
 """This script crawls the CURIA database and saves all cases
 and relevant document links for each case to the database.
+Documents are crawled for the cases in the crawl frontier, so
+the crawl resumes where it stopped, and several processes can
+crawl at the same time. Only the cases and document pages
+allowed by the download policy in setup.json are fetched.
+Cases whose document pages were skipped by the policy can be
+crawled again with --reopen_skipped after widening it.
 """
 import argparse
-import concurrent.futures
+from lazylawyer.crawlers import crawl_engine, http_cache
 from lazylawyer.crawlers.crawlers import CURIACrawler
-from lazylawyer.database import table_cases, table_docs, table_appeals
-from lazylawyer import helpers
+from lazylawyer.database import database as db
+from lazylawyer.database import table_cases, table_docs, table_appeals, table_crawl_frontier
+from lazylawyer.documents import download_policy
+from lazylawyer import helpers, http_client
 from tqdm import tqdm
 
-def crawl_cases_docs_curia(crawl_docs_only=False, num_cases=-1):
+def write_case_docs(case, docs, writer=None):
+    """Stores the crawled documents of a case.
+    """
+    if docs is not None:
+        # insert parties to cases table
+        table_cases.update_parties(case, docs[0]['party1'], docs[0]['party2'], writer)
+        table_cases.update_subject(case, docs[0]['subject'], writer)
+        for doc in docs:
+            doc.pop('party1')
+            doc.pop('party2')
+            doc.pop('subject')
+        table_docs.write_docs_for_case(case, docs)
+
+def leased_cases(batch_size, condition, params, max_cases=-1):
+    """Yields cases leased from the crawl frontier. Cases are
+    leased in small batches while the crawl runs, so that
+    other workers get their share of the frontier.
+    Input params:
+    condition: SQL condition on the cases to lease with its
+    parameters in params.
+    max_cases: If > 0, at most max_cases cases are leased.
+    """
+    config = helpers.setup_json['crawl_frontier']
+    num_leased = 0
+    while max_cases <= 0 or num_leased < max_cases:
+        size = batch_size if max_cases <= 0 else min(batch_size, max_cases - num_leased)
+        cases = table_crawl_frontier.lease(size, config['lease_seconds'], config['max_attempts'],
+            condition=condition, params=params)
+        if not cases:
+            return
+        num_leased += len(cases)
+        yield from cases
+
+def crawl_cases_docs_curia(crawl_docs_only=False, num_cases=-1, max_in_flight=10, offline=False,
+        retry_failed=False, reopen_skipped=False):
     """Crawls cases and the corresponding documents.
     Input params:
-    crawl_docs_only: If True, does not crawl cases and only crawls docs.
+    crawl_docs_only: If True, does not crawl cases and only crawls docs
+    of the pending cases in the crawl frontier.
     num_cases: If <= 0, crawls all available cases. Otherwise, crawls num_cases
-    cases.
+    cases and only the docs of these cases, or with crawl_docs_only, the docs
+    of at most num_cases pending cases.
+    max_in_flight: maximum number of concurrent requests.
+    offline: if True, pages are only read from the http cache, e.g. to
+    re-parse them after changes of the protocol.
+    retry_failed: if True, cases which failed before are crawled again.
+    reopen_skipped: if True, cases whose document pages were skipped by
+    the download policy are crawled again, e.g. after it was widened.
     """
-    formats = ['html', 'pdf'] # formats are processed in the order they are given
+    http_cache.set_offline(offline)
+    # formats are processed in the order they are given
+    formats = download_policy.allowed_formats(['html', 'pdf'])
 
     crawler = CURIACrawler() 
+    # cases excluded by the download policy are left pending
+    policy_condition, params = download_policy.case_condition()
+    condition = policy_condition
 
-    if crawl_docs_only:
-        cases = table_cases.get_all_cases() 
-        max_case_id = table_docs.get_max_case_id_in_docs()
-        cases = [x for x in cases if x['id'] > max_case_id]
-    else:
+    if not crawl_docs_only:
         cases, appeals = crawler.crawl_ecj_cases(num_cases)
         table_cases.write_cases(cases)
+        crawled_names = set(case['name'] for case in cases)
         cases = table_cases.get_all_cases() # obtain cases once more to get ids
+        table_crawl_frontier.add_cases(cases)
+        if num_cases > 0:
+            # only crawl the docs of the cases crawled now; the ids are
+            # integers from the database, so they can be inlined
+            case_ids = ','.join(str(case['id']) for case in cases if case['name'] in crawled_names)
+            condition = '({0}) AND cases.id IN ({1})'.format(condition, case_ids or 'NULL')
 
         # convert appeal case names to numbers
         for appeal in appeals:
@@ -40,28 +98,78 @@ def crawl_cases_docs_curia(crawl_docs_only=False, num_cases=-1):
         appeals = [appeal for appeal in appeals if appeal['orig_case_id'] and appeal['appeal_case_id']] # remove appeals with None
         table_appeals.write_appeals(appeals)
 
-    cases_batches = helpers.create_batches_list(cases, 50)
-    for batch in tqdm(cases_batches):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures_cases = {executor.submit(crawler.crawl_case_docs, case, formats):case for case in batch}
+    if retry_failed:
+        table_crawl_frontier.retry_failed()
+    if reopen_skipped:
+        table_crawl_frontier.reopen_skipped()
+
+    # documents are written as soon as their case is crawled,
+    # and the case is marked as done after its documents
+    max_attempts = helpers.setup_json['crawl_frontier']['max_attempts']
+    num_skipped_cases = table_crawl_frontier.get_counts()['pending'] \
+        - table_crawl_frontier.get_counts(policy_condition, params)['pending']
+    total = table_crawl_frontier.get_counts(condition, params)['pending']
+    total = min(num_cases, total) if crawl_docs_only and num_cases > 0 else total
+    num_skipped_pages = 0
+    # number of skipped document pages by case id
+    skipped_pages = {}
+    def doc_filter(case, doc):
+        # runs on the event loop of the crawl, so the counters need no lock;
+        # the count of a case is only taken after its docs were crawled
+        nonlocal num_skipped_pages
+        if download_policy.allows_doc(doc):
+            return True
+        num_skipped_pages += 1
+        skipped_pages[case['id']] = skipped_pages.get(case['id'], 0) + 1
+        return False
+
+    try:
+        with db.BufferedWriter() as writer, tqdm(total=total) as progress:
+            def show_limits():
+                # current concurrency limit and queue depth per host
+                progress.set_postfix_str(', '.join('{0}: {1} ({2} queued)'.format(host, s['limit'], s['queued'])
+                    for host, s in http_client.get_limits().items()), refresh=False)
+
+            def on_result(case, docs):
+                write_case_docs(case, docs, writer)
+                table_crawl_frontier.mark_done(case, writer, skipped_pages.pop(case['id'], 0))
+                show_limits()
+                progress.update()
+
+            def on_error(case, e):
+                tqdm.write('Failed to crawl {0}: {1!r}'.format(case['name'], e))
+                skipped_pages.pop(case['id'], None)
+                table_crawl_frontier.mark_failed(case, repr(e), max_attempts, writer)
+                show_limits()
+                progress.update()
 
-        for future in concurrent.futures.as_completed(futures_cases):
-            case = futures_cases[future]
-            docs = future.result()
-            if docs is not None:
-                # insert parties to cases table
-                table_cases.update_parties(case, docs[0]['party1'], docs[0]['party2'])
-                table_cases.update_subject(case, docs[0]['subject'])
-                for doc in docs:
-                    doc.pop('party1')
-                    doc.pop('party2')
-                    doc.pop('subject')
-                table_docs.write_docs_for_case(case, docs)
+            crawl_engine.crawl(leased_cases(max_in_flight, condition, params, num_cases if crawl_docs_only else -1),
+                lambda case, fetch: crawler.crawl_case_docs_async(case, formats, fetch,
+                    lambda doc: doc_filter(case, doc)),
+                on_result, on_error, max_in_flight)
+    finally:
+        # cases which were leased but not finished, e.g. on
+        # KeyboardInterrupt, can be leased by others right away
+        table_crawl_frontier.release()
+    print(', '.join('{0} {1}'.format(n, state) for state, n in table_crawl_frontier.get_counts().items()))
+    print('Skipped {0} pending cases and {1} document pages by the download policy'.format(
+        num_skipped_cases, num_skipped_pages))
+    print(http_cache.stats_summary())
+    print(http_client.stats_summary())
+    print(http_client.limits_summary())
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Crawl CURIA cases and docs.')
     parser.add_argument('--docs_only', action='store_true', help='only crawl documents')
-    parser.add_argument('--num_cases', type=int, default=-1, help='only crawl a limited number of cases')
+    parser.add_argument('--num_cases', type=int, default=-1,
+        help='only crawl a limited number of cases and their docs; with --docs_only, the docs of this many pending cases')
+    parser.add_argument('--max_in_flight', type=int, default=10,
+        help='maximum number of concurrent requests; the limits per host are adapted within it')
+    parser.add_argument('--offline', action='store_true', help='only use cached pages')
+    parser.add_argument('--retry_failed', action='store_true', help='crawl cases which failed before again')
+    parser.add_argument('--reopen_skipped', action='store_true',
+        help='crawl cases again whose document pages were skipped by the download policy')
 
     args = parser.parse_args()
-    crawl_cases_docs_curia(args.docs_only, args.num_cases)
+    crawl_cases_docs_curia(args.docs_only, args.num_cases, args.max_in_flight, args.offline, args.retry_failed,
+        args.reopen_skipped)
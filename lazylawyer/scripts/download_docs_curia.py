@@ -1,30 +1,122 @@
 """This script downloads documents from the curia database
 and saves these documents in the doc_dir folder under the
 case name and with a unique identifier as the document name.
+All pending downloads are read with one query and run on a
+pool of worker threads; the request rate per host is limited
+by http_client. Files are only renamed into place when they
+are complete, so the script can be interrupted and restarted
+at any time. Documents which the download policy in setup.json
+excludes are not downloaded.
 """
+import argparse
 import concurrent.futures
-from lazylawyer.documents import doc_downloader
-from lazylawyer.database import table_cases, table_docs
-from lazylawyer import helpers
-import json
-from requests.exceptions import HTTPError
+from lazylawyer.documents import doc_downloader, download_policy
+from lazylawyer.database import database as db
+from lazylawyer.database import table_docs
+from lazylawyer import helpers, http_client
+import os
+from requests.exceptions import HTTPError, RequestException
+import time
 from tqdm import tqdm
 
-def get_and_download_docs(case):
-    # in this step we also skip documents which have already been downloaded
-    docs = table_docs.get_docs_for_case(case, only_with_link=True, downloaded=False)
+def get_file_for_link(link, docs):
+    """Gets the file of a link for all documents with this link.
+    The file is taken from a complete file left by an interrupted
+    run, from a download of an earlier run, or downloaded once; the
+    other documents get a copy. Returns the hash of the file, the
+    number of downloaded bytes and the number of copied bytes.
+    Input params:
+    docs: documents with the link, with the name of their case in
+    doc['case_name'].
+    """
+    path = doc_downloader.doc_path(docs[0]['case_name'], docs[0])
+    source = None
+    if os.path.exists(path):
+        # files are renamed into place when complete, so an
+        # existing file was fully downloaded
+        source = (path, helpers.hash_file(path))
+    else:
+        source_doc = table_docs.get_downloaded_doc_with_link(link)
+        if source_doc is not None:
+            source_path = doc_downloader.doc_path(source_doc['case_name'], source_doc)
+            if os.path.exists(source_path):
+                source = (source_path, source_doc['file_hash'])
+
+    downloaded_bytes, copied_bytes = 0, 0
+    if source is None:
+        source = (path, doc_downloader.download_doc(docs[0]['case_name'], docs[0]))
+        downloaded_bytes = os.path.getsize(path)
+
     for doc in docs:
-        try:
-            doc_downloader.download_doc_for_case(case, doc)
-            table_docs.write_download_error(doc, 0)
-        except HTTPError:
-            table_docs.write_download_error(doc, 1)
+        doc_path = doc_downloader.doc_path(doc['case_name'], doc)
+        if doc_path != source[0] and not os.path.exists(doc_path):
+            doc_downloader.copy_doc(source[0], doc['case_name'], doc)
+            copied_bytes += os.path.getsize(doc_path)
+    return source[1], downloaded_bytes, copied_bytes
 
-def download_docs_curia():
-    cases = table_cases.get_all_cases()
+def download_docs_curia(workers=None):
+    """Downloads all documents which were not downloaded yet.
+    Input params:
+    workers: number of concurrent downloads; if None, the
+    workers entry of downloads in setup.json is used.
+    """
+    workers = helpers.setup_json['downloads']['workers'] if workers is None else workers
+    condition, params = download_policy.doc_condition()
+    docs = table_docs.get_pending_downloads(condition, params)
+    num_skipped = table_docs.count_pending_downloads() - len(docs)
+    docs_by_link = {}
+    for doc in docs:
+        docs_by_link.setdefault(doc['link'], []).append(doc)
 
-    for case in tqdm(cases):
-        get_and_download_docs(case)
+    num_failed, num_pending = 0, 0
+    downloaded_bytes, copied_bytes = 0, 0
+    start = time.perf_counter()
+    # download results are written in batches by the writer
+    with db.BufferedWriter() as writer, tqdm(total=len(docs), unit='file') as progress:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        futures = {}
+        try:
+            for link, link_docs in docs_by_link.items():
+                futures[executor.submit(get_file_for_link, link, link_docs)] = link_docs
+            for future in concurrent.futures.as_completed(futures):
+                link_docs = futures[future]
+                try:
+                    file_hash, num_bytes, num_copied_bytes = future.result()
+                except HTTPError:
+                    for doc in link_docs:
+                        table_docs.write_download_error(doc, 1, writer)
+                    num_failed += len(link_docs)
+                except (RequestException, OSError) as e:
+                    # e.g. a dropped connection; the documents stay pending
+                    # and the partial file is resumed in the next run
+                    tqdm.write('Failed to download {0}: {1!r}'.format(link_docs[0]['link'], e))
+                    num_pending += len(link_docs)
+                else:
+                    for doc in link_docs:
+                        table_docs.write_download_error(doc, 0, writer)
+                        table_docs.update_file_hash(doc, file_hash, writer)
+                    downloaded_bytes += num_bytes
+                    copied_bytes += num_copied_bytes
+                progress.set_postfix_str('{0:.2f} MB/s'.format(
+                    downloaded_bytes / 1e6 / (time.perf_counter() - start)), refresh=False)
+                progress.update(len(link_docs))
+        finally:
+            # on interruption, downloads which have not started are dropped
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - start
+    print('Downloaded {0:.1f} MB in {1:.0f} s ({2:.2f} MB/s), copied {3:.1f} MB for documents with known links'.format(
+        downloaded_bytes / 1e6, elapsed, downloaded_bytes / 1e6 / max(elapsed, 1e-9), copied_bytes / 1e6))
+    print('{0} documents failed, {1} left pending for the next run'.format(num_failed, num_pending))
+    print('Skipped {0} pending downloads by the download policy'.format(num_skipped))
+    print(http_client.stats_summary())
+    print(http_client.limits_summary())
 
 if __name__ == '__main__':
-    download_docs_curia()
+    parser = argparse.ArgumentParser(description='Download CURIA documents.')
+    parser.add_argument('--workers', type=int, default=None, help='number of concurrent downloads')
+
+    args = parser.parse_args()
+    download_docs_curia(args.workers)
@@ -1,63 +1,244 @@
 """This script tries to extract text and high-level structure from
 documents. It does this by batch-processing all documents belonging
 to all cases. For HTML documents, a text parser is called.
-PDF documents are converted to an image format first (e.g. tiff) and
-then processed with tesseract-ocr.
+The text layer of PDF documents is used if it has enough text of a
+good quality. Otherwise, e.g. for scanned documents, PDF documents are
+converted to an image format first (e.g. tiff) and then processed with
+tesseract-ocr.
+Documents whose file or text is identical to an already
+extracted document share its content, so each distinct file
+is only processed and stored once.
+Documents are extracted on a pool of processes, each job in its
+own temporary directory, and the results are stored in the order
+of the documents by the main process.
 """
 
-from lazylawyer.database import table_cases, table_docs, table_doc_contents
-from lazylawyer.documents import doc_textextractor, doc_renderer
+import argparse
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from lazylawyer.database import database as db
+from lazylawyer.database import table_docs, table_doc_contents
+from lazylawyer.documents import doc_downloader, doc_textextractor, doc_renderer
 from lazylawyer.nlp.curia_preprocessor import extract_keywords
 from lazylawyer import helpers
 import os
-from pathlib import Path
+import subprocess
+import tempfile
+import time
 from tqdm import tqdm
 
-def text_from_doc(doc):
-    """Extract text from documents in a case.
-    """
-    case = table_cases.get_case_for_doc(doc)    
-    folder_path = Path('doc_dir/' + helpers.case_name_to_folder(case['name']))
+# formats which text_from_doc() extracts
+FORMATS = ['pdf', 'html']
+
+def _add_time(stats, stage, start):
+    end = time.perf_counter()
+    stats[stage] = stats.get(stage, 0.0) + end - start
+    return end
 
-    doc_filename = str(doc['id']) + '.' + doc['format']
-    doc_path = str(folder_path / doc_filename)
+def text_from_doc(doc, resolution=300, threads=None, work_dir=None, text_layer=None, stats=None):
+    """Extract text from documents in a case. Requires
+    the name of the case in doc['case_name'].
+    Input params:
+    resolution: resolution in DPI at which pdfs are rendered.
+    threads: maximum number of threads of the OCR.
+    work_dir: folder for the temporary directories of the
+    rendered images, the default temporary folder if None.
+    text_layer: dictionary with min_chars and min_quality, the
+    text layer of a pdf is used instead of OCR if it has at least
+    min_chars characters and text_layer_quality() of at least
+    min_quality. If None, pdfs are always OCRed.
+    stats: if given, the time of each stage in seconds is added
+    to this dictionary, and the path taken (text_layer, ocr or
+    html) is stored in stats['path'].
+    """
+    doc_path = str(doc_downloader.doc_path(doc['case_name'], doc))
+    stats = {} if stats is None else stats
 
     text = None
+    start = time.perf_counter()
     if doc['format'] == 'pdf':
-        try:
-            # first convert pdf to tiff image
-            img_filename = 'tmp.tiff'
-            doc_renderer.render_doc(doc_path, img_filename, 300)
+        # every job renders into its own directory, so jobs
+        # can run in parallel
+        with tempfile.TemporaryDirectory(prefix='ocr_', dir=work_dir) as job_dir:
+            if text_layer is not None:
+                # digitally created pdfs have a text layer, which is
+                # much faster to extract than rendering and OCR
+                try:
+                    text = doc_textextractor.extract_from_text_layer(doc_path, os.path.join(job_dir, 'doc.txt'))
+                except subprocess.CalledProcessError:
+                    text = None
+                start = _add_time(stats, 'text_layer', start)
+                if text is not None and len(text) >= text_layer['min_chars'] \
+                        and doc_textextractor.text_layer_quality(text) >= text_layer['min_quality']:
+                    stats['path'] = 'text_layer'
+                    return text
 
-            os.rename(str(folder_path / (' ' + img_filename)), str(folder_path / img_filename))
+            # first convert pdf to tiff image
+            img_path = os.path.join(job_dir, 'doc.tiff')
+            doc_renderer.render_doc(doc_path, img_path, resolution)
+            start = _add_time(stats, 'render', start)
 
-            # extract text from tiff and delete it
-            text = doc_textextractor.extract_from_image(str(folder_path / img_filename))
-        finally:
-            if (os.path.exists(str(folder_path / img_filename))):
-                os.remove(str(folder_path / img_filename))
+            # extract text from tiff, the directory is deleted afterwards
+            text = doc_textextractor.extract_from_image(img_path, threads)
+            _add_time(stats, 'ocr', start)
+            stats['path'] = 'ocr'
 
     elif doc['format'] == 'html':
-        text = doc_textextractor.extract_from_html(str(folder_path / doc_filename))
+        text = doc_textextractor.extract_from_html(doc_path)
+        _add_time(stats, 'html', start)
+        stats['path'] = 'html'
 
     return text
 
-def extract_content_curia():
-    docs = table_docs.get_docs_with_names(['Judgment'], only_valid=True, only_with_content=False)
-    if len(docs) > 0:
-        for doc in docs:
-            # first check if document could be downloaded
-            if doc['download_error'] is None or doc['download_error'] > 0:
-                continue
+def _extract_job(doc, resolution, threads, work_dir, text_layer):
+    # runs in a worker process
+    stats = {}
+    text = text_from_doc(doc, resolution, threads, work_dir, text_layer, stats)
+    return text, stats
+
+def extract_content_curia(workers=None):
+    """Extracts the content of all judgments which have none yet.
+    Input params:
+    workers: number of processes; if None, the workers entry of
+    extraction in setup.json is used, or all cores if it is null.
+    """
+    config = helpers.setup_json['extraction']
+    workers = config['workers'] if workers is None else workers
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    # with one process per core, tesseract should not start more threads
+    threads = 1 if workers > 1 else None
+
+    docs = table_docs.get_docs_with_cases(['Judgment'], only_valid=True, only_with_content=False, case_fields=['case_name'])
+    # documents waiting for the extraction of an identical file
+    # in this run, by file hash
+    waiting = {}
+    # content and keywords of files extracted in this run, by file
+    # hash, as the buffered hashes are not visible to the database yet
+    extracted = {}
+    num_extracted, num_failed, num_unsupported = 0, 0, 0
+    num_skipped, skipped_bytes = 0, 0
+    num_shared, shared_bytes = 0, 0
+    stage_times = collections.Counter()
+    # number of documents and extraction time by path
+    path_counts, path_times = collections.Counter(), collections.Counter()
+    start = time.perf_counter()
 
-            if doc['content_id'] is None:
-                text = text_from_doc(doc)
+    def store(doc, text, writer):
+        nonlocal num_shared, shared_bytes
+        if table_doc_contents.write_doc_content(doc, text):
+            num_shared += 1
+            shared_bytes += len(text.encode())
+        # try to extract keywords as well
+        keywords = extract_keywords(text)
+        if keywords:
+            table_docs.update_keywords(doc, keywords, writer)
+        extracted[doc['file_hash']] = {'content_id': doc['content_id'], 'keywords': keywords}
+        for other in waiting.pop(doc['file_hash']):
+            table_doc_contents.share_doc_content(other, doc['content_id'], writer)
+            if keywords:
+                table_docs.update_keywords(other, keywords, writer)
+
+    if len(docs) > 0:
+        with db.BufferedWriter() as writer, tqdm(total=len(docs), unit='doc') as progress, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # results are stored in the order of the documents; the
+            # number of submitted jobs is bounded to limit memory
+            jobs = collections.deque()
+            def finish_job():
+                nonlocal num_extracted, num_failed
+                doc, future = jobs.popleft()
+                try:
+                    text, stats = future.result()
+                except BrokenProcessPool:
+                    # the queued jobs are lost as well
+                    raise
+                except Exception as e:
+                    tqdm.write('Failed to extract document {0}: {1!r}'.format(doc['id'], e))
+                    num_failed += 1
+                    text, stats = None, {}
+                else:
+                    num_extracted += 1
+                path = stats.pop('path', None)
+                if path is not None:
+                    path_counts[path] += 1
+                    path_times[path] += sum(stats.values())
+                stage_times.update(stats)
+                write_start = time.perf_counter()
                 if text is not None:
-                    table_doc_contents.write_doc_content(doc, text)
-                    # try to extract keywords as well
-                    keywords = extract_keywords(text)
-                    if keywords:
-                        table_docs.update_keywords(doc, keywords)
+                    store(doc, text, writer)
+                else:
+                    # identical files are tried again in the next run
+                    waiting.pop(doc['file_hash'])
+                stage_times['write'] += time.perf_counter() - write_start
+                progress.update()
+
+            for doc in docs:
+                # first check if document could be downloaded
+                if doc['download_error'] is None or doc['download_error'] > 0 or doc['content_id'] is not None:
+                    progress.update()
+                    continue
+                if doc['format'] not in FORMATS:
+                    num_unsupported += 1
+                    progress.update()
+                    continue
+
+                hash_start = time.perf_counter()
+                doc_path = doc_downloader.doc_path(doc['case_name'], doc)
+                if doc['file_hash'] is None:
+                    try:
+                        doc['file_hash'] = helpers.hash_file(doc_path)
+                    except OSError as e:
+                        tqdm.write('Failed to read document {0}: {1!r}'.format(doc['id'], e))
+                        num_failed += 1
+                        progress.update()
+                        continue
+                    table_docs.update_file_hash(doc, doc['file_hash'], writer)
+                stage_times['hash'] += time.perf_counter() - hash_start
+
+                # skip extraction of files which were extracted before
+                source = extracted.get(doc['file_hash'])
+                if source is None and doc['file_hash'] not in waiting:
+                    source = table_docs.get_doc_with_file_hash(doc['file_hash'])
+                if source is not None or doc['file_hash'] in waiting:
+                    if source is not None:
+                        table_doc_contents.share_doc_content(doc, source['content_id'], writer)
+                        if source['keywords']:
+                            table_docs.update_keywords(doc, source['keywords'], writer)
+                    else:
+                        waiting[doc['file_hash']].append(doc)
+                    num_skipped += 1
+                    skipped_bytes += os.path.getsize(doc_path)
+                    progress.update()
+                    continue
+
+                waiting[doc['file_hash']] = []
+                # records cannot be pickled, workers get the fields they need
+                job_doc = {'id': doc['id'], 'format': doc['format'], 'case_name': doc['case_name']}
+                jobs.append((doc, executor.submit(_extract_job, job_doc, config['resolution'], threads,
+                    config['work_dir'], config['text_layer'])))
+                if len(jobs) >= 4 * workers:
+                    finish_job()
+            while jobs:
+                finish_job()
+
+    elapsed = time.perf_counter() - start
+    extraction_time = sum(path_times.values())
+    print('Extracted {0} documents in {1:.1f} s on {2} processes ({3} failed, {4} in unsupported formats)'.format(
+        num_extracted, elapsed, workers, num_failed, num_unsupported))
+    print('Stage times: text layer {0:.1f} s, render {1:.1f} s, ocr {2:.1f} s, html {3:.1f} s summed over '
+        'processes; hash {4:.1f} s, write {5:.1f} s'.format(stage_times['text_layer'], stage_times['render'],
+        stage_times['ocr'], stage_times['html'], stage_times['hash'], stage_times['write']))
+    print('Paths: ' + ', '.join('{0} {1} ({2:.2f} s per document)'.format(n, path, path_times[path] / n)
+        for path, n in sorted(path_counts.items())))
+    avg_time = extraction_time / num_extracted if num_extracted > 0 else 0.0
+    print('Skipped {0} identical files ({1:.1f} MB, about {2:.1f} s of extraction)'.format(
+        num_skipped, skipped_bytes / 1e6, num_skipped * avg_time))
+    print('Shared {0} identical texts ({1:.1f} MB not stored)'.format(num_shared, shared_bytes / 1e6))
 
 if __name__ == '__main__':
-    extract_content_curia()
+    parser = argparse.ArgumentParser(description='Extract the content of CURIA documents.')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, all cores by default')
+
+    args = parser.parse_args()
+    extract_content_curia(args.workers)
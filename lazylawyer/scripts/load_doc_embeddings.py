@@ -1,26 +1,30 @@
 import argparse
-from lazylawyer.database import table_docs
-from lazylawyer.content_generator import ContentGenerator
-from lazylawyer import helpers
+from lazylawyer.database import embedding_store
 import os
 import pickle
 
-def load_doc_embeddings(file_name):
+def load_doc_embeddings(file_name, model=None):
     """Loads document embeddings from a file and saves
-    them in the database.
+    them in the embedding store.
+    Input params:
+    file_name: name of the pickled embeddings file.
+    model: name of the model in the embedding store. If None,
+    the file name without extension is used.
     """
-    docs = table_docs.get_docs_with_names(['Judgment'])
+    if model is None:
+        model = os.path.splitext(file_name)[0]
 
     with open(os.path.join('saved_embeddings', file_name), 'rb') as f:
         embs = pickle.load(f)
 
-    for emb in embs:
-        table_docs.update_embedding(emb['doc_id'], emb['emb'])
+    embedding_store.write_embeddings(model, [emb['doc_id'] for emb in embs],
+        [emb['emb'] for emb in embs])
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Save document embeddings using a certain model')
     parser.add_argument('file_name', help='file name of the pickled embeddings file')
+    parser.add_argument('--model', help='model name in the embedding store, defaults to the file name')
 
     args = parser.parse_args()
 
-    load_doc_embeddings(args.file_name)
+    load_doc_embeddings(args.file_name, args.model)
@@ -1,9 +1,18 @@
-"""This script performs migration of the database.
+"""This script performs migration of the database. Missing
+migration steps are applied in place, so no data is lost
+unless --reset is given.
 """
-from lazylawyer.database import database as db
+import argparse
+from lazylawyer.database import migrations
 
-def migrate_db():
-    db.create_tables(remove_old=True)
+def migrate_db(reset=False):
+    if reset:
+        migrations.reset()
+    migrations.migrate()
 
 if __name__ == '__main__':
-    migrate_db()
+    parser = argparse.ArgumentParser(description='Migrate database to the latest schema version.')
+    parser.add_argument('--reset', action='store_true', help='drop all tables and data before migrating')
+
+    args = parser.parse_args()
+    migrate_db(args.reset)
@@ -0,0 +1,19 @@
+"""This script publishes a consistent read-only snapshot of
+the database for the web app. It can run while crawling and
+extraction keep writing to the database. Serving processes
+open the snapshot as immutable, see app.py --snapshot.
+"""
+import argparse
+from lazylawyer import helpers
+from lazylawyer.database import database as db
+
+def publish_snapshot(path):
+    print('Publishing snapshot of {0} to {1}...'.format(db.db_path, path))
+    db.publish_snapshot(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish a read-only snapshot of the database.')
+    parser.add_argument('--path', default=helpers.setup_json['snapshot_path'], help='path of the snapshot file')
+
+    args = parser.parse_args()
+    publish_snapshot(args.path)
@@ -0,0 +1,12 @@
+"""This script rebuilds the full-text index over all stored
+document contents, e.g. for databases whose contents were
+written without updating the index.
+"""
+from lazylawyer.database import table_doc_contents
+
+def rebuild_fulltext_index():
+    print('Rebuilding full-text index...')
+    table_doc_contents.rebuild_fulltext_index()
+
+if __name__ == '__main__':
+    rebuild_fulltext_index()
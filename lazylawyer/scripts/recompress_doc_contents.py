@@ -0,0 +1,41 @@
+"""This script rewrites the stored document contents of an
+existing database with a different codec, e.g. to compress
+contents written by older versions. With --train_dict, a shared
+zstd dictionary is trained on a sample of the contents first.
+"""
+import argparse
+from lazylawyer.database import compression
+from lazylawyer.database import database as db
+from lazylawyer.database import table_doc_contents
+
+def recompress_doc_contents(codec, train_dict=False, num_samples=1000, vacuum=True, level=None):
+    if train_dict:
+        print('Training compression dictionary...')
+        samples = table_doc_contents.get_content_samples(num_samples)
+        dict_id = compression.train_dict(samples)
+        print('Stored dictionary {0}'.format(dict_id))
+
+    # contents moved to the content database are vacuumed there
+    schema = table_doc_contents.get_content_schema()
+    size_before = db.file_size(schema)
+    print('Recompressing contents...')
+    num_rows = table_doc_contents.recompress_doc_contents(codec, level=level)
+    print('Recompressed {0} documents'.format(num_rows))
+
+    if vacuum:
+        print('Vacuuming database...')
+        db.vacuum(schema)
+        size_after = db.file_size(schema)
+        print('Database size ({0}): {1:.1f} MB -> {2:.1f} MB'.format(schema, size_before / 1e6, size_after / 1e6))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompress stored document contents.')
+    parser.add_argument('codec', choices=compression.CODECS, help='codec to store contents with')
+    parser.add_argument('--train_dict', action='store_true', help='train a new zstd dictionary first')
+    parser.add_argument('--num_samples', type=int, default=1000, help='number of documents to train the dictionary on')
+    parser.add_argument('--level', type=int, default=None,
+        help='zstd level, e.g. 19 for smaller but much slower compression; content_zstd_level in setup.json by default')
+    parser.add_argument('--no_vacuum', action='store_true', help='do not shrink the database file afterwards')
+
+    args = parser.parse_args()
+    recompress_doc_contents(args.codec, args.train_dict, args.num_samples, not args.no_vacuum, args.level)
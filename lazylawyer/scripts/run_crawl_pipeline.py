@@ -10,7 +10,7 @@ def run_crawl_pipeline(num_cases=-1):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run whole crawling pipeline up to document content saving')
-    parser.add_argument('--num_cases', type=int, default=-1, help='only crawl a limited number of cases')
+    parser.add_argument('--num_cases', type=int, default=-1, help='only crawl a limited number of cases and their docs')
 
     args = parser.parse_args()
     run_crawl_pipeline(args.num_cases)
@@ -1,6 +1,6 @@
 import argparse
-from lazylawyer.database import table_docs
-from lazylawyer.content_generator import ContentGenerator
+from lazylawyer.database import table_doc_contents
+from lazylawyer.nlp.curia_preprocessor import preprocess
 from lazylawyer.nlp.helpers import get_embedding_doc_word2vec
 from lazylawyer.nlp.helpers import get_embedding_doc_lsi
 from lazylawyer import helpers
@@ -9,19 +9,25 @@ from itertools import chain
 import os
 import pickle
 
+def embed_docs(embed):
+    """Returns embeddings of all judgments computed with
+    embed(text). Documents sharing a content share its
+    embedding, which is only computed once.
+    """
+    embs = []
+    content_embs = {}
+    for doc, text in table_doc_contents.iter_docs_with_contents(['Judgment'], columns=['id', 'content_id']):
+        if doc['content_id'] not in content_embs:
+            content_embs[doc['content_id']] = embed(text)
+        embs.append({'doc_id': doc['id'], 'emb': content_embs[doc['content_id']]})
+    return embs
+
 def save_doc_embeddings_word2vec(file_name, model):
     """Saves document embeddings in a file
     using the provided word2vec or fasttext model.
     """
-    docs = table_docs.get_docs_with_names(['Judgment'])
-    content_gen = ContentGenerator(docs)
-
     helpers.create_folder_if_not_exists('saved_embeddings')
-    embs = []
-
-    for doc, content in zip(docs, content_gen):
-        emb = get_embedding_doc_word2vec(content, model, stopword_removal=True)
-        embs.append({'doc_id': doc['id'], 'emb': emb})
+    embs = embed_docs(lambda text: get_embedding_doc_word2vec(preprocess(text), model, stopword_removal=True))
 
     with open(os.path.join('saved_embeddings', file_name), 'wb') as f:
         pickle.dump(embs, f)
@@ -30,16 +36,8 @@ def save_doc_embeddings_doc2vec(file_name, model):
     """Saves document embeddings in a file
     using the provided doc2vec model.
     """
-    docs = table_docs.get_docs_with_names(['Judgment'])
-    content_gen = ContentGenerator(docs)
-    contents = [list(chain.from_iterable(content)) for content in content_gen]
-
     helpers.create_folder_if_not_exists('saved_embeddings')
-    embs = []
-
-    for doc, content in zip(docs, contents):
-        emb = model.infer_vector(content)
-        embs.append({'doc_id': doc['id'], 'emb': emb})
+    embs = embed_docs(lambda text: model.infer_vector(list(chain.from_iterable(preprocess(text)))))
 
     with open(os.path.join('saved_embeddings', file_name), 'wb') as f:
         pickle.dump(embs, f)
@@ -48,16 +46,9 @@ def save_doc_embeddings_lsi(file_name, model, dictionary, tfidf):
     """Saves document embeddings in a file
     using the provided lsi model.
     """
-    docs = table_docs.get_docs_with_names(['Judgment'])
-    content_gen = ContentGenerator(docs)
-    contents = [list(chain.from_iterable(content)) for content in content_gen]
-
     helpers.create_folder_if_not_exists('saved_embeddings')
-    embs = []
-
-    for doc, content in zip(docs, contents):
-        emb = get_embedding_doc_lsi(content, model, dictionary, tfidf)
-        embs.append({'doc_id': doc['id'], 'emb': emb})
+    embs = embed_docs(lambda text: get_embedding_doc_lsi(list(chain.from_iterable(preprocess(text))),
+        model, dictionary, tfidf))
 
     with open(os.path.join('saved_embeddings', file_name), 'wb') as f:
         pickle.dump(embs, f)
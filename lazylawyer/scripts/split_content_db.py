@@ -0,0 +1,42 @@
+"""This script moves the document contents out of the main
+database into the content database configured as
+content_db_path in setup.json. Afterwards, the main database
+only holds the small metadata tables, which makes scans over
+cases and docs faster. Embeddings which earlier versions stored
+in docs.embedding are moved to the embedding store.
+"""
+import argparse
+from lazylawyer.database import database as db
+from lazylawyer.database import embedding_store, migrations, table_docs
+
+def split_content_db(embeddings_model='legacy'):
+    """Moves the contents to the content database.
+    Input params:
+    embeddings_model: name in the embedding store under which
+    embeddings from docs.embedding are saved.
+    """
+    if 'content' not in db.manager.attached:
+        print('Set content_db_path in setup.json first.')
+        return
+    migrations.migrate()
+
+    doc_ids, embeddings = table_docs.get_legacy_embeddings()
+    if doc_ids:
+        print('Moving {0} embeddings to model {1} of the embedding store...'.format(len(doc_ids), embeddings_model))
+        embedding_store.write_embeddings(embeddings_model, doc_ids, embeddings)
+        table_docs.clear_legacy_embeddings()
+
+    print('Moving contents to {0}...'.format(db.manager.attached['content'][0]))
+    num_rows = migrations.split_content()
+    print('Moved {0} contents.'.format(num_rows))
+    if num_rows > 0:
+        print('Vacuuming {0}...'.format(db.db_path))
+        db.vacuum()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move document contents to the content database.')
+    parser.add_argument('--embeddings_model', default='legacy',
+        help='model name in the embedding store for embeddings stored in docs.embedding')
+
+    args = parser.parse_args()
+    split_content_db(args.embeddings_model)
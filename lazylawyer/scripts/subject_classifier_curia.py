@@ -1,7 +1,7 @@
 import argparse
 from itertools import chain
 from lazylawyer.content_generator import ContentGenerator
-from lazylawyer.database import table_cases, table_docs, table_doc_contents
+from lazylawyer.database import table_docs, table_doc_contents
 from lazylawyer import helpers
 import numpy as np
 import os
@@ -30,9 +30,8 @@ def generate_class_labels():
             labels = pickle.load(f)
     else:
         print("Generating class labels...")
-        docs = table_docs.get_docs_with_names(['Judgment'])
-        cases = [table_cases.get_case_for_doc(doc) for doc in docs]
-        Y = [case['subject'] for case in cases]
+        docs = table_docs.get_docs_with_cases(['Judgment'], columns=['id'], case_fields=['subject'])
+        Y = [doc['subject'] for doc in docs]
         setY = set(Y)
         labels = dict(zip(setY, range(len(setY))))
         with open(labels_path, 'wb') as f:
@@ -70,8 +69,7 @@ def train_nb(model_name, vectorizer_name, labels_dict, test_examples=5):
         pipeline = build_pipeline_multinomial_nb(vectorizer)
 
     print("Initializing database and loading features and labels...")
-    docs = table_docs.get_docs_with_names(['Judgment'])
-    cases = [table_cases.get_case_for_doc(doc) for doc in docs]
+    docs = table_docs.get_docs_with_cases(['Judgment'], columns=['id', 'content_id'], case_fields=['subject'])
 
     content_gen = ContentGenerator(docs)
     contents = list(content_gen) # generate all contents at once
@@ -79,7 +77,7 @@ def train_nb(model_name, vectorizer_name, labels_dict, test_examples=5):
 
     X_train = contents[:-test_examples]
 
-    Y = [case['subject'] for case in cases]
+    Y = [doc['subject'] for doc in docs]
     Y = [labels_dict.get(subject) for subject in Y]
     Y = [y for y in Y if y is not None] # filter out cases with nonexistent labels
     Y = np.asarray(Y)
@@ -99,8 +97,7 @@ def validate_model(test_examples=5):
     and true labels extracted from the database.
     """
     print("Initializing database and loading features and labels...")
-    docs = table_docs.get_docs_with_names(['Judgment'])
-    cases = [table_cases.get_case_for_doc(doc) for doc in docs]
+    docs = table_docs.get_docs_with_cases(['Judgment'], columns=['id', 'content_id'], case_fields=['subject'])
 
     content_gen = ContentGenerator(docs)
     contents = list(content_gen) # generate all contents at once
@@ -108,7 +105,7 @@ def validate_model(test_examples=5):
 
     X_test = contents[-test_examples:]
 
-    Y = [case['subject'] for case in cases]
+    Y = [doc['subject'] for doc in docs]
     Y = [labels_dict.get(subject) for subject in Y]
     Y = [y for y in Y if y is not None] # filter out cases with nonexistent labels
     Y = np.asarray(Y)
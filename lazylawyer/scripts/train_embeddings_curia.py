@@ -4,7 +4,7 @@
 # parties and keywords.
 
 import argparse
-from lazylawyer.database import table_docs, table_cases
+from lazylawyer.database import table_docs
 from lazylawyer.content_generator import ContentGenerator
 from lazylawyer import helpers
 from lazylawyer.nlp.curia_preprocessor import tokenize_and_process_metadata
@@ -18,7 +18,7 @@ import pickle
 
 def train_fasttext_curia(min_count, epoch_num, embedding_dim, learning_rate):
     print("Initializing database and loading documents...")
-    docs = table_docs.get_docs_with_names(['Judgment'])
+    docs = table_docs.get_docs_with_names(['Judgment'], columns=['content_id'])
 
     helpers.create_folder_if_not_exists('trained_models')
     model_path = os.path.join('trained_models', helpers.setup_json['fasttext_path'])
@@ -37,7 +37,7 @@ def train_fasttext_curia(min_count, epoch_num, embedding_dim, learning_rate):
 
 def train_word2vec_curia(min_count, epoch_num, embedding_dim, learning_rate):
     print("Initializing database and loading documents...")
-    docs = table_docs.get_docs_with_names(['Judgment'])
+    docs = table_docs.get_docs_with_names(['Judgment'], columns=['content_id'])
 
     helpers.create_folder_if_not_exists('trained_models')
     model_path = os.path.join('trained_models', helpers.setup_json['word2vec_path'])
@@ -56,7 +56,7 @@ def train_word2vec_curia(min_count, epoch_num, embedding_dim, learning_rate):
 
 def train_doc2vec_curia(min_count, epoch_num, embedding_dim, learning_rate):
     print("Initializing database and loading documents...")
-    docs = table_docs.get_docs_with_names(['Judgment'])
+    docs = table_docs.get_docs_with_names(['Judgment'], columns=['content_id'])
 
     helpers.create_folder_if_not_exists('trained_models')
     model_path = os.path.join('trained_models', helpers.setup_json['doc2vec_path'])
@@ -76,7 +76,7 @@ def train_doc2vec_curia(min_count, epoch_num, embedding_dim, learning_rate):
 
 def train_lsi_curia(embedding_dim):
     print("Initializing database and loading documents...")
-    docs = table_docs.get_docs_with_names(['Judgment'])
+    docs = table_docs.get_docs_with_names(['Judgment'], columns=['content_id'])
 
     helpers.create_folder_if_not_exists('trained_models')
     model_path = os.path.join('trained_models', helpers.setup_json['lsi_path'])
@@ -102,11 +102,11 @@ def train_lsi_curia(embedding_dim):
 
 def train_metadata_vocabulary_curia():
     print("Initializing database and loading documents...")
-    docs = table_docs.get_docs_with_names(['Judgment'])
-    cases = [table_cases.get_case_for_doc(doc) for doc in docs]
+    docs = table_docs.get_docs_with_cases(['Judgment'], columns=['keywords'],
+        case_fields=['party1', 'party2', 'subject'])
 
     keywords = [doc['keywords'] for doc in docs]
-    parties_subjects = [[case['party1'], case['party2'], case['subject']] for case in cases]
+    parties_subjects = [[doc['party1'], doc['party2'], doc['subject']] for doc in docs]
 
     helpers.create_folder_if_not_exists('trained_models')
     metadata_path = os.path.join('trained_models', helpers.setup_json['metadata_path'])
@@ -0,0 +1,14 @@
+from lazylawyer.database import database as db
+from lazylawyer.database import migrations
+import pytest
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Opens an empty database with all tables in a temporary
+    folder and reopens the configured database afterwards.
+    """
+    old_path = db.db_path
+    db.open_database(str(tmp_path / 'test.db'))
+    migrations.migrate()
+    yield db
+    db.open_database(old_path, attached=db.configured_attachments())
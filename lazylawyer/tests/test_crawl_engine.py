@@ -0,0 +1,153 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lazylawyer import helpers, http_client
+from lazylawyer.crawlers import crawl_engine, curia_cl_protocol, http_cache
+import lazylawyer.crawlers.helpers
+import pytest
+import threading
+import time
+
+ROW = """<tr class="table_document_ligne">
+    <td class="table_cell_doc">{name}
+    </td><td class="table_cell_date">01/02/2018</td>
+    <td class="table_cell_nom_usuel">Commission v Germany</td>
+    <td class="table_cell_aff"><span class="outputEcli">ECLI:EU:C:2018:{i}</span></td>
+    <td class="table_cell_aff">{eurlex}</td>
+    <td class="table_cell_links_eurlex">{curia}</td>
+    <td class="table_cell_links_curia"><span class="tooltipLink">Competition</span></td>
+    </tr>"""
+IMG = '<a href="{0}"><img title="View {1} documents"></a>'
+
+def _pages(base):
+    rows = [
+        # html page on curia which links to the document
+        ROW.format(i=0, name='Judgment', eurlex='', curia=IMG.format(base + '/page0', 'html')),
+        # broken html page, falls back to the pdf
+        ROW.format(i=1, name='Order', eurlex='', curia=IMG.format(base + '/missing', 'html') + IMG.format('pdf1', 'pdf')),
+        ROW.format(i=2, name='Opinion', eurlex=IMG.format('html2', 'html'), curia=''),
+    ]
+    return {
+        '/case': '<a id="mainForm:j_id56" href="{0}/docs">documents</a>'.format(base),
+        '/docs': '<table class="detail_table_documents"><tbody>{0}</tbody></table>'.format(''.join(rows)),
+        '/page0': '<a id="mainForm:j_id159" href="html0">document</a>',
+    }
+
+class _Handler(BaseHTTPRequestHandler):
+    pages = {}
+    in_flight = 0
+    max_in_flight = 0
+    num_requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            _Handler.num_requests += 1
+            _Handler.in_flight += 1
+            _Handler.max_in_flight = max(_Handler.max_in_flight, _Handler.in_flight)
+        time.sleep(0.03)
+        # the request is finished before the client gets the response,
+        # which may be followed by the next request right away
+        with self.lock:
+            _Handler.in_flight -= 1
+        etag = '"{0}"'.format(hash(self.pages.get(self.path)))
+        if self.path not in self.pages:
+            self.send_response(404)
+            body = b''
+        elif self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            body = b''
+        else:
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            body = self.pages[self.path].encode()
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'http_cache_dir', str(tmp_path / 'http_cache'))
+    monkeypatch.setitem(helpers.setup_json, 'http', dict(helpers.setup_json['http'],
+        host_limits={'default': {'rate': 1000, 'burst': 100, 'max_concurrency': 100}}))
+    monkeypatch.setattr(http_client, '_limiters', {})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    _Handler.pages = _pages(base)
+    yield base
+    server.shutdown()
+    server.server_close()
+
+def test_crawl_docs_async(server):
+    html = lazylawyer.crawlers.helpers.crawl(server + '/case')
+    expected = curia_cl_protocol.crawl_docs(html, ['html', 'pdf'])
+    assert [(doc['name'], doc['link'], doc['format'], doc['source']) for doc in expected] == [
+        ('Judgment', 'html0', 'html', 'curia'), ('Order', 'pdf1', 'pdf', 'curia'), ('Opinion', 'html2', 'html', 'eurlex')]
+
+    async def crawl_item(item, fetch):
+        return await curia_cl_protocol.crawl_docs_async(await fetch(server + '/case'), ['html', 'pdf'], fetch)
+    results = []
+    _Handler.max_in_flight = 0
+    crawl_engine.crawl(range(20), crawl_item, lambda item, docs: results.append((item, docs)), max_in_flight=4)
+
+    assert sorted(item for item, _ in results) == list(range(20))
+    assert all(docs == expected for _, docs in results)
+    assert 1 < _Handler.max_in_flight <= 4
+
+def test_items_off_event_loop():
+    # items are taken on another thread, so a blocking iterator,
+    # e.g. leasing from the database, does not stall the requests
+    threads = []
+    def items():
+        for i in range(10):
+            threads.append(threading.current_thread())
+            time.sleep(0.01)
+            yield i
+
+    async def crawl_item(item, fetch):
+        return item
+    results = []
+    crawl_engine.crawl(items(), crawl_item, lambda item, result: results.append(result), max_in_flight=4)
+    assert sorted(results) == list(range(10))
+    assert threading.main_thread() not in threads
+
+def test_http_cache(server):
+    http_cache.set_offline(True)
+    try:
+        with pytest.raises(http_cache.CacheMiss):
+            http_cache.get(server + '/case')
+    finally:
+        http_cache.set_offline(False)
+
+    _Handler.num_requests = 0
+    page = _Handler.pages['/case'].encode()
+    assert http_cache.get(server + '/case') == page
+    assert http_cache.get(server + '/case') == page # revalidated with If-None-Match
+    _Handler.pages['/case'] = 'changed'
+    assert http_cache.get(server + '/case') == b'changed'
+    assert _Handler.num_requests == 3
+
+    http_cache.set_offline(True)
+    try:
+        assert http_cache.get(server + '/case') == b'changed'
+    finally:
+        http_cache.set_offline(False)
+    assert _Handler.num_requests == 3
+
+def test_crawl_cases():
+    link = '<b><a href="javascript:window.open(\'https://curia.europa.eu/{0}\', \'case\');">{0}</a></b>'
+    index = '<html><body><div><a href="#">menu</a></div><table>' \
+        + '<tr><td>{0}</td><td><i>Commission v Italy</i></td></tr>'.format(link.format('C-1/18')) \
+        + '<tr><td>{0}</td><td><i>Dow v Commission <b>APPEAL : </b><a href="#">T-2/16</a></i></td></tr>'.format(
+            link.format('T-3/17')) \
+        + '<tr><td>header</td></tr></table></body></html>'
+    expected = ([
+        {'url': 'https://curia.europa.eu/C-1/18', 'name': 'C-1/18', 'desc': 'Commission v Italy', 'court': 'COJ'},
+        {'url': 'https://curia.europa.eu/T-3/17', 'name': 'T-3/17', 'desc': 'Dow v Commission APPEAL : T-2/16',
+            'court': 'GC'}],
+        [{'orig': 'T-3/17', 'appeal': 'T-2/16'}])
+    for parse_only in [None, curia_cl_protocol.CASES_STRAINER]:
+        assert curia_cl_protocol.crawl_cases(lazylawyer.crawlers.helpers.parse_html(index, parse_only)) == expected
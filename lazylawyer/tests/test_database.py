@@ -0,0 +1,459 @@
+import concurrent.futures
+from lazylawyer import helpers
+from lazylawyer.documents import download_policy
+from lazylawyer.database import compression, embedding_store, migrations, query_stats, table_cases, table_crawl_frontier, table_doc_contents, table_docs
+from lazylawyer.scripts.split_content_db import split_content_db
+import numpy as np
+import os
+import pickle
+import pytest
+import sqlite3
+import threading
+import time
+
+def _case(i):
+    return {'name': 'C-{0}/18'.format(i), 'desc': 'desc', 'url': 'url',
+        'protocol': 'protocol', 'court': 'COJ'}
+
+def test_journal_mode_wal(temp_db):
+    temp_db.cursor.execute('PRAGMA journal_mode')
+    assert temp_db.cursor.fetchone()[0] == 'wal'
+
+def test_concurrent_writes(temp_db):
+    def insert(i):
+        s = """INSERT INTO cases (name, desc, url, protocol) VALUES (?, ?, ?, ?)"""
+        temp_db.write(lambda connection: connection.execute(s, ('C-{0}/18'.format(i), '', '', '')))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        list(executor.map(insert, range(200)))
+
+    assert len(table_cases.get_all_cases()) == 200
+
+def test_failing_write_does_not_roll_back_others(temp_db):
+    table_cases.write_cases([_case(1)])
+    with pytest.raises(sqlite3.IntegrityError):
+        temp_db.write(lambda connection: connection.execute(
+            """INSERT INTO cases (name) VALUES ('C-2/18')"""))
+    assert len(table_cases.get_all_cases()) == 1
+
+def test_readers_do_not_block_on_writer(temp_db):
+    table_cases.write_cases([_case(1)])
+    in_transaction = threading.Event()
+    release = threading.Event()
+
+    def long_write(connection):
+        connection.execute("""UPDATE cases SET subject='x'""")
+        in_transaction.set()
+        release.wait(5)
+
+    future = temp_db.manager.submit(long_write)
+    assert in_transaction.wait(5)
+    # the uncommitted update is not visible, but reading does not block
+    assert table_cases.get_all_cases()[0]['subject'] is None
+    release.set()
+    future.result()
+    assert table_cases.get_all_cases()[0]['subject'] == 'x'
+
+def test_write_cases_is_idempotent(temp_db):
+    cases = [_case(i) for i in range(250)]
+    table_cases.write_cases(cases)
+    table_cases.write_cases(cases + [_case(1), _case(250)])
+    assert len(table_cases.get_all_cases()) == 251
+
+def test_write_docs_for_case_is_idempotent(temp_db):
+    case = _case(1)
+    table_cases.write_cases([case])
+    docs = [{'name': 'Judgment', 'link': 'a'}, {'name': 'Order', 'link': 'b'}]
+    table_docs.write_docs_for_case(case, [dict(d) for d in docs])
+    table_docs.write_docs_for_case(case, [dict(d) for d in docs])
+    case = table_cases.get_case_with_name(case['name'])
+    assert len(table_docs.get_docs_for_case(case)) == 2
+
+def test_migrate_removes_duplicates(temp_db):
+    migrations.reset()
+    migrations.migrate(target=1)
+    s = """INSERT INTO cases (name, desc, url, protocol) VALUES ('C-1/18', '', '', '')"""
+    temp_db.write(lambda connection: connection.executemany(s, [(), ()]))
+    # docs of a case which does not exist are left alone
+    s = """INSERT INTO docs (case_id, name) VALUES (?, 'Judgment')"""
+    temp_db.write(lambda connection: connection.executemany(s, [(2,), (99,)]))
+    # of duplicate docs, the one which was downloaded and extracted is kept
+    s = """INSERT INTO docs (id, case_id, name, download_error, content_id) VALUES (?, 1, 'Order', ?, ?)"""
+    temp_db.write(lambda connection: connection.executemany(s, [(10, None, None), (11, 0, 1), (12, 1, None)]))
+    s = """INSERT INTO doc_contents (id, content, doc_id) VALUES (1, 'The order.', 11)"""
+    temp_db.execute_write(s, ())
+    migrations.migrate()
+    assert migrations.get_version() == len(migrations.MIGRATIONS)
+    assert len(table_cases.get_all_cases()) == 1
+    temp_db.cursor.execute("""SELECT case_id FROM docs WHERE name='Judgment' ORDER BY case_id""")
+    assert temp_db.cursor.fetchall() == [(1,), (99,)]
+    temp_db.cursor.execute("""SELECT id, download_error, content_id FROM docs WHERE name='Order'""")
+    assert temp_db.cursor.fetchall() == [(11, 0, 1)]
+    temp_db.cursor.execute("""SELECT id, doc_id FROM doc_contents""")
+    assert temp_db.cursor.fetchall() == [(1, 11)]
+
+def test_lookups_use_indices(temp_db):
+    queries = ["""SELECT * FROM docs WHERE case_id=?""",
+        """SELECT * FROM docs WHERE name IN (?, ?)""",
+        """SELECT * FROM cases WHERE name=?""",
+        """SELECT * FROM doc_contents WHERE doc_id=?"""]
+    for s in queries:
+        temp_db.cursor.execute('EXPLAIN QUERY PLAN ' + s, (1,) * s.count('?'))
+        plan = ' '.join(row[-1] for row in temp_db.cursor.fetchall())
+        assert 'USING' in plan and 'INDEX' in plan
+
+def test_embedding_store(tmp_path, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'embeddings_dir', str(tmp_path))
+    embedding_store.write_embeddings('word2vec', [3, 1], [[3, 3], [1, 1]])
+    embedding_store.write_embeddings('word2vec', [2, 3], [[2, 2], [4, 4]])
+    embedding_store.write_embeddings('lsi', [5], [[5, 5, 5]])
+
+    doc_ids, embeddings = embedding_store.load_embeddings('word2vec')
+    assert isinstance(embeddings, np.memmap) and embeddings.dtype == np.float32
+    rows = embedding_store.get_rows(doc_ids, [3, 4, 1])
+    assert rows[1] == -1
+    assert embeddings[rows[0]].tolist() == [4, 4]
+    assert embeddings[rows[2]].tolist() == [1, 1]
+    assert embedding_store.load_embeddings('lsi')[1].shape == (1, 3)
+
+@pytest.mark.parametrize('codec', ['raw', 'zlib', 'lzma'])
+def test_doc_content_codecs(temp_db, monkeypatch, codec):
+    monkeypatch.setitem(helpers.setup_json, 'content_codec', codec)
+    case = _case(1)
+    table_cases.write_cases([case])
+    table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'a'}])
+    doc = table_docs.get_docs_with_names(['Judgment'], only_with_content=False)[0]
+
+    text = 'The Court hereby rules. ' * 100
+    table_doc_contents.write_doc_content(doc, text)
+    doc = table_docs.get_doc_with_id(doc['id'])[0]
+    assert table_doc_contents.get_doc_content(doc) == text
+
+    assert table_doc_contents.recompress_doc_contents('lzma' if codec != 'lzma' else 'raw') == 1
+    assert table_doc_contents.get_doc_content(doc) == text
+
+def test_doc_content_zstd_dict(temp_db, monkeypatch):
+    pytest.importorskip('zstandard')
+    monkeypatch.setitem(helpers.setup_json, 'content_codec', 'zstd')
+    case = _case(1)
+    table_cases.write_cases([case])
+    docs = [{'name': 'Judgment{0}'.format(i), 'link': 'a'} for i in range(50)]
+    table_docs.write_docs_for_case(case, docs)
+    case = table_cases.get_case_with_name(case['name'])
+    texts = ['Judgment of the Court in case {0}. The Court hereby rules. '.format(i) * 20 for i in range(50)]
+    for doc, text in zip(table_docs.get_docs_for_case(case), texts):
+        table_doc_contents.write_doc_content(doc, text)
+
+    assert compression.resolve_codec('zstd') == 'zstd'
+    dict_id = compression.train_dict(table_doc_contents.get_content_samples(50), dict_size=1024)
+    assert compression.resolve_codec('zstd') == 'zstd:{0}'.format(dict_id)
+    assert table_doc_contents.recompress_doc_contents('zstd', level=19) == 50
+    for doc, text in zip(table_docs.get_docs_for_case(case), texts):
+        assert table_doc_contents.get_doc_content(doc) == text
+
+def test_buffered_writer(temp_db):
+    cases = [_case(i) for i in range(10)]
+    table_cases.write_cases(cases)
+    cases = table_cases.get_all_cases()
+
+    with temp_db.BufferedWriter(flush_size=6, flush_interval=None) as writer:
+        for case in cases:
+            table_cases.update_subject(case, 'subject', writer)
+            table_cases.update_parties(case, 'party1', None, writer)
+        # 20 statements were added, so all but the last 2 were flushed
+        assert [case['subject'] for case in table_cases.get_all_cases()].count('subject') == 9
+
+    cases = table_cases.get_all_cases()
+    assert all(case['subject'] == 'subject' and case['party1'] == 'party1' for case in cases)
+
+def test_buffered_writer_flush_interval(temp_db):
+    table_cases.write_cases([_case(1)])
+    case = table_cases.get_all_cases()[0]
+    writer = temp_db.BufferedWriter(flush_interval=0.05)
+    table_cases.update_subject(case, 'subject', writer)
+    time.sleep(0.5)
+    assert table_cases.get_all_cases()[0]['subject'] == 'subject'
+
+    # a failed flush of the timer is raised by the next call
+    writer.execute("""UPDATE no_such_table SET x=1""", ())
+    time.sleep(0.5)
+    with pytest.raises(sqlite3.OperationalError):
+        writer.execute("""UPDATE cases SET subject=NULL""", ())
+    writer.flush()
+
+def test_column_projection(temp_db):
+    case = _case(1)
+    table_cases.write_cases([case])
+    table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'a'}])
+
+    docs = table_docs.get_docs_with_names(['Judgment'], only_with_content=False, columns=['id', 'content_id'])
+    assert docs[0].keys() == ('id', 'content_id')
+    assert docs[0]['id'] == docs[0].id and docs[0]['content_id'] is None
+    with pytest.raises(KeyError):
+        docs[0]['name']
+    with pytest.raises(ValueError):
+        table_cases.get_all_cases(columns=['id', 'name; DROP TABLE cases'])
+
+    case = table_cases.get_all_cases()[0]
+    assert dict(case)['name'] == 'C-1/18'
+
+def test_streaming_iterators(temp_db, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'content_codec', 'zlib')
+    cases = [_case(i) for i in range(5)]
+    table_cases.write_cases(cases)
+    for case in cases:
+        table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'a'}, {'name': 'Order', 'link': 'b'}])
+    docs = table_docs.get_docs_with_names(['Judgment'], only_with_content=False)
+    for doc in docs[:4]:
+        table_doc_contents.write_doc_content(doc, 'text {0}'.format(doc['id']))
+
+    assert len(list(table_cases.iter_all_cases(arraysize=2))) == 5
+    assert len(list(table_docs.iter_docs_with_names(['Judgment', 'Order'], only_with_content=False, arraysize=3))) == 10
+    assert len(list(table_docs.iter_docs_for_case(table_cases.get_all_cases()[0]))) == 2
+
+    # reads of the thread see writes made while iterating
+    for i, case in enumerate(table_cases.iter_all_cases(arraysize=2)):
+        table_cases.update_subject(case, 'subject')
+        assert table_cases.get_all_cases()[i]['subject'] == 'subject'
+
+    pairs = list(table_doc_contents.iter_docs_with_contents(['Judgment'], columns=['id', 'case_id'], arraysize=3))
+    assert [text for _, text in pairs] == ['text {0}'.format(doc['id']) for doc in docs[:4]]
+    assert pairs[0][0].keys() == ('id', 'case_id')
+
+    contents = table_doc_contents.get_doc_contents(table_docs.get_docs_with_names(['Judgment'], only_with_content=False), batch_size=3)
+    assert contents[:4] == [text for _, text in pairs] and contents[4] is None
+
+def test_get_docs_with_cases(temp_db):
+    cases = [_case(1), dict(_case(2), name='T-2/18', court='GC')]
+    table_cases.write_cases(cases)
+    for case in cases:
+        table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'a'}, {'name': 'Order', 'link': 'b'}])
+    table_cases.update_subject(table_cases.get_case_with_name('T-2/18'), 'Competition')
+
+    docs = table_docs.get_docs_with_cases(['Judgment'], only_with_content=False)
+    assert [doc['case_name'] for doc in docs] == ['C-1/18', 'T-2/18']
+    assert docs[1]['subject'] == 'Competition' and docs[1]['name'] == 'Judgment'
+
+    docs = table_docs.get_docs_with_cases(['Judgment', 'Order'], only_with_content=False,
+        courts=['GC'], columns=['id'], case_fields=['court'])
+    assert len(docs) == 2 and all(doc.keys() == ('id', 'court') and doc['court'] == 'GC' for doc in docs)
+
+def test_search_fulltext(temp_db, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'content_codec', 'zlib')
+    case = _case(1)
+    table_cases.write_cases([case])
+    table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'a'}, {'name': 'Order', 'link': 'b'}])
+    docs = table_cases.get_case_with_name(case['name'])
+    docs = table_docs.get_docs_for_case(docs)
+    table_doc_contents.write_doc_content(docs[0], 'The agreement infringes Article 101 TFEU.')
+    table_doc_contents.write_doc_content(docs[1], 'Article 102 TFEU and Article 101 of the Treaty.')
+
+    results = table_doc_contents.search_fulltext('"Article 101 TFEU"')
+    assert [r['doc_id'] for r in results] == [docs[0]['id']]
+    snippets = table_doc_contents.get_fulltext_snippets('"Article 101 TFEU"', [results[0]['content_id']])
+    assert '[Article 101 TFEU]' in snippets[results[0]['content_id']]
+
+    table_doc_contents.recompress_doc_contents('lzma')
+    temp_db.write(lambda connection: connection.execute("""DELETE FROM doc_contents_fts"""))
+    assert table_doc_contents.search_fulltext('treaty') == []
+    table_doc_contents.rebuild_fulltext_index()
+    results = table_doc_contents.search_fulltext('treaty "Article 101"')
+    assert [r['doc_id'] for r in results] == [docs[1]['id'], docs[0]['id']]
+
+def test_read_only_snapshot(temp_db, tmp_path):
+    table_cases.write_cases([_case(1)])
+    snapshot_path = str(tmp_path / 'snapshot.db')
+    temp_db.publish_snapshot(snapshot_path)
+    table_cases.write_cases([_case(2)])
+
+    temp_db.open_database(snapshot_path, immutable=True)
+    assert [case['name'] for case in table_cases.get_all_cases()] == ['C-1/18']
+    temp_db.cursor.execute('PRAGMA journal_mode')
+    assert temp_db.cursor.fetchone()[0] == 'delete'
+    with pytest.raises(sqlite3.OperationalError):
+        table_cases.write_cases([_case(3)])
+    with pytest.raises(sqlite3.OperationalError):
+        temp_db.cursor.execute("""DELETE FROM cases""")
+
+def test_split_content(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'content_codec', 'zlib')
+    case = _case(1)
+    table_cases.write_cases([case])
+    table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'a'}])
+    doc = table_docs.get_docs_for_case(table_cases.get_case_with_name(case['name']))[0]
+    table_doc_contents.write_doc_content(doc, 'The agreement infringes Article 101 TFEU.')
+
+    content_path = str(tmp_path / 'content.db')
+    attached = {'content': (content_path, temp_db.CONTENT_PRAGMAS)}
+    temp_db.open_database(temp_db.db_path, attached=attached)
+    assert table_doc_contents.get_content_schema() == 'main'
+    assert migrations.split_content() == 1
+    assert migrations.split_content() == 0
+    assert table_doc_contents.get_content_schema() == 'content'
+    assert temp_db.file_size('content') == os.path.getsize(content_path)
+    temp_db.cursor.execute("""SELECT name FROM main.sqlite_master WHERE name LIKE 'doc_contents%'""")
+    assert temp_db.cursor.fetchall() == []
+    temp_db.cursor.execute("""PRAGMA content.page_size""")
+    assert temp_db.cursor.fetchone()[0] == temp_db.CONTENT_PRAGMAS['page_size']
+
+    doc = table_docs.get_doc_with_id(doc['id'])[0]
+    assert table_doc_contents.get_doc_content(doc) == 'The agreement infringes Article 101 TFEU.'
+    assert [r['doc_id'] for r in table_doc_contents.search_fulltext('agreement')] == [doc['id']]
+
+    # snapshots contain the attached database as well
+    snapshot_path = str(tmp_path / 'snapshot.db')
+    temp_db.publish_snapshot(snapshot_path)
+    temp_db.open_database(snapshot_path, immutable=True, attached=temp_db.snapshot_attachments(snapshot_path))
+    assert table_doc_contents.get_doc_content(doc) == 'The agreement infringes Article 101 TFEU.'
+
+def test_split_content_db_from_version_0(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'embeddings_dir', str(tmp_path / 'embeddings'))
+    # database as created before the migrations, with plain text contents
+    # and pickled embeddings
+    migrations.reset()
+    temp_db.write(migrations._create_tables)
+    temp_db.execute_write("""INSERT INTO cases (id, name, desc, url, protocol) VALUES (1, 'C-1/18', '', '', '')""", ())
+    s = """INSERT INTO docs (id, case_id, name, content_id, embedding) VALUES (1, 1, 'Judgment', 1, ?)"""
+    temp_db.execute_write(s, (pickle.dumps(np.ones(3)),))
+    s = """INSERT INTO doc_contents (id, content, doc_id) VALUES (1, 'The agreement infringes Article 101.', 1)"""
+    temp_db.execute_write(s, ())
+    assert migrations.get_version() == 0
+
+    attached = {'content': (str(tmp_path / 'content.db'), temp_db.CONTENT_PRAGMAS)}
+    temp_db.open_database(temp_db.db_path, attached=attached)
+    split_content_db()
+    assert migrations.get_version() == len(migrations.MIGRATIONS)
+    doc = table_docs.get_doc_with_id(1)[0]
+    assert table_doc_contents.get_doc_content(doc) == 'The agreement infringes Article 101.'
+    assert [r['doc_id'] for r in table_doc_contents.search_fulltext('agreement')] == [1]
+    doc_ids, embeddings = embedding_store.load_embeddings('legacy')
+    assert doc_ids.tolist() == [1] and embeddings.tolist() == [[1, 1, 1]]
+    assert table_docs.get_legacy_embeddings() == ([], [])
+
+def test_query_stats(temp_db, tmp_path):
+    log_path = str(tmp_path / 'slow.log')
+    stats = query_stats.enable(slow_query_ms=0, slow_query_log=log_path, summary_at_exit=False)
+    try:
+        table_cases.write_cases([_case(i) for i in range(3)])
+        for i in range(3):
+            table_cases.get_case_with_name('C-{0}/18'.format(i))
+        assert len(list(table_cases.iter_all_cases(arraysize=2))) == 3
+    finally:
+        query_stats.disable()
+
+    entries = {sql.split(' WHERE ')[-1]: e for sql, e in stats.statements.items() if sql.startswith('SELECT')}
+    entry = entries['name=?']
+    assert entry.count == 3 and entry.rows == 3 and entry.max_time > 0
+    assert 'USING INDEX cases_name' in entry.plan
+    [entry] = [e for sql, e in stats.statements.items() if sql.startswith('INSERT INTO cases(')]
+    assert entry.sql.endswith('VALUES(...) ON CONFLICT(name) DO NOTHING')
+    assert entry.count == 1 and entry.rows == 3 and entry.wait > 0
+    assert 'FROM cases WHERE name=?' in stats.summary()
+    with open(log_path) as f:
+        assert "params=('C-0/18',)" in f.read()
+
+    table_cases.get_all_cases()
+    assert entries['name=?'].count == 3
+
+def test_content_dedup(temp_db, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'content_codec', 'zlib')
+    migrations.reset()
+    migrations.migrate(target=5)
+    case = _case(1)
+    table_cases.write_cases([case])
+    table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': 'a'}, {'name': 'Order', 'link': 'a'},
+        {'name': 'Opinion', 'link': 'b'}])
+    docs = table_docs.get_docs_for_case(table_cases.get_case_with_name(case['name']), columns=['id', 'content_id'])
+    s = """INSERT INTO doc_contents (content, doc_id, codec) VALUES (?, ?, ?)"""
+    temp_db.execute_write(s, (compression.compress('Judgment text', 'zlib'), docs[0]['id'], 'zlib'))
+    temp_db.execute_write("""UPDATE docs SET content_id=1 WHERE id=?""", (docs[0]['id'],))
+
+    # existing contents get their hash in the migration
+    migrations.migrate()
+    assert table_doc_contents.write_doc_content(docs[1], 'Judgment text')
+    assert docs[1]['content_id'] == 1
+    assert not table_doc_contents.write_doc_content(docs[2], 'Opinion text')
+    temp_db.cursor.execute("""SELECT COUNT(*) FROM doc_contents""")
+    assert temp_db.cursor.fetchone()[0] == 2
+
+    table_docs.update_file_hash(docs[0], 'abc')
+    assert table_docs.get_doc_with_file_hash('abc')['id'] == docs[0]['id']
+    assert table_docs.get_downloaded_doc_with_link('a') is None
+    table_docs.write_download_error(docs[0], 0)
+    assert table_docs.get_downloaded_doc_with_link('a')['case_name'] == case['name']
+
+def test_crawl_frontier(temp_db):
+    migrations.reset()
+    migrations.migrate(target=6)
+    table_cases.write_cases([_case(i) for i in range(10)])
+    table_docs.write_docs_for_case(_case(0), [{'name': 'Judgment', 'link': 'a'}])
+
+    # cases with docs are done after the migration
+    migrations.migrate()
+    assert table_crawl_frontier.get_counts() == {'pending': 9, 'leased': 0, 'done': 1, 'failed': 0}
+    table_crawl_frontier.add_cases(table_cases.get_all_cases())
+    assert table_crawl_frontier.get_counts()['done'] == 1
+
+    # concurrent workers never get the same case
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        leases = list(executor.map(lambda worker: table_crawl_frontier.lease(2, 60, 2, worker=worker),
+            ['w{0}'.format(i) for i in range(4)]))
+    leased = [case['id'] for cases in leases for case in cases]
+    assert len(leased) == len(set(leased)) == 8
+    assert table_crawl_frontier.release('w0') == 2
+
+    cases = table_crawl_frontier.lease(10, 60, 2, worker='w4')
+    assert len(cases) == 3
+    table_crawl_frontier.mark_done(cases[0])
+    table_crawl_frontier.mark_failed(cases[1], 'error', 2)
+    # the failed case is pending again, the lease of the third one expires
+    assert table_crawl_frontier.get_counts() == {'pending': 1, 'leased': 7, 'done': 2, 'failed': 0}
+    temp_db.execute_write("""UPDATE crawl_frontier SET lease_expires=0 WHERE case_id=?""", (cases[2]['id'],))
+    retried = table_crawl_frontier.lease(10, 60, 2, worker='w5')
+    assert [case['id'] for case in retried] == [cases[1]['id'], cases[2]['id']]
+
+    # cases which reached max_attempts fail when their lease expires
+    temp_db.execute_write("""UPDATE crawl_frontier SET lease_expires=0 WHERE worker='w5'""", ())
+    assert table_crawl_frontier.lease(10, 60, 2, worker='w6') == []
+    failed = table_crawl_frontier.get_failed_cases()
+    assert [(row['case_id'], row['attempts'], row['last_error']) for row in failed] == [
+        (cases[1]['id'], 2, 'lease of w5 expired'), (cases[2]['id'], 2, 'lease of w5 expired')]
+    assert table_crawl_frontier.retry_failed() == 2
+    assert table_crawl_frontier.get_counts() == {'pending': 2, 'leased': 6, 'done': 2, 'failed': 0}
+
+    # cases with pages skipped by the download policy can be crawled again,
+    # their docs which were not downloaded are stored anew
+    case = table_cases.get_case_with_name(_case(3)['name'])
+    table_docs.write_docs_for_case(_case(3), [{'name': 'Order', 'link': 'b'}, {'name': 'Judgment', 'link': 'c'}])
+    table_docs.write_download_error([doc for doc in table_docs.get_docs_for_case(case) if doc['name'] == 'Judgment'][0], 0)
+    table_crawl_frontier.mark_done(case, skipped_pages=1)
+    assert table_crawl_frontier.reopen_skipped() == 1
+    assert table_crawl_frontier.get_counts()['pending'] == 3
+    assert [doc['name'] for doc in table_docs.get_docs_for_case(case)] == ['Judgment']
+
+def test_download_policy(temp_db, monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'download_policy',
+        {'names': ['Judgment'], 'formats': ['pdf'], 'courts': ['COJ'], 'years': [2000, None]})
+    assert download_policy.case_year('C-12/98') == 1998
+    assert download_policy.case_year('T-1/05 P') == 2005
+    assert download_policy.allowed_formats(['html', 'pdf']) == ['pdf']
+    cases = [dict(_case(0), name='C-1/98'), _case(1), dict(_case(2), name='T-2/18', court='GC'), _case(3)]
+    table_cases.write_cases(cases)
+    for case, format in zip(cases, ['pdf', 'pdf', 'pdf', 'html']):
+        table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': case['name'], 'format': format},
+            {'name': 'Order', 'link': case['name'], 'format': 'pdf'}])
+
+    # only the pdf judgment of C-1/18 is allowed
+    docs = table_docs.get_pending_downloads(*download_policy.doc_condition())
+    assert [(doc['case_name'], doc['name'], doc['format']) for doc in docs] == [('C-1/18', 'Judgment', 'pdf')]
+    assert table_docs.count_pending_downloads() == 8
+
+    table_crawl_frontier.add_cases(table_cases.get_all_cases())
+    condition, params = download_policy.case_condition()
+    leased = table_crawl_frontier.lease(10, 60, 2, worker='w0', condition=condition, params=params)
+    assert [case['name'] for case in leased] == ['C-1/18', 'C-3/18']
+    # excluded cases stay pending for a wider policy
+    assert table_crawl_frontier.get_counts() == {'pending': 2, 'leased': 2, 'done': 0, 'failed': 0}
+    assert table_crawl_frontier.get_counts(condition, params)['pending'] == 0
+    assert not download_policy.allows_doc({'name': 'Order'})
+    assert download_policy.allows_doc({'name': 'Judgment'})
@@ -60,7 +60,7 @@ def test_crawling_pipeline():
     # downloading documents to extracting text and saving it in the
     # database. It asserts, if content for the documents named 'Judgment'
     # is available in the 'doc_contents' table.
-    lazylawyer.scripts.migrate_db.migrate_db()
+    lazylawyer.scripts.migrate_db.migrate_db(reset=True)
     lazylawyer.scripts.run_crawl_pipeline.run_crawl_pipeline(num_cases=1250)
     docs = lazylawyer.database.table_docs.get_docs_with_names(['Judgment'])
     doc_contents = [lazylawyer.database.table_doc_contents.get_doc_content(doc) for doc in docs]
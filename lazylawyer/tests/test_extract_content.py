@@ -0,0 +1,132 @@
+from lazylawyer import helpers
+from lazylawyer.database import table_cases, table_doc_contents, table_docs
+from lazylawyer.documents import doc_downloader, doc_renderer, doc_textextractor
+from lazylawyer.scripts.extract_content_curia import extract_content_curia, text_from_doc
+import os
+
+def _render(document_path, output_filename, resolution):
+    # the image contains the text of the pdf and the job directory
+    with open(document_path) as f:
+        text = f.read()
+    with open(output_filename, 'w') as f:
+        f.write(text + '|' + os.path.dirname(output_filename))
+
+def _ocr(file_path, threads=None):
+    with open(file_path) as f:
+        text, job_dir = f.read().split('|')
+    assert os.listdir(job_dir) == ['doc.tiff']
+    return '{0} ({1})'.format(text, job_dir)
+
+def test_extract_content(temp_db, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # the worker processes are forked and use the patched functions
+    monkeypatch.setattr(doc_renderer, 'render_doc', _render)
+    monkeypatch.setattr(doc_textextractor, 'extract_from_image', _ocr)
+    monkeypatch.setitem(helpers.setup_json, 'extraction', {'workers': 2, 'resolution': 300,
+        'work_dir': str(tmp_path), 'text_layer': None})
+    cases = [{'name': 'C-{0}/18'.format(i), 'desc': '', 'url': '', 'protocol': '', 'court': 'COJ'} for i in range(6)]
+    table_cases.write_cases(cases)
+    for i, case in enumerate(cases):
+        table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': str(i), 'format': 'pdf'}])
+    docs = table_docs.get_docs_with_cases(['Judgment'], only_with_content=False, case_fields=['case_name'])
+    for i, doc in enumerate(docs):
+        path = doc_downloader.doc_path(doc['case_name'], doc)
+        os.makedirs(path.parent)
+        # the last two documents have the same file
+        path.write_text('judgment {0}'.format(min(i, 4)))
+        table_docs.write_download_error(doc, 0)
+
+    extract_content_curia()
+    docs = table_docs.get_docs_with_cases(['Judgment'], case_fields=['case_name'])
+    texts = [table_doc_contents.get_doc_content(doc) for doc in docs]
+    assert [text.split(' (')[0] for text in texts] == ['judgment {0}'.format(min(i, 4)) for i in range(6)]
+    # every job had its own directory, which was removed
+    job_dirs = [text.split(' (')[1][:-1] for text in texts[:5]]
+    assert len(set(job_dirs)) == 5
+    assert not any(os.path.exists(job_dir) for job_dir in job_dirs)
+    assert docs[4]['content_id'] == docs[5]['content_id']
+
+def test_extract_content_reuses_run(temp_db, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(doc_renderer, 'render_doc', _render)
+    monkeypatch.setattr(doc_textextractor, 'extract_from_image', _ocr)
+    # the buffered file hashes of this run are not in the database yet
+    monkeypatch.setattr(table_docs, 'get_doc_with_file_hash', lambda file_hash: None)
+    monkeypatch.setitem(helpers.setup_json, 'extraction', {'workers': 1, 'resolution': 300,
+        'work_dir': str(tmp_path), 'text_layer': None})
+    cases = [{'name': 'C-{0}/18'.format(i), 'desc': '', 'url': '', 'protocol': '', 'court': 'COJ'} for i in range(6)]
+    table_cases.write_cases(cases)
+    for i, case in enumerate(cases):
+        table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': str(i), 'format': 'pdf'}])
+    docs = table_docs.get_docs_with_cases(['Judgment'], only_with_content=False, case_fields=['case_name'])
+    for i, doc in enumerate(docs):
+        path = doc_downloader.doc_path(doc['case_name'], doc)
+        os.makedirs(path.parent)
+        # the last document has the same file as the first one,
+        # whose job is finished before it is reached
+        path.write_text('judgment {0}'.format(i % 5))
+        table_docs.write_download_error(doc, 0)
+
+    extract_content_curia()
+    docs = table_docs.get_docs_with_cases(['Judgment'], case_fields=['case_name'])
+    assert len(set(doc['content_id'] for doc in docs)) == 5
+    assert docs[0]['content_id'] == docs[5]['content_id']
+
+def _failing_ocr(file_path, threads=None):
+    text = _ocr(file_path, threads)
+    if text.startswith('broken'):
+        raise RuntimeError('tesseract failed')
+    return text
+
+def test_extract_content_failures(temp_db, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(doc_renderer, 'render_doc', _render)
+    monkeypatch.setattr(doc_textextractor, 'extract_from_image', _failing_ocr)
+    monkeypatch.setitem(helpers.setup_json, 'extraction', {'workers': 2, 'resolution': 300,
+        'work_dir': str(tmp_path), 'text_layer': None})
+    cases = [{'name': 'C-{0}/18'.format(i), 'desc': '', 'url': '', 'protocol': '', 'court': 'COJ'} for i in range(4)]
+    table_cases.write_cases(cases)
+    for i, case in enumerate(cases):
+        # the last document has a format which cannot be extracted
+        table_docs.write_docs_for_case(case, [{'name': 'Judgment', 'link': str(i), 'format': 'pdf' if i < 3 else 'doc'}])
+    docs = table_docs.get_docs_with_cases(['Judgment'], only_with_content=False, case_fields=['case_name'])
+    for i, doc in enumerate(docs):
+        # the file of the first document was deleted after the download
+        if i > 0:
+            path = doc_downloader.doc_path(doc['case_name'], doc)
+            os.makedirs(path.parent)
+            path.write_text('broken' if i == 1 else 'judgment')
+        table_docs.write_download_error(doc, 0)
+
+    # failed documents do not stop the extraction of the others
+    extract_content_curia()
+    docs = table_docs.get_docs_with_cases(['Judgment'], only_with_content=False, case_fields=['case_name'])
+    assert [doc['content_id'] is not None for doc in docs] == [False, False, True, False]
+    out = capsys.readouterr().out
+    assert 'Extracted 1 documents' in out and '(2 failed, 1 in unsupported formats)' in out
+
+def test_text_layer_fast_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(doc_renderer, 'render_doc', _render)
+    monkeypatch.setattr(doc_textextractor, 'extract_from_image', _ocr)
+    layers = {1: 'In Case C-1/18, the Court gives the following judgment. ' * 20,
+        2: '', 3: '\ufffd\x03\ue000' * 300 + 'ok'}
+    monkeypatch.setattr(doc_textextractor, 'extract_from_text_layer',
+        lambda file_path, output_path: layers[int(os.path.basename(file_path)[0])])
+    text_layer = {'min_chars': 500, 'min_quality': 0.95}
+    assert doc_textextractor.text_layer_quality(layers[1]) == 1.0
+    assert doc_textextractor.text_layer_quality(layers[3]) < 0.01
+
+    paths = []
+    for i in [1, 2, 3]:
+        doc = {'id': i, 'format': 'pdf', 'case_name': 'C-1/18'}
+        path = doc_downloader.doc_path(doc['case_name'], doc)
+        os.makedirs(path.parent, exist_ok=True)
+        path.write_text('scan {0}'.format(i))
+        stats = {}
+        text = text_from_doc(doc, work_dir=str(tmp_path), text_layer=text_layer, stats=stats)
+        paths.append(stats['path'])
+        assert text.startswith('In Case') if i == 1 else text.startswith('scan')
+        assert 'text_layer' in stats and ('ocr' in stats) == (i != 1)
+    # scanned documents and broken text layers are OCRed
+    assert paths == ['text_layer', 'ocr', 'ocr']
@@ -0,0 +1,225 @@
+import concurrent.futures
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lazylawyer import helpers, http_client
+from lazylawyer.database import table_cases, table_docs
+from lazylawyer.host_limiter import HostLimiter
+from lazylawyer.scripts.download_docs_curia import download_docs_curia
+import pytest
+import requests
+import threading
+import time
+import tracemalloc
+
+class _Handler(BaseHTTPRequestHandler):
+    failures = {} # path -> number of 503 responses before success
+    capacity = None # concurrent requests served, more are rejected with 503
+    in_flight = 0
+    rejected = 0
+    lock = threading.Lock()
+    file = b''
+    etag = '"v1"'
+    cut_after = None # number of bytes of the file sent before the connection is dropped
+    requested_ranges = []
+
+    def do_GET(self):
+        if self.capacity is not None:
+            self._serve_with_capacity()
+            return
+        if self.path == '/file.pdf':
+            self._serve_file()
+            return
+        if self.failures.get(self.path, 0) > 0:
+            self.failures[self.path] -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = ('content of ' + self.path).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_with_capacity(self):
+        with self.lock:
+            overloaded = _Handler.in_flight >= self.capacity
+            if overloaded:
+                _Handler.rejected += 1
+            else:
+                _Handler.in_flight += 1
+        if overloaded:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        time.sleep(0.02)
+        with self.lock:
+            _Handler.in_flight -= 1
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def _serve_file(self):
+        # Range requests are served if If-Range matches the ETag
+        first = 0
+        range_header = self.headers.get('Range')
+        if range_header is not None and self.headers.get('If-Range') == self.etag:
+            first = int(range_header[len('bytes='):-1])
+            _Handler.requested_ranges.append(first)
+            if first >= len(self.file):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(len(self.file)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(first, len(self.file) - 1, len(self.file)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.file) - first))
+        self.end_headers()
+        if self.cut_after is not None:
+            self.wfile.write(memoryview(self.file)[first:self.cut_after])
+            _Handler.cut_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(memoryview(self.file)[first:])
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setitem(helpers.setup_json, 'http', dict(helpers.setup_json['http'], retries=2, backoff_factor=0.01,
+        host_limits={'default': {'rate': 1000, 'burst': 100, 'max_concurrency': 16}}))
+    monkeypatch.setattr(http_client, '_local', threading.local())
+    monkeypatch.setattr(http_client, '_limiters', {})
+    _Handler.capacity = None
+    http_client.reset_stats()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def test_retries_and_stats(server, tmp_path):
+    _Handler.failures = {'/flaky': 2, '/down': 3}
+    assert http_client.get(server + '/flaky').text == 'content of /flaky'
+    assert http_client.get(server + '/down').status_code == 503
+
+    file_hash = http_client.download(server + '/doc.pdf', tmp_path / 'doc.pdf')
+    assert file_hash == hashlib.sha256(b'content of /doc.pdf').hexdigest()
+    _Handler.failures = {'/missing.pdf': 3}
+    with pytest.raises(requests.HTTPError):
+        http_client.download(server + '/missing.pdf', tmp_path / 'missing.pdf')
+
+    [stats] = http_client.get_stats().values()
+    assert stats.requests == 4 and stats.retries == 6 and stats.errors == 2
+    assert stats.bytes == len('content of /flaky') + len('content of /doc.pdf')
+
+def test_token_bucket():
+    limiter = HostLimiter(rate=50, burst=1, max_concurrency=4)
+    start = time.monotonic()
+    for _ in range(11):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert time.monotonic() - start >= 0.19
+
+def test_adaptive_limits(server, monkeypatch):
+    def run(limits):
+        monkeypatch.setitem(helpers.setup_json['http'], 'host_limits', {'default': limits})
+        monkeypatch.setattr(http_client, '_limiters', {})
+        _Handler.capacity = 3
+        _Handler.in_flight = _Handler.rejected = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            responses = list(executor.map(lambda i: http_client.get(server + '/page'), range(200)))
+        return sum(response.status_code == 200 for response in responses), _Handler.rejected
+
+    fixed_ok, fixed_rejected = run({'rate': 1000, 'burst': 100, 'max_concurrency': 16,
+        'min_concurrency': 16, 'initial_concurrency': 16})
+    adaptive_ok, adaptive_rejected = run({'rate': 1000, 'burst': 100, 'max_concurrency': 16})
+    # the limit settles around the capacity of the server, so
+    # far fewer requests are rejected than with a fixed limit
+    assert adaptive_ok > fixed_ok
+    assert adaptive_rejected * 2 < fixed_rejected
+    [limits] = http_client.get_limits().values()
+    assert limits['decreases'] > 0 and 1 <= limits['limit'] <= 6
+    assert limits['in_flight'] == 0 and limits['queued'] == 0
+    assert 'limit' in http_client.limits_summary()
+
+def test_resumable_download(server, tmp_path):
+    _Handler.file = bytes(range(256)) * 16384 # 4 MB
+    _Handler.etag = '"v1"'
+    _Handler.requested_ranges = []
+    full_hash = hashlib.sha256(_Handler.file).hexdigest()
+    path = tmp_path / 'file.pdf'
+
+    # an interrupted download leaves only the partial file
+    _Handler.cut_after = 1000000
+    with pytest.raises(requests.RequestException):
+        http_client.download(server + '/file.pdf', path)
+    assert not path.exists()
+    part_size = (tmp_path / 'file.pdf.part').stat().st_size
+    assert 0 < part_size <= 1000000
+
+    # the rest is requested with a Range request
+    tracemalloc.start()
+    assert http_client.download(server + '/file.pdf', path, chunk_size=1 << 16) == full_hash
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert _Handler.requested_ranges == [part_size]
+    assert path.read_bytes() == _Handler.file
+    assert not (tmp_path / 'file.pdf.part').exists()
+    assert peak < 1000000
+
+    # a partial file of an older version of the file is replaced
+    (tmp_path / 'file.pdf.part').write_bytes(b'old')
+    (tmp_path / 'file.pdf.part.validator').write_text('"v0"')
+    assert http_client.download(server + '/file.pdf', path) == full_hash
+    assert _Handler.requested_ranges == [part_size]
+
+    # a partial file which is already complete is only renamed
+    (tmp_path / 'file.pdf.part').write_bytes(_Handler.file)
+    (tmp_path / 'file.pdf.part.validator').write_text('"v1"')
+    path.unlink()
+    assert http_client.download(server + '/file.pdf', path) == full_hash
+    assert _Handler.requested_ranges == [part_size, len(_Handler.file)]
+    assert path.read_bytes() == _Handler.file
+
+def test_download_stage(server, temp_db, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(helpers.setup_json, 'download_policy',
+        {'names': None, 'formats': None, 'courts': None, 'years': [None, None]})
+    _Handler.failures = {'/missing.pdf': 10}
+    cases = [{'name': 'C-{0}/18'.format(i), 'desc': '', 'url': '', 'protocol': '', 'court': 'COJ'} for i in range(2)]
+    table_cases.write_cases(cases)
+    table_docs.write_docs_for_case(cases[0], [
+        {'name': 'Judgment', 'link': server + '/a.pdf', 'format': 'pdf'},
+        {'name': 'Order', 'link': server + '/a.pdf', 'format': 'pdf'},
+        {'name': 'Opinion', 'link': server + '/missing.pdf', 'format': 'pdf'}])
+    table_docs.write_docs_for_case(cases[1], [{'name': 'Judgment', 'link': server + '/b.pdf', 'format': 'pdf'}])
+    assert len(table_docs.get_pending_downloads()) == 4
+
+    download_docs_curia(workers=4)
+    # every link is downloaded once
+    [stats] = http_client.get_stats().values()
+    assert stats.requests == 3
+    for doc in table_docs.get_docs_with_names(['Judgment', 'Order', 'Opinion'], only_valid=False, only_with_content=False):
+        path = doc['link'][len(server):]
+        if path == '/missing.pdf':
+            assert doc['download_error'] == 1
+        else:
+            assert doc['download_error'] == 0
+            assert doc['file_hash'] == hashlib.sha256(('content of ' + path).encode()).hexdigest()
+    assert table_docs.get_pending_downloads() == []
+
+    # after an interruption, complete files are not downloaded again
+    temp_db.execute_write("""UPDATE docs SET download_error=NULL, file_hash=NULL""", ())
+    temp_db.execute_write("""UPDATE docs SET link=? WHERE name='Opinion'""", (server + '/c.pdf',))
+    download_docs_curia(workers=4)
+    assert http_client.get_stats()[server[len('http://'):]].requests == 4
+    assert table_docs.get_pending_downloads() == []